@@ -1,20 +1,79 @@
 """
-The Flask class and Flask's Blueprint registration is placed
-in the catalog module's global scope.
+The catalog package builds the application with `create_app()`, which
+loads the settings, registers the Blueprints and sets up every module.
+
+Importing the package opens no database or Redis connection. Each process
+opens its own on first use, so an app created before a pre-fork server
+forks its workers (see wsgi.py) shares no connections with them.
 
 """
 
 from flask import Flask
+from catalog.login import http_client, provider_config, revocation
 from catalog.login.controller import bp_login
 from catalog.main.controller import bp_main
 from catalog.rlimiter.controller import bp_rlimit
+from catalog import (autocomplete, bulk_writer, catalog_snapshot,
+                     compression, connection_manager, db_setup, http_cache,
+                     page_cache, password_manager, redis_manager,
+                     session_store, static_files, template_cache,
+                     token_manager, transfer, upload_manager, user_service)
+from catalog.upload_manager import UploadRequest
+
+
+def create_app(config=None):
+    """Creates and sets up the catalog application.
+
+    Args:
+        config (dict): Settings overriding the defaults in `catalog.config`.
+
+    Returns:
+        :obj:`Flask`: The application object.
+    """
+
+    app = Flask(__name__)
+    app.config.from_object("catalog.config")
+    app.config.update(config or {})
+
+    if not app.secret_key:
+        app.secret_key = db_setup.secret_key
+
+    # Streams file uploads to disk instead of buffering them in memory
+    app.request_class = UploadRequest
+
+    app.register_blueprint(bp_login, url_prefix="/user")
+    app.register_blueprint(bp_main, url_prefix="/catalog")
+    app.register_blueprint(bp_rlimit, url_prefix="/rlimit")
+
+    connection_manager.init_app(app)
+    redis_manager.init_app(app)
+    upload_manager.init_app(app)
+    static_files.init_app(app)
+    password_manager.init_app(app)
+    http_client.init_app(app)
+    provider_config.init_app(app)
+    revocation.init_app(app)
+    token_manager.init_app(app)
+    session_store.init_app(app)
+    user_service.init_app(app)
+    page_cache.init_app(app)
+    catalog_snapshot.init_app(app)
+    autocomplete.init_app(app)
+    bulk_writer.init_app(app)
+    transfer.init_app(app)
+    template_cache.init_app(app)
+    http_cache.init_app(app)
+    compression.init_app(app)
+
+    return app
+
 
-app = Flask(__name__)
+def reset_after_fork():
+    """Drops the connections and locks a forked worker must not share.
 
-app.register_blueprint(bp_login, url_prefix="/user")
-app.register_blueprint(bp_main, url_prefix="/catalog")
-app.register_blueprint(bp_rlimit, url_prefix="/rlimit")
+    Processes notice a fork on their own, so this only makes the reset
+    explicit for servers that offer a post-fork hook.
+    """
 
-# For file upload feature
-app.config["UPLOAD_FOLDER"] = "catalog/static/uploads"
-app.config["MAX_CONTENT_LENGTH"] = 1 * 1024 * 1024  # Restrict file size to 1MB
+    connection_manager.reset()
+    redis_manager.reset()
@@ -0,0 +1,260 @@
+"""
+This module completes item and category names from in-memory indexes.
+
+There is an index of each user's names and one of the names in all public
+catalogs. An index is a sorted list of keys, each joining the lowercased
+name, the name and its kind with NUL characters, so a prefix query is a
+binary search and a scan of the matching keys that never touches the
+database. Records sharing a name share its key, and each record is mapped
+to its key so a change can find the name it replaces.
+
+A user's index is built from their catalog snapshot when first queried
+and tagged with its catalog version. `catalog_snapshot` passes the changes
+of each commit to `_apply()`, which updates an index tagged with the
+version just before in place. Any other index is rebuilt on its next
+query, as happens after another process changed the catalog. The public
+index is read from the database and reread every AUTOCOMPLETE_PUBLIC_TTL
+seconds, which picks up the changes of other processes and privacy
+settings. Changes committed in this process reach it at once.
+
+"""
+
+import threading
+from bisect import bisect_left, insort
+from catalog import catalog_snapshot, page_cache
+from catalog.cache import LRUCache, MISSING
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Category, Item, User
+
+# Autocomplete settings, replaced by `init_app()`
+settings = {"limit": 10, "public_ttl": 60}
+
+indexes = LRUCache(maxsize=256)
+public = LRUCache(maxsize=1)
+
+# Kinds of names
+ITEM, CATEGORY = "item", "category"
+
+# Sorts before any character, so shorter names come first
+SEPARATOR = u"\x00"
+
+_public_lock = threading.Lock()
+
+
+def _item(item_id):
+    return "i{}".format(item_id)
+
+
+def _category(category_id):
+    return "c{}".format(category_id)
+
+
+class PrefixIndex(object):
+    """Sorted set of names that answers prefix queries.
+
+    Args:
+        version (int): Catalog version of a user's index.
+
+    Attributes:
+        version (int): Catalog version the index reflects.
+        users (set): IDs of the users whose names are in the public index.
+    """
+
+    def __init__(self, version=None):
+        self.version = version
+        self.users = set()
+        self._keys = []
+        self._counts = {}
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def load(self, entries):
+        """Fills an empty index, sorting once.
+
+        Args:
+            entries: (record, name, kind) tuples, where record is a string
+                unique to the record, like "i12" for item 12.
+        """
+
+        for record, name, kind in entries:
+            key = SEPARATOR.join((name.lower(), name, kind))
+            self._records[record] = key
+            self._counts[key] = self._counts.get(key, 0) + 1
+        self._keys = sorted(self._counts)
+
+    def add(self, record, name, kind):
+        """Adds a record's name, replacing the name it had."""
+
+        key = SEPARATOR.join((name.lower(), name, kind))
+        with self._lock:
+            old_key = self._records.get(record)
+            if old_key == key:
+                return
+            if old_key is not None:
+                self._drop(old_key)
+
+            self._records[record] = key
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+            if not count:
+                insort(self._keys, key)
+
+    def remove(self, record):
+        """Removes a record's name, if it is in the index."""
+
+        with self._lock:
+            key = self._records.pop(record, None)
+            if key is not None:
+                self._drop(key)
+
+    def _drop(self, key):
+        count = self._counts.pop(key) - 1
+        if count:
+            self._counts[key] = count
+        else:
+            del self._keys[bisect_left(self._keys, key)]
+
+    def search(self, prefix, kind=None, limit=10):
+        """Returns names starting with a prefix, ignoring case.
+
+        Args:
+            prefix (unicode): Start of the names.
+            kind (str): ITEM or CATEGORY, to return one kind of name.
+            limit (int): Largest number of names returned.
+
+        Returns:
+            list: Dicts with the "name" and "kind", ordered by name.
+        """
+
+        prefix = prefix.lower()
+        matches = []
+
+        with self._lock:
+            keys = self._keys
+            position = bisect_left(keys, prefix)
+            while position < len(keys) and len(matches) < limit:
+                key = keys[position]
+                if not key.startswith(prefix):
+                    break
+                name, key_kind = key.split(SEPARATOR)[1:]
+                if kind is None or key_kind == kind:
+                    matches.append({"name": name, "kind": key_kind})
+                position += 1
+
+        return matches
+
+
+def _snapshot_entries(snapshot):
+    for category in snapshot["c"]:
+        yield _category(category[0]), category[1], CATEGORY
+    for rows in snapshot["i"].values():
+        for row in rows:
+            yield (_item(row[catalog_snapshot.ITEM_ID]),
+                   row[catalog_snapshot.ITEM_NAME], ITEM)
+
+
+def user_index(user_id):
+    """Returns the index of a user's names, building it if needed.
+
+    Args:
+        user_id (int): Owner of the catalog, who must exist.
+    """
+
+    version, shared = page_cache.current_version(user_id)
+    index = indexes.get(user_id)
+    if index is not MISSING and index.version == version:
+        return index
+
+    snapshot = catalog_snapshot.get(user_id)
+    index = PrefixIndex(snapshot["v"])
+    index.load(_snapshot_entries(snapshot))
+    indexes.set(user_id, index, page_cache.cache_ttl(shared, None))
+    return index
+
+
+def _public_entries(db_session, index):
+    users = db_session.query(User.id).filter(User.public.is_(True))
+    index.users.update(user.id for user in users)
+
+    categories = (db_session.query(Category.id, Category.name)
+                  .join(User, User.id == Category.user_id)
+                  .filter(User.public.is_(True)).yield_per(1000))
+    for category in categories:
+        yield _category(category.id), category.name, CATEGORY
+
+    items = (db_session.query(Item.id, Item.name)
+             .join(User, User.id == Item.user_id)
+             .filter(User.public.is_(True)).yield_per(1000))
+    for item in items:
+        yield _item(item.id), item.name, ITEM
+
+
+def public_index():
+    """Returns the index of the names in public catalogs."""
+
+    index = public.get("public")
+    if index is not MISSING:
+        return index
+
+    # One request reads the database, the others wait for its index
+    with _public_lock:
+        index = public.get("public")
+        if index is MISSING:
+            index = PrefixIndex()
+            db_session = session_factory()
+            try:
+                index.load(_public_entries(db_session, index))
+            finally:
+                db_session.close()
+            public.set("public", index, settings["public_ttl"])
+    return index
+
+
+def _apply_changes(index, changes):
+    for change in changes:
+        kind = change[0]
+        if kind == "item":
+            row = change[2]
+            index.add(_item(row[catalog_snapshot.ITEM_ID]),
+                      row[catalog_snapshot.ITEM_NAME], ITEM)
+        elif kind == "item_deleted":
+            index.remove(_item(change[1]))
+        elif kind == "category":
+            index.add(_category(change[1]), change[2], CATEGORY)
+        elif kind == "category_deleted":
+            index.remove(_category(change[1]))
+
+
+def _apply(user_id, version, changes):
+    # Called by `catalog_snapshot` after each commit
+    index = indexes.get(user_id)
+    if index is not MISSING:
+        if index.version == version - 1:
+            _apply_changes(index, changes)
+            index.version = version
+        else:
+            indexes.delete(user_id)
+
+    index = public.get("public")
+    if index is not MISSING and user_id in index.users:
+        _apply_changes(index, changes)
+
+
+catalog_snapshot.change_handlers.append(_apply)
+
+
+def init_app(app):
+    """Applies the AUTOCOMPLETE_* settings of an app.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    config = app.config
+    settings["limit"] = config["AUTOCOMPLETE_LIMIT"]
+    settings["public_ttl"] = config["AUTOCOMPLETE_PUBLIC_TTL"]
+    indexes.maxsize = config["AUTOCOMPLETE_CACHE_SIZE"]
+    public.clear()
@@ -0,0 +1,111 @@
+"""
+This module contains a small background worker for deferred jobs.
+
+Request handlers hand work to a `BatchWorker` with `put()` and return right
+away. The worker thread drains its queue in batches and can also run a
+periodic task between batches. Threads are started lazily in the process
+that uses them, so workers forked from a preloaded parent start their own.
+
+"""
+
+import logging
+import os
+import threading
+import time
+from Queue import Empty, Queue
+
+log = logging.getLogger(__name__)
+
+
+class BatchWorker(object):
+    """Daemon thread that processes queued jobs in batches.
+
+    Args:
+        name (str): Thread name, shown in logs.
+        handler (callable): Called with a list of queued jobs.
+        batch_size (int): Most jobs handed to `handler` at once.
+        linger (float): Seconds to wait for more jobs to fill a batch.
+        periodic (callable): Optional task run every `period` seconds.
+        period (float): Seconds between `periodic` runs. 0 disables it.
+    """
+
+    def __init__(self, name, handler, batch_size=50, linger=0.5,
+                 periodic=None, period=0):
+        self.name = name
+        self.handler = handler
+        self.batch_size = batch_size
+        self.linger = linger
+        self.periodic = periodic
+        self.period = period
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+
+    def start(self):
+        """Starts the worker thread if it is not running in this process."""
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            self._queue = Queue()
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._run, name=self.name)
+            thread.daemon = True
+            thread.start()
+
+    def put(self, job):
+        """Queues a job for the next batch.
+
+        Args:
+            job: Any value understood by the worker's handler.
+        """
+
+        self.start()
+        self._queue.put(job)
+
+    def _next_batch(self, timeout):
+        """Blocks for the first job, then collects more for `linger`."""
+
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except Empty:
+            return []
+
+        deadline = time.time() + self.linger
+
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        next_periodic = time.time() + self.period
+
+        while True:
+            timeout = None
+            if self.periodic is not None and self.period > 0:
+                timeout = max(next_periodic - time.time(), 0.01)
+
+            batch = self._next_batch(timeout)
+
+            if batch:
+                try:
+                    self.handler(batch)
+                except Exception:
+                    log.exception("%s: batch of %d failed", self.name,
+                                  len(batch))
+
+            if (self.periodic is not None and self.period > 0 and
+                    time.time() >= next_periodic):
+                try:
+                    self.periodic()
+                except Exception:
+                    log.exception("%s: periodic task failed", self.name)
+                next_periodic = time.time() + self.period
@@ -0,0 +1,536 @@
+"""
+This module applies batches of item and category writes for the JSON API.
+
+A batch holds lists of creates, updates and deletes for one user. Every
+record is checked in a single pass against state read with a few
+set-based queries: the user's categories, the records named by ID and the
+records holding any name the batch uses. Valid records are then written
+with one executemany per kind of write, in the caller's transaction,
+together with their item counts, snapshot changes and change log
+entries. Each record gets its own result, so a bad record does not stop
+the rest unless the batch is atomic.
+
+Deletes are applied first, then updates, then creates, so a batch can
+free a name and reuse it. The items of deleted categories move to the
+user's "Unsorted" category, which is created if the user has none and
+can itself be neither renamed nor deleted.
+
+"""
+
+from collections import namedtuple
+from sqlalchemy import bindparam
+from werkzeug.utils import secure_filename
+from catalog import catalog_snapshot, change_log, item_counts
+from catalog.db_setup import Category, Item
+
+# Bulk write settings, replaced by `init_app()`
+settings = {"max_records": 5000}
+
+# SQLite allows 999 bound parameters in a statement
+CHUNK_SIZE = 500
+
+# Category that receives the items of deleted categories
+UNSORTED = "Unsorted"
+
+DEFAULT_DESCRIPTION = Item.__table__.c.description.default.arg
+
+ITEM_COLUMNS = (Item.id, Item.name, Item.description, Item.image_file,
+                Item.image_url, Item.create_date, Item.category_id,
+                Item.category_name, Item.user_id)
+ItemRow = namedtuple("ItemRow", [column.key for column in ITEM_COLUMNS])
+
+CATEGORY_COLUMNS = (Category.id, Category.name, Category.user_id)
+CategoryRow = namedtuple("CategoryRow",
+                         [column.key for column in CATEGORY_COLUMNS])
+
+
+class BulkError(Exception):
+    """Raised for a request body that is not a valid batch."""
+
+
+def parse(payload):
+    """Checks the shape of a batch.
+
+    Args:
+        payload: The decoded JSON body, an object with optional "create",
+            "update" and "delete" lists.
+
+    Returns:
+        tuple: The create, update and delete lists.
+    """
+
+    if not isinstance(payload, dict):
+        raise BulkError("The body must be a JSON object.")
+
+    batch = []
+    for key in ("create", "update", "delete"):
+        records = payload.get(key, [])
+        if not isinstance(records, list):
+            raise BulkError("{} must be a list.".format(key.capitalize()))
+        batch.append(records)
+
+    if sum(len(records) for records in batch) > settings["max_records"]:
+        raise BulkError("At most {} records are allowed per request."
+                        .format(settings["max_records"]))
+    return tuple(batch)
+
+
+def unsorted_category(db_session, user_id):
+    """Returns a user's "Unsorted" category, creating it if missing.
+
+    Every account gets one at signup, but older or hand-edited ones may
+    not have it, and the items of a deleted category need a place.
+
+    Args:
+        db_session (:obj:`Session`): The session that owns the change.
+        user_id (int): Owner of the category.
+    """
+
+    category = (db_session.query(Category)
+                .filter_by(user_id=user_id, name=UNSORTED).first())
+    if category is None:
+        category = Category(name=UNSORTED, user_id=user_id)
+        db_session.add(category)
+        catalog_snapshot.category_saved(db_session, category)
+        change_log.category_changed(db_session, category, change_log.CREATE)
+    return category
+
+
+def _chunks(values):
+    values = list(values)
+    for start in xrange(0, len(values), CHUNK_SIZE):
+        yield values[start:start + CHUNK_SIZE]
+
+
+def _select_in(db_session, model, columns, user_id, column, values):
+    # One query per chunk of values, whatever the size of the catalog
+    rows = []
+    for chunk in _chunks(values):
+        rows.extend(db_session.query(*columns)
+                    .filter(model.user_id == user_id, column.in_(chunk))
+                    .all())
+    return rows
+
+
+def _record_id(record):
+    value = record.get("id")
+    if isinstance(value, bool) or not isinstance(value, (int, long)):
+        return None
+    return value
+
+
+def _text_error(record, field, size, required=False, empty=False):
+    # Returns the problem with a text field, None when it is fine
+    value = record.get(field)
+    if value is None:
+        return "Missing {}.".format(field) if required else None
+    if not isinstance(value, basestring) or (value == "" and not empty):
+        return "Invalid {}.".format(field)
+    if len(value) > size:
+        return "The {} is longer than {} characters.".format(field, size)
+    return None
+
+
+def _image_error(record, image_url):
+    # Only callers that put the files in place may name image files
+    if "image_file" not in record:
+        return None
+    if image_url is None:
+        return "Image files cannot be set here."
+    value = record["image_file"]
+    if value is None:
+        return None
+    if (not isinstance(value, basestring) or value == "" or
+            value != secure_filename(value) or len(value) > 250):
+        return "Invalid image_file."
+    return None
+
+
+def _image_values(record, user_id, image_url):
+    # Image file and URL of a record that names an image file
+    image_file = record["image_file"]
+    if image_file is None:
+        return None, None
+    return image_file, image_url(user_id, image_file)
+
+
+def _result(op, index, status, record_id=None, error=None):
+    result = {"op": op, "index": index, "status": status}
+    if record_id is not None:
+        result["id"] = record_id
+    if error is not None:
+        result["error"] = error
+    return result
+
+
+def _target_error(record, rows, done):
+    # Checks the ID of an update or delete against the loaded rows
+    record_id = _record_id(record)
+    if record_id is None:
+        return "Missing or invalid id."
+    if record_id not in rows:
+        return "Record not found."
+    if record_id in done:
+        return "Record listed twice."
+    return None
+
+
+def _names(records):
+    return set(record["name"] for record in records
+               if isinstance(record, dict) and
+               isinstance(record.get("name"), basestring))
+
+
+def _ids(records):
+    return set(_record_id(record) for record in records
+               if isinstance(record, dict)) - set([None])
+
+
+def _finish(results, atomic):
+    # Atomic batches with a bad record write nothing
+    failed = any(result["status"] == "error" for result in results)
+    if atomic and failed:
+        for result in results:
+            if result["status"] != "error":
+                result["status"] = "skipped"
+                result.pop("id", None)
+        return False
+    return True
+
+
+def write_items(db_session, user_id, creates, updates, deletes,
+                atomic=False, image_url=None):
+    """Applies a batch of item writes in the current transaction.
+
+    Create records have a "name" and optionally a "description" and a
+    "category", "Unsorted" by default. Update records have the item "id"
+    and any of those fields. Delete records have the item "id". Uploads
+    are left to the form handlers, but importers that place image files
+    themselves can pass `image_url` and name the files in "image_file".
+
+    Args:
+        db_session (:obj:`Session`): The session that owns the changes.
+        user_id (int): Owner of the items.
+        creates (list): Records of new items.
+        updates (list): Records of changed items.
+        deletes (list): Records of deleted items.
+        atomic (bool): Writes nothing if any record is invalid.
+        image_url (function): Returns the URL of an image file from the
+            user ID and the file name.
+
+    Returns:
+        tuple: The result of each record, in create, update, delete order,
+        and the rows of the deleted items, whose image files the caller
+        removes after the commit.
+    """
+
+    existing = dict((row.id, ItemRow(*row)) for row in _select_in(
+        db_session, Item, ITEM_COLUMNS, user_id, Item.id,
+        _ids(updates + deletes)))
+    taken = dict((row.name, row.id) for row in _select_in(
+        db_session, Item, (Item.id, Item.name), user_id, Item.name,
+        _names(creates + updates)))
+    categories = dict(db_session.query(Category.name, Category.id)
+                      .filter(Category.user_id == user_id))
+
+    done = set()
+    deleted, updated, created = [], [], []
+    create_results, update_results, delete_results = [], [], []
+
+    for index, record in enumerate(deletes):
+        error = (_target_error(record, existing, done)
+                 if isinstance(record, dict) else "Not an object.")
+        if error is not None:
+            delete_results.append(_result("delete", index, "error",
+                                          error=error))
+            continue
+
+        row = existing[record["id"]]
+        done.add(row.id)
+        if taken.get(row.name) == row.id:
+            del taken[row.name]
+        deleted.append(row)
+        delete_results.append(_result("delete", index, "deleted", row.id))
+
+    for index, record in enumerate(updates):
+        error = (_target_error(record, existing, done) or
+                 _text_error(record, "name", 80) or
+                 _text_error(record, "description", 250, empty=True) or
+                 _text_error(record, "category", 80) or
+                 _image_error(record, image_url)
+                 if isinstance(record, dict) else "Not an object.")
+        if error is None and record.get("category") is not None:
+            if record["category"] not in categories:
+                error = "Unknown category."
+        if error is None:
+            row = existing[record["id"]]
+            name = record.get("name") or row.name
+            if taken.get(name, row.id) != row.id:
+                error = "An item with that name already exists."
+        if error is not None:
+            update_results.append(_result("update", index, "error",
+                                          error=error))
+            continue
+
+        done.add(row.id)
+        if taken.get(row.name) == row.id:
+            del taken[row.name]
+        taken[name] = row.id
+        if "image_file" in record:
+            image_file, url = _image_values(record, user_id, image_url)
+            row = row._replace(image_file=image_file, image_url=url)
+        description = record.get("description")
+        category_name = record.get("category") or row.category_name
+        updated.append(row._replace(
+            name=name,
+            description=(row.description if description is None
+                         else description),
+            category_id=categories.get(category_name, row.category_id),
+            category_name=category_name))
+        update_results.append(_result("update", index, "updated", row.id))
+
+    for index, record in enumerate(creates):
+        error = (_text_error(record, "name", 80, required=True) or
+                 _text_error(record, "description", 250, empty=True) or
+                 _text_error(record, "category", 80) or
+                 _image_error(record, image_url)
+                 if isinstance(record, dict) else "Not an object.")
+        if error is None:
+            if record.get("category", UNSORTED) not in categories:
+                error = "Unknown category."
+            elif record["name"] in taken:
+                error = "An item with that name already exists."
+        if error is not None:
+            create_results.append(_result("create", index, "error",
+                                          error=error))
+            continue
+
+        taken[record["name"]] = None
+        image_file = url = None
+        if "image_file" in record:
+            image_file, url = _image_values(record, user_id, image_url)
+        description = record.get("description")
+        created.append({
+            "name": record["name"],
+            "description": (DEFAULT_DESCRIPTION if description is None
+                            else description),
+            "image_file": image_file,
+            "image_url": url,
+            "category_id": categories[record.get("category", UNSORTED)],
+            "user_id": user_id
+        })
+        create_results.append(_result("create", index, "created"))
+
+    results = create_results + update_results + delete_results
+    if not _finish(results, atomic):
+        return results, []
+
+    table = Item.__table__
+    if deleted:
+        db_session.execute(
+            table.delete().where(table.c.id == bindparam("b_id")),
+            [{"b_id": row.id} for row in deleted])
+    if updated:
+        db_session.execute(
+            table.update().where(table.c.id == bindparam("b_id"))
+            .values(name=bindparam("b_name"),
+                    description=bindparam("b_description"),
+                    image_file=bindparam("b_image_file"),
+                    image_url=bindparam("b_image_url"),
+                    category_id=bindparam("b_category_id")),
+            [{"b_id": row.id, "b_name": row.name,
+              "b_description": row.description,
+              "b_image_file": row.image_file,
+              "b_image_url": row.image_url,
+              "b_category_id": row.category_id} for row in updated])
+    if created:
+        db_session.execute(table.insert(), created)
+
+        # Names are unique per user, so they lead back to the new IDs
+        new_rows = dict((row.name, ItemRow(*row)) for row in _select_in(
+            db_session, Item, ITEM_COLUMNS, user_id, Item.name,
+            [values["name"] for values in created]))
+        created = [new_rows[values["name"]] for values in created]
+        for result, row in zip([result for result in create_results
+                                if result["status"] == "created"], created):
+            result["id"] = row.id
+
+    counts = item_counts.Changes()
+    for row in deleted:
+        counts.removed(user_id, row.category_id)
+    for row in updated:
+        counts.moved(existing[row.id].category_id, row.category_id)
+    for row in created:
+        counts.added(user_id, row.category_id)
+    counts.apply(db_session)
+
+    catalog_snapshot.items_deleted(db_session, user_id,
+                                   [row.id for row in deleted])
+    catalog_snapshot.items_saved(db_session, user_id, updated + created)
+    change_log.record_many(
+        db_session,
+        [change_log.item_entry(row, change_log.DELETE) for row in deleted] +
+        [change_log.item_entry(row, change_log.UPDATE) for row in updated] +
+        [change_log.item_entry(row, change_log.CREATE) for row in created])
+
+    return results, deleted
+
+
+def write_categories(db_session, user_id, creates, updates, deletes,
+                     atomic=False):
+    """Applies a batch of category writes in the current transaction.
+
+    Create records have a "name", update records the category "id" and
+    its new "name" and delete records the category "id". Items follow a
+    renamed category, and deleting a category moves its items to
+    "Unsorted", which is created if missing and cannot be renamed or
+    deleted.
+
+    Args:
+        db_session (:obj:`Session`): The session that owns the changes.
+        user_id (int): Owner of the categories.
+        creates (list): Records of new categories.
+        updates (list): Records of renamed categories.
+        deletes (list): Records of deleted categories.
+        atomic (bool): Writes nothing if any record is invalid.
+
+    Returns:
+        tuple: The result of each record, in create, update, delete order,
+        and the rows of the deleted categories.
+    """
+
+    existing = dict((row.id, CategoryRow(*row)) for row in _select_in(
+        db_session, Category, CATEGORY_COLUMNS, user_id, Category.id,
+        _ids(updates + deletes)))
+    taken = dict((row.name, row.id) for row in _select_in(
+        db_session, Category, (Category.id, Category.name), user_id,
+        Category.name, _names(creates + updates)))
+
+    done = set()
+    deleted, updated, created = [], [], []
+    create_results, update_results, delete_results = [], [], []
+
+    for index, record in enumerate(deletes):
+        error = (_target_error(record, existing, done)
+                 if isinstance(record, dict) else "Not an object.")
+        if error is None and existing[record["id"]].name == UNSORTED:
+            error = "That category cannot be deleted."
+        if error is not None:
+            delete_results.append(_result("delete", index, "error",
+                                          error=error))
+            continue
+
+        row = existing[record["id"]]
+        done.add(row.id)
+        if taken.get(row.name) == row.id:
+            del taken[row.name]
+        deleted.append(row)
+        delete_results.append(_result("delete", index, "deleted", row.id))
+
+    # Deleting a category creates "Unsorted" if it is missing
+    if deleted:
+        taken.setdefault(UNSORTED, None)
+
+    for index, record in enumerate(updates):
+        error = (_target_error(record, existing, done) or
+                 _text_error(record, "name", 80, required=True)
+                 if isinstance(record, dict) else "Not an object.")
+        if error is None:
+            row = existing[record["id"]]
+            if row.name == UNSORTED:
+                error = "That category cannot be renamed."
+            elif taken.get(record["name"], row.id) != row.id:
+                error = "A category with that name already exists."
+        if error is not None:
+            update_results.append(_result("update", index, "error",
+                                          error=error))
+            continue
+
+        done.add(row.id)
+        if taken.get(row.name) == row.id:
+            del taken[row.name]
+        taken[record["name"]] = row.id
+        updated.append(row._replace(name=record["name"]))
+        update_results.append(_result("update", index, "updated", row.id))
+
+    for index, record in enumerate(creates):
+        error = (_text_error(record, "name", 80, required=True)
+                 if isinstance(record, dict) else "Not an object.")
+        if error is None and record["name"] in taken:
+            error = "A category with that name already exists."
+        if error is not None:
+            create_results.append(_result("create", index, "error",
+                                          error=error))
+            continue
+
+        taken[record["name"]] = None
+        created.append({"name": record["name"], "user_id": user_id})
+        create_results.append(_result("create", index, "created"))
+
+    results = create_results + update_results + delete_results
+    if not _finish(results, atomic):
+        return results, []
+
+    entries = []
+    items = Item.__table__
+    table = Category.__table__
+
+    if deleted:
+        unsorted = unsorted_category(db_session, user_id)
+        unsorted_id = unsorted.id
+        category_ids = [row.id for row in deleted]
+        moved = _select_in(db_session, Item, ITEM_COLUMNS, user_id,
+                           Item.category_id, category_ids)
+        entries.extend(change_log.item_entry(row, change_log.UPDATE,
+                                             unsorted) for row in moved)
+        counts = item_counts.Changes()
+        for row in moved:
+            counts.moved(row.category_id, unsorted_id)
+        counts.apply(db_session)
+        for chunk in _chunks(category_ids):
+            db_session.execute(
+                items.update()
+                .where(items.c.category_id.in_(chunk))
+                .values(category_id=unsorted_id))
+        db_session.execute(
+            table.delete().where(table.c.id == bindparam("b_id")),
+            [{"b_id": row.id} for row in deleted])
+    if updated:
+        db_session.execute(
+            table.update().where(table.c.id == bindparam("b_id"))
+            .values(name=bindparam("b_name")),
+            [{"b_id": row.id, "b_name": row.name} for row in updated])
+    if created:
+        db_session.execute(table.insert(), created)
+
+        new_rows = dict((row.name, CategoryRow(*row)) for row in _select_in(
+            db_session, Category, CATEGORY_COLUMNS, user_id, Category.name,
+            [values["name"] for values in created]))
+        created = [new_rows[values["name"]] for values in created]
+        for result, row in zip([result for result in create_results
+                                if result["status"] == "created"], created):
+            result["id"] = row.id
+
+    for row in deleted:
+        catalog_snapshot.category_deleted(db_session, row, moved_to=UNSORTED)
+    catalog_snapshot.categories_saved(db_session, user_id, updated + created)
+    entries.extend(
+        [change_log.category_entry(row, change_log.DELETE)
+         for row in deleted] +
+        [change_log.category_entry(row, change_log.UPDATE)
+         for row in updated] +
+        [change_log.category_entry(row, change_log.CREATE)
+         for row in created])
+    change_log.record_many(db_session, entries)
+
+    return results, deleted
+
+
+def init_app(app):
+    """Applies the BULK_* settings of an app.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    settings["max_records"] = app.config["BULK_MAX_RECORDS"]
@@ -0,0 +1,78 @@
+"""
+This module contains a small in-process cache shared by other modules.
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by `LRUCache.get()` when a key is absent, so None can be cached
+MISSING = object()
+
+
+class LRUCache(object):
+    """Thread-safe least-recently-used cache with optional expiry.
+
+    Args:
+        maxsize (int): Entries kept before the oldest are evicted.
+        ttl (float): Default seconds an entry stays valid, or None.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=MISSING):
+        """Returns the value stored for `key`, or `default`."""
+
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None or (entry[1] is not None and
+                                 entry[1] <= time.time()):
+                self.misses += 1
+                return default
+
+            # Re-inserting moves the key to the most recently used end
+            self._data[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Stores `value`, evicting the least recently used entries.
+
+        Args:
+            key: Any hashable value.
+            value: Value to store.
+            ttl (float): Seconds the entry stays valid; defaults to the
+                cache's own ttl.
+        """
+
+        if ttl is None:
+            ttl = self.ttl
+        expires = time.time() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Removes `key` if present."""
+
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Removes every entry."""
+
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
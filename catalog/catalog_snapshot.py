@@ -0,0 +1,471 @@
+"""
+This module contains the materialized snapshot of each user's catalog.
+
+A snapshot holds a user's categories, their items grouped by category,
+the list of recent items and the item counters, already reduced to plain
+values, so the catalog
+pages and the per-user API answer without building ORM objects. It is
+stored as compressed JSON in Redis and kept decoded in a local LRU cache.
+
+Snapshots are tagged with the owner's catalog version from `page_cache`.
+The CRUD handlers record each change with `item_saved()`, `item_deleted()`,
+`category_saved()` or `category_deleted()`, and bulk writes use the plural
+forms, which take plain rows. Once the transaction commits
+and the version is bumped, the changes are applied to the stored snapshot
+if it was tagged with the version just before, and the counters are read
+again from their columns. Any other snapshot is out
+of date and is rebuilt from the database on the next read. Applying a
+change twice leaves the same result, so a rebuild that already saw a change
+does not break. Other in-memory views of the catalogs, such as the
+`autocomplete` indexes, get the same changes through `change_handlers`.
+
+"""
+
+import copy
+import heapq
+import json
+import logging
+import zlib
+from operator import itemgetter
+from redis import RedisError
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from catalog import page_cache
+from catalog.cache import LRUCache, MISSING
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Category, Item, User
+from catalog.redis_manager import get_redis
+
+log = logging.getLogger(__name__)
+
+# Snapshot settings, replaced by `init_app()`
+settings = {"enabled": True, "redis": True, "ttl": 24 * 60 * 60}
+
+snapshots = LRUCache(maxsize=256)
+
+# Functions called with the owner's ID, new catalog version and list of
+# changes after each commit
+change_handlers = []
+
+# Number of items in the recent items list
+RECENT_COUNT = 7
+
+# Key for changes parked on `Session.info` until the transaction ends
+PENDING_CHANGES = "catalog_snapshot.changes"
+
+# Layout of the stored snapshots; older layouts are ignored and rebuilt
+FORMAT = 2
+
+# Positions in an item row: [id, name, description, image_url, created]
+ITEM_ID, ITEM_NAME, ITEM_DESCRIPTION, ITEM_IMAGE_URL, ITEM_CREATED = range(5)
+
+
+def _key(user_id):
+    return "snapshot:{}:{}".format(FORMAT, user_id)
+
+
+def _created(value):
+    # Kept as the text the pages show
+    return str(value) if value is not None else None
+
+
+def _item_row(item):
+    return [item.id, item.name, item.description, item.image_url,
+            _created(item.create_date)]
+
+
+def _recent_key(row):
+    return (row[ITEM_CREATED + 1] or "", row[ITEM_ID + 1])
+
+
+def _refresh_recent(snapshot):
+    rows = ([name] + row for name, rows in snapshot["i"].items()
+            for row in rows)
+    snapshot["r"] = heapq.nlargest(RECENT_COUNT, rows, key=_recent_key)
+
+
+def build(user_id, version):
+    """Reads a user's catalog from the database into a new snapshot.
+
+    Args:
+        user_id (int): Owner of the catalog.
+        version (int): Catalog version read before the database.
+    """
+
+    db_session = session_factory()
+    try:
+        categories = (db_session.query(Category.id, Category.name,
+                                       Category.item_count)
+                      .filter(Category.user_id == user_id)
+                      .order_by(Category.name, Category.id).all())
+        items = (db_session.query(Item.id, Item.name, Item.description,
+                                  Item.image_url, Item.create_date,
+                                  Category.name.label("category_name"))
+                 .join(Category, Category.id == Item.category_id)
+                 .filter(Item.user_id == user_id)
+                 .order_by(Category.name, Item.id).all())
+        total = (db_session.query(User.item_count)
+                 .filter(User.id == user_id).scalar())
+    finally:
+        db_session.close()
+
+    grouped = {}
+    for item in items:
+        grouped.setdefault(item.category_name, []).append(_item_row(item))
+
+    snapshot = {"v": version, "u": user_id,
+                "c": [[category.id, category.name, category.item_count or 0]
+                      for category in categories],
+                "n": total or 0, "i": grouped}
+    _refresh_recent(snapshot)
+    return snapshot
+
+
+def _redis_load(user_id):
+    if not settings["redis"]:
+        return None
+    try:
+        value = get_redis().get(_key(user_id))
+    except RedisError as err:
+        log.debug("Snapshot not loaded from Redis: %s", err)
+        return None
+    if value is None:
+        return None
+    return json.loads(zlib.decompress(value))
+
+
+def _store(user_id, snapshot, shared=True):
+    # Versions local to one process miss other processes' edits
+    snapshots.set(user_id, snapshot, page_cache.cache_ttl(shared, None))
+    if not settings["redis"]:
+        return
+
+    value = zlib.compress(json.dumps(snapshot, separators=(",", ":")))
+    try:
+        get_redis().setex(_key(user_id), settings["ttl"], value)
+    except RedisError as err:
+        log.debug("Snapshot not stored in Redis: %s", err)
+
+
+def get(user_id):
+    """Returns the current snapshot of a user's catalog.
+
+    The result is shared and must not be changed by the caller.
+
+    Args:
+        user_id (int): Owner of the catalog. The user must exist, since
+            a snapshot of a missing user would be cached as empty.
+    """
+
+    version, shared = page_cache.current_version(user_id)
+    if not settings["enabled"]:
+        return build(user_id, version)
+
+    snapshot = snapshots.get(user_id)
+    if snapshot is not MISSING and snapshot["v"] == version:
+        return snapshot
+
+    snapshot = _redis_load(user_id)
+    if snapshot is not None and snapshot["v"] == version:
+        snapshots.set(user_id, snapshot)
+        return snapshot
+
+    snapshot = build(user_id, version)
+    _store(user_id, snapshot, shared)
+    return snapshot
+
+
+def categories(snapshot):
+    """Returns the categories of a snapshot, ordered by name.
+
+    Each one is a dict like `Category.serialize`, with the `item_count`
+    column as of the snapshot's version.
+    """
+
+    return [{"id": category_id, "name": name, "user_id": snapshot["u"],
+             "item_count": count}
+            for category_id, name, count in snapshot["c"]]
+
+
+def item_count(snapshot):
+    """Returns the owner's `item_count` column as of the snapshot."""
+
+    return snapshot["n"]
+
+
+def _item_dict(snapshot, category_name, row):
+    return {"id": row[ITEM_ID], "name": row[ITEM_NAME],
+            "description": row[ITEM_DESCRIPTION],
+            "image_url": row[ITEM_IMAGE_URL],
+            "create_date": row[ITEM_CREATED],
+            "category_name": category_name, "user_id": snapshot["u"]}
+
+
+def items(snapshot):
+    """Returns the items of a snapshot, ordered by category name.
+
+    Each one is a dict with the `Item` columns the pages and API use.
+    """
+
+    return [_item_dict(snapshot, name, row)
+            for name in sorted(snapshot["i"])
+            for row in snapshot["i"][name]]
+
+
+def recent_items(snapshot):
+    """Returns the newest items of a snapshot, newest first."""
+
+    return [_item_dict(snapshot, row[0], row[1:]) for row in snapshot["r"]]
+
+
+def item_data(item):
+    """Returns an item dict from `items()` in its API form."""
+
+    return {"id": item["id"], "name": item["name"],
+            "description": item["description"],
+            "image_url": item["image_url"],
+            "category": item["category_name"], "user_id": item["user_id"]}
+
+
+def _record(db_session, user_id, change):
+    # The change is only applied once the catalog version is bumped, so
+    # the owner's catalog is marked as changed if the handler has not
+    if user_id not in db_session.info.get(page_cache.PENDING_CHANGES, ()):
+        page_cache.catalog_changed(db_session, user_id)
+    changes = db_session.info.setdefault(PENDING_CHANGES, {})
+    changes.setdefault(user_id, []).append(change)
+
+
+def item_saved(db_session, item):
+    """Records a new or changed item in the current transaction.
+
+    Like the other recording functions, it also marks the owner's catalog
+    as changed with `page_cache.catalog_changed()`. The session is flushed
+    first, so a new item has its ID.
+
+    Args:
+        db_session (:obj:`Session`): The session that owns the change.
+        item (:obj:`Item`): The item as it will be committed.
+    """
+
+    db_session.flush()
+    _record(db_session, item.user_id,
+            ["item", item.category_name, _item_row(item)])
+
+
+def item_deleted(db_session, item):
+    """Records the removal of an item in the current transaction."""
+
+    _record(db_session, item.user_id, ["item_deleted", item.id])
+
+
+def category_saved(db_session, category):
+    """Records a new or renamed category in the current transaction.
+
+    Flushes the session, so a new category gets its ID.
+    """
+
+    db_session.flush()
+    _record(db_session, category.user_id,
+            ["category", category.id, category.name])
+
+
+def items_saved(db_session, user_id, items):
+    """Records new or changed items written without the ORM.
+
+    Args:
+        db_session (:obj:`Session`): The session that owns the changes.
+        user_id (int): Owner of the items.
+        items (list): Rows with the `Item` columns, IDs assigned.
+    """
+
+    for item in items:
+        _record(db_session, user_id,
+                ["item", item.category_name, _item_row(item)])
+
+
+def items_deleted(db_session, user_id, item_ids):
+    """Records the removal of items written without the ORM."""
+
+    for item_id in item_ids:
+        _record(db_session, user_id, ["item_deleted", item_id])
+
+
+def categories_saved(db_session, user_id, categories):
+    """Records new or renamed categories written without the ORM.
+
+    Args:
+        db_session (:obj:`Session`): The session that owns the changes.
+        user_id (int): Owner of the categories.
+        categories (list): Rows with `id` and `name`, IDs assigned.
+    """
+
+    for category in categories:
+        _record(db_session, user_id,
+                ["category", category.id, category.name])
+
+
+def category_deleted(db_session, category, moved_to=None):
+    """Records the removal of a category in the current transaction.
+
+    Args:
+        db_session (:obj:`Session`): The session that owns the change.
+        category: The `Category` record or row being deleted.
+        moved_to (str): Category that received its items, if any.
+    """
+
+    _record(db_session, category.user_id,
+            ["category_deleted", category.id, category.name, moved_to])
+
+
+def _apply_items(snapshot, items):
+    # Applies a run of item changes in one pass over the snapshot, so a
+    # bulk write costs about the same as a single change
+    for name, rows in snapshot["i"].items():
+        kept = [row for row in rows if row[ITEM_ID] not in items]
+        if not kept:
+            del snapshot["i"][name]
+        elif len(kept) != len(rows):
+            snapshot["i"][name] = kept
+
+    touched = set()
+    for item in items.values():
+        if item is not None:
+            category_name, row = item
+            snapshot["i"].setdefault(category_name, []).append(row)
+            touched.add(category_name)
+    for category_name in touched:
+        snapshot["i"][category_name].sort(key=itemgetter(ITEM_ID))
+
+
+def _apply_category(snapshot, change):
+    kind = change[0]
+
+    if kind == "category":
+        category_id, name = change[1], change[2]
+        old = [category for category in snapshot["c"]
+               if category[0] == category_id]
+        old_names = [category[1] for category in old]
+
+        # Items follow a renamed category
+        if old_names and old_names[0] != name:
+            rows = snapshot["i"].pop(old_names[0], [])
+            if rows:
+                rows = snapshot["i"].get(name, []) + rows
+                rows.sort(key=itemgetter(ITEM_ID))
+                snapshot["i"][name] = rows
+
+        snapshot["c"] = [category for category in snapshot["c"]
+                         if category[0] != category_id]
+        # The count is read again from its column once the changes apply
+        snapshot["c"].append([category_id, name, old[0][2] if old else 0])
+        snapshot["c"].sort(key=lambda category: (category[1], category[0]))
+    elif kind == "category_deleted":
+        category_id, name, moved_to = change[1], change[2], change[3]
+        snapshot["c"] = [category for category in snapshot["c"]
+                         if category[0] != category_id]
+        rows = snapshot["i"].pop(name, [])
+        if moved_to is not None and rows:
+            rows = snapshot["i"].get(moved_to, []) + rows
+            rows.sort(key=itemgetter(ITEM_ID))
+            snapshot["i"][moved_to] = rows
+
+
+def apply_changes(snapshot, changes):
+    """Applies recorded changes to a snapshot in place, in order."""
+
+    # Latest state of each item changed since the last category change,
+    # None for a deleted item
+    items = {}
+
+    for change in changes:
+        if change[0] == "item":
+            items[change[2][ITEM_ID]] = (change[1], change[2])
+        elif change[0] == "item_deleted":
+            items[change[1]] = None
+        else:
+            if items:
+                _apply_items(snapshot, items)
+                items = {}
+            _apply_category(snapshot, change)
+
+    if items:
+        _apply_items(snapshot, items)
+    _refresh_recent(snapshot)
+
+
+def _load_counts(snapshot):
+    # The counters are columns kept by the writes, so they are read rather
+    # than derived from the items held in the snapshot
+    db_session = session_factory()
+    try:
+        counts = dict(db_session.query(Category.id, Category.item_count)
+                      .filter(Category.user_id == snapshot["u"]))
+        total = (db_session.query(User.item_count)
+                 .filter(User.id == snapshot["u"]).scalar())
+    finally:
+        db_session.close()
+
+    for category in snapshot["c"]:
+        category[2] = counts.get(category[0]) or 0
+    snapshot["n"] = total or 0
+
+
+def _update(user_id, version, changes):
+    snapshot = _redis_load(user_id)
+    if snapshot is None and not settings["redis"]:
+        snapshot = snapshots.get(user_id, None)
+        snapshot = copy.deepcopy(snapshot)
+
+    # Snapshots from any other version are rebuilt when next read
+    if snapshot is None or snapshot["v"] != version - 1:
+        return
+
+    apply_changes(snapshot, changes)
+    _load_counts(snapshot)
+    snapshot["v"] = version
+    _store(user_id, snapshot)
+
+
+# Registered after the `page_cache` listener, which bumps the versions
+@event.listens_for(Session, "after_commit")
+def _after_commit(db_session):
+    changes = db_session.info.pop(PENDING_CHANGES, {})
+
+    for user_id, user_changes in changes.items():
+        # Read after `page_cache` bumped the version for this commit
+        version = page_cache.version(user_id)
+        if settings["enabled"]:
+            try:
+                _update(user_id, version, user_changes)
+            except Exception:
+                log.exception("Could not update the snapshot of user %s",
+                              user_id)
+        for handler in change_handlers:
+            try:
+                handler(user_id, version, user_changes)
+            except Exception:
+                log.exception("Change handler %r failed for user %s",
+                              handler, user_id)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _after_transaction_end(db_session, transaction):
+    # Changes still pending when the outermost transaction ends were
+    # rolled back
+    if transaction.parent is None:
+        db_session.info.pop(PENDING_CHANGES, None)
+
+
+def init_app(app):
+    """Applies the SNAPSHOT_* settings of an app.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    config = app.config
+    settings["enabled"] = config["SNAPSHOT_ENABLED"]
+    settings["redis"] = config["SNAPSHOT_REDIS"]
+    settings["ttl"] = config["SNAPSHOT_TTL"]
+    snapshots.maxsize = config["SNAPSHOT_CACHE_SIZE"]
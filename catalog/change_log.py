@@ -0,0 +1,185 @@
+"""
+This module contains the append-only log of catalog changes.
+
+Every create, update and delete of an item or category adds an entry in
+the same transaction as the change itself, so the log never shows a
+change that rolled back and never misses one that committed. Item data
+carries the category ID, so moving items logs an update of each item,
+while renaming a category logs only the category: consumers take the
+category name from its latest entry. Entry IDs increase with every write
+and serve as sync tokens: an API consumer asks for the changes made after
+the last token it saw, and its cost follows the amount of change rather
+than the size of the catalog.
+
+A token is only safe to resume from if entries become visible in ID
+order. Before writing entries, a transaction updates the single
+`change_log_lock` row, which it then holds until it ends, so logging
+transactions commit one at a time, in the order their IDs were assigned.
+SQLite already allows one writer at a time; on other databases this keeps
+a consumer from reading a higher ID before a lower one commits.
+
+"""
+
+import json
+from sqlalchemy import func
+from catalog.connection_manager import session_factory
+from catalog.db_setup import ChangeLog, ChangeLogLock, Item, User
+
+# Actions of an entry
+CREATE, UPDATE, DELETE = "create", "update", "delete"
+
+
+def _entry(kind, action, user_id, record_id, data=None):
+    return {"kind": kind, "action": action, "user_id": user_id,
+            "record_id": record_id,
+            "data": json.dumps(data) if data is not None else None}
+
+
+def record_many(db_session, entries):
+    """Adds entries to the log in the current transaction.
+
+    Args:
+        db_session (:obj:`Session`): The session that owns the changes.
+        entries (list): Dicts made by the functions below, written with
+            one executemany.
+    """
+
+    if not entries:
+        return
+
+    # Holds the lock row until the transaction ends, so entries commit in
+    # ID order
+    lock = ChangeLogLock.__table__
+    locked = db_session.execute(
+        lock.update().where(lock.c.id == 1)
+        .values(writes=lock.c.writes + 1)).rowcount
+    if not locked:
+        # Databases not migrated since the lock row was added
+        db_session.execute(lock.insert().values(id=1, writes=1))
+
+    db_session.execute(ChangeLog.__table__.insert(), entries)
+
+
+def item_entry(item, action, category=None):
+    """Returns the log entry of an item change.
+
+    The data has the fields of `Item.serialize` and the `category_id`, so
+    rows selected with those columns can be logged like records. The
+    category name is the one at the time of the entry; a later category
+    entry renames it.
+
+    Args:
+        item: An `Item` record or row, with its ID assigned.
+        action (str): CREATE, UPDATE or DELETE.
+        category: The `Category` record or row the item is moved to, if
+            it changes.
+    """
+
+    data = None
+    if action != DELETE:
+        if category is None:
+            category_id, category_name = item.category_id, item.category_name
+        else:
+            category_id, category_name = category.id, category.name
+        data = {"id": item.id, "name": item.name,
+                "description": item.description,
+                "image_url": item.image_url,
+                "category": category_name, "category_id": category_id,
+                "user_id": item.user_id}
+    return _entry("item", action, item.user_id, item.id, data)
+
+
+def category_entry(category, action):
+    """Returns the log entry of a category change.
+
+    Args:
+        category: A `Category` record or row, with its ID assigned.
+        action (str): CREATE, UPDATE or DELETE.
+    """
+
+    data = None
+    if action != DELETE:
+        data = {"id": category.id, "name": category.name,
+                "user_id": category.user_id}
+    return _entry("category", action, category.user_id, category.id, data)
+
+
+def item_changed(db_session, item, action):
+    """Logs a change to one item in the current transaction.
+
+    The session is flushed first, so a new item has its ID and a moved
+    item its new category ID.
+    """
+
+    db_session.flush()
+    record_many(db_session, [item_entry(item, action)])
+
+
+def category_changed(db_session, category, action):
+    """Logs a change to one category in the current transaction."""
+
+    if category.id is None:
+        db_session.flush()
+    record_many(db_session, [category_entry(category, action)])
+
+
+def items_moved(db_session, from_category, to_category):
+    """Logs the items of a category as moved to another category.
+
+    Must run before the UPDATE that moves them, which bypasses the ORM.
+
+    Args:
+        db_session (:obj:`Session`): The session that owns the change.
+        from_category (:obj:`Category`): The category being emptied.
+        to_category (:obj:`Category`): The category receiving the items.
+    """
+
+    items = (db_session.query(Item.id, Item.name, Item.description,
+                              Item.image_url, Item.user_id)
+             .filter(Item.category_id == from_category.id)
+             .order_by(Item.id).all())
+    record_many(db_session, [item_entry(item, UPDATE, to_category)
+                             for item in items])
+
+
+def latest():
+    """Returns the newest sync token, 0 while the log is empty."""
+
+    db_session = session_factory()
+    try:
+        return db_session.query(func.max(ChangeLog.id)).scalar() or 0
+    finally:
+        db_session.close()
+
+
+def changes_since(token, limit, user_id=None):
+    """Returns the public changes made after a sync token.
+
+    Args:
+        token (int): Last token the consumer has seen.
+        limit (int): Largest number of changes returned.
+        user_id (int): Restricts the changes to one user's catalog.
+
+    Returns:
+        tuple: The changes as dicts, oldest first, and whether more
+        changes follow them.
+    """
+
+    db_session = session_factory()
+    try:
+        query = (db_session.query(ChangeLog)
+                 .join(User, User.id == ChangeLog.user_id)
+                 .filter(ChangeLog.id > token, User.public.is_(True)))
+        if user_id is not None:
+            query = query.filter(ChangeLog.user_id == user_id)
+        entries = query.order_by(ChangeLog.id).limit(limit + 1).all()
+    finally:
+        db_session.close()
+
+    changes = [{"token": str(entry.id), "kind": entry.kind,
+                "action": entry.action, "id": entry.record_id,
+                "user_id": entry.user_id,
+                "data": json.loads(entry.data) if entry.data else None,
+                "time": entry.created.isoformat()}
+               for entry in entries[:limit]]
+    return changes, len(entries) > limit
@@ -0,0 +1,226 @@
+"""
+This module contains the response compression middleware.
+
+HTML and JSON responses are compressed with brotli, when the `brotli`
+package is installed and the client accepts it, or with gzip. Bodies are
+compressed chunk by chunk as the application produces them, so streamed
+and generator responses keep streaming. The compressor is flushed once at
+least COMPRESS_FLUSH_SIZE bytes went in since the last flush, rather than
+after every chunk, since a flush per small chunk, such as one export row,
+costs most of the compression. A response is left alone when:
+
++ its content type is not in COMPRESS_TYPES,
++ its Content-Length is below COMPRESS_MIN_SIZE,
++ it already has a Content-Encoding, such as precompressed static files,
++ it is a partial (206) or bodiless response, or supports byte ranges,
++ its Cache-Control contains no-transform.
+
+"""
+
+import zlib
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header, parse_options_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Statuses that never carry a body worth compressing
+SKIP_STATUSES = ("204", "206", "304")
+
+
+class GzipStream(object):
+    """Incremental gzip compressor.
+
+    Args:
+        level (int): gzip level, from 1 (fastest) to 9 (smallest).
+        flush_size (int): Input bytes collected between sync flushes.
+    """
+
+    def __init__(self, level, flush_size):
+        self._zlib = zlib.compressobj(level, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+        self.flush_size = flush_size
+        self._pending = 0
+
+    def compress(self, data):
+        output = self._zlib.compress(data)
+        self._pending += len(data)
+        if self._pending < self.flush_size:
+            return output
+
+        # Sync flushes let the data so far reach the client
+        self._pending = 0
+        return output + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._zlib.flush(zlib.Z_FINISH)
+
+
+class BrotliStream(object):
+    """Incremental brotli compressor.
+
+    Args:
+        quality (int): brotli quality, from 0 to 11.
+        flush_size (int): Input bytes collected between flushes.
+    """
+
+    def __init__(self, quality, flush_size):
+        self._brotli = brotli.Compressor(quality=quality)
+        self.flush_size = flush_size
+        self._pending = 0
+
+        # Older brotli releases name `process` `compress`
+        self._process = getattr(self._brotli, "process", None) or \
+            self._brotli.compress
+
+    def compress(self, data):
+        output = self._process(data)
+        self._pending += len(data)
+        if self._pending < self.flush_size:
+            return output
+
+        self._pending = 0
+        return output + self._brotli.flush()
+
+    def finish(self):
+        return self._brotli.finish()
+
+
+class CompressionMiddleware(object):
+    """WSGI middleware compressing text responses.
+
+    Args:
+        app (callable): The wrapped WSGI application.
+        types (list): Compressible content types.
+        min_size (int): Smallest known body length worth compressing.
+        level (int): gzip level, from 1 (fastest) to 9 (smallest).
+        brotli_quality (int): brotli quality, from 0 to 11.
+        flush_size (int): Input bytes collected between flushes of a
+            streamed body.
+    """
+
+    def __init__(self, app, types, min_size=500, level=6, brotli_quality=5,
+                 flush_size=16 * 1024):
+        self.app = app
+        self.types = frozenset(types)
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.flush_size = flush_size
+
+    def choose_encoding(self, environ):
+        """Returns "br", "gzip" or None for the client's Accept-Encoding."""
+
+        accepted = parse_accept_header(environ.get("HTTP_ACCEPT_ENCODING"))
+        if brotli is not None and accepted["br"]:
+            return "br"
+        if accepted["gzip"]:
+            return "gzip"
+        return None
+
+    def should_compress(self, status, headers):
+        """Checks the response status and headers against the policy."""
+
+        if status[:3] in SKIP_STATUSES:
+            return False
+        if "Content-Encoding" in headers:
+            return False
+        if headers.get("Accept-Ranges", "none") != "none":
+            return False
+        if "no-transform" in headers.get("Cache-Control", ""):
+            return False
+
+        mimetype = parse_options_header(headers.get("Content-Type"))[0]
+        if mimetype not in self.types:
+            return False
+
+        length = headers.get("Content-Length")
+        if length is not None and int(length) < self.min_size:
+            return False
+        return True
+
+    def __call__(self, environ, start_response):
+        encoding = self.choose_encoding(environ)
+        if encoding is None or environ["REQUEST_METHOD"] == "HEAD":
+            return self.app(environ, start_response)
+
+        state = {}
+
+        def compressing_start_response(status, headers, exc_info=None):
+            headers = Headers(headers)
+            state["started"] = True
+
+            if not self.should_compress(status, headers):
+                return start_response(status, headers.to_wsgi_list(),
+                                      exc_info)
+
+            if encoding == "br":
+                stream = BrotliStream(self.brotli_quality, self.flush_size)
+            else:
+                stream = GzipStream(self.level, self.flush_size)
+            state["stream"] = stream
+
+            headers.pop("Content-Length", None)
+            headers["Content-Encoding"] = encoding
+            vary = headers.get("Vary")
+            if not vary:
+                headers["Vary"] = "Accept-Encoding"
+            elif "accept-encoding" not in vary.lower():
+                headers["Vary"] = vary + ", Accept-Encoding"
+
+            # The compressed body is a different representation
+            etag = headers.get("ETag")
+            if etag and etag.endswith('"'):
+                headers["ETag"] = '{}-{}"'.format(etag[:-1], encoding)
+
+            write = start_response(status, headers.to_wsgi_list(), exc_info)
+            return lambda data: write(stream.compress(data))
+
+        app_iter = self.app(environ, compressing_start_response)
+
+        # Untouched bodies are passed through, keeping file wrappers intact
+        if "started" in state and "stream" not in state:
+            return app_iter
+        return self.compress_iter(app_iter, state)
+
+    def compress_iter(self, app_iter, state):
+        """Yields the compressed chunks of a response body.
+
+        Applications may call `start_response` only when their first chunk
+        is produced, so the decision is read from `state` as chunks arrive.
+        """
+
+        try:
+            for data in app_iter:
+                stream = state.get("stream")
+                if stream is None:
+                    yield data
+                elif data:
+                    chunk = stream.compress(data)
+                    if chunk:
+                        yield chunk
+
+            if "stream" in state:
+                yield state["stream"].finish()
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+
+
+def init_app(app):
+    """Wraps the app in the COMPRESS_* configured middleware.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    config = app.config
+    if not config["COMPRESS_ENABLED"]:
+        return
+
+    app.wsgi_app = CompressionMiddleware(
+        app.wsgi_app, config["COMPRESS_TYPES"], config["COMPRESS_MIN_SIZE"],
+        config["COMPRESS_LEVEL"], config["COMPRESS_BROTLI_QUALITY"],
+        config["COMPRESS_FLUSH_SIZE"])
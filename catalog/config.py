@@ -0,0 +1,139 @@
+"""
+This module contains the default settings of the catalog application.
+
+`create_app()` loads them into `app.config` before applying the settings
+it is given, so a deployment only needs to pass the values it changes.
+
+"""
+
+# Database opened lazily by each process, and brought up to date with the
+# models when an app is created
+DATABASE_URL = "sqlite:///catalog/catalog.db"
+DATABASE_MIGRATE = True
+
+# Signs session cookies; None uses the persistent key from `db_setup`
+SECRET_KEY = None
+
+# For file upload feature
+UPLOAD_FOLDER = "catalog/static/uploads"
+MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # Restrict size to 16MB
+UPLOAD_MAX_DIMENSION = 4096  # Largest image side in pixels
+
+# Removed image files are deleted in batches after the commit, and a sweep
+# reclaims unreferenced files older than the grace period every hour, run
+# by one worker process at a time
+UPLOAD_DELETE_BATCH = 50
+UPLOAD_GC_INTERVAL = 60 * 60
+UPLOAD_GC_GRACE = 60 * 60
+
+# Set to "x-accel-redirect" (nginx) or "x-sendfile" to let the front proxy
+# send static files. The accel prefix is an internal location that maps
+# to the catalog/static directory.
+STATIC_SENDFILE_MODE = None
+STATIC_ACCEL_PREFIX = "/_static/"
+STATIC_MAX_AGE = 365 * 24 * 60 * 60  # Fingerprinted URLs
+
+# Hash scheme and cost for new passwords. Existing hashes that differ are
+# upgraded on the next login. At most PASSWORD_WORKERS hashes run at once.
+PASSWORD_SCHEME = "pbkdf2_sha256"
+PASSWORD_ROUNDS = 29000
+PASSWORD_WORKERS = 2
+PASSWORD_TIMEOUT = 10  # Seconds to wait for a free worker
+
+# Outbound calls to the OAuth providers share one keep-alive pool
+# Timeouts are (connect, read) seconds. PROVIDER_BASE_URLS can send a
+# provider's calls elsewhere, e.g. {"google": "http://localhost:9000"}.
+PROVIDER_POOL_SIZE = 10
+PROVIDER_RETRIES = 2
+PROVIDER_BACKOFF = 0.2
+PROVIDER_TIMEOUTS = {
+    "google": (3.05, 5),
+    "facebook": (3.05, 5),
+    "twitter": (3.05, 5)
+}
+PROVIDER_BASE_URLS = {}
+PROVIDER_FANOUT_WORKERS = 8  # Threads for concurrent calls
+
+# OAuth client secrets are loaded once and reloaded when a file changes,
+# which each process checks at most every interval
+PROVIDER_SECRETS_FILES = {
+    "google": "catalog/login/client_secrets_gpl.json",
+    "facebook": "catalog/login/client_secrets_fb.json",
+    "twitter": "catalog/login/client_secrets_twt.json"
+}
+PROVIDER_SECRETS_CHECK_INTERVAL = 5  # Seconds
+
+# Logout queues OAuth token revocations, which are retried with backoff
+REVOCATION_MAX_ATTEMPTS = 8
+REVOCATION_BACKOFF = 30  # Seconds before the first retry
+REVOCATION_POLL_INTERVAL = 60  # Seconds between due checks
+REVOCATION_LEASE = 5 * 60  # Seconds a worker holds the rows it sends
+
+# Signed API tokens from /catalog/api/1.0/token, cached once verified
+API_TOKEN_EXPIRATION = 600  # Seconds
+API_TOKEN_CACHE_SIZE = 1024
+
+# Shared Redis connection, opened on first use
+REDIS_URL = "redis://localhost:6379/0"
+
+# login_session data stays on the server; the cookie only holds its ID
+# SESSION_BACKEND is "sqlite" (single node), "redis" or "cookie"
+SESSION_BACKEND = "sqlite"
+SESSION_SQLITE_PATH = "catalog/sessions.db"
+SESSION_LOCAL_CACHE_SIZE = 1024
+SESSION_LOCAL_TTL = 30  # Seconds, bounds revocation delay
+SESSION_ANONYMOUS_TTL = 3600  # Seconds a signed-out session is stored
+
+# User lookups are memoized per request and cached across requests
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 10  # Seconds, 0 disables the shared cache
+
+# Items listed per page of a category
+CATEGORY_PAGE_SIZE = 50
+
+# Public catalog, category and item pages are cached per owner version
+PAGE_CACHE_ENABLED = True
+PAGE_CACHE_REDIS = True  # Shares pages between processes
+PAGE_CACHE_SIZE = 512  # Pages kept in each process
+PAGE_CACHE_TTL = 300  # Seconds
+PAGE_CACHE_FALLBACK_TTL = 5  # Seconds, while Redis is unreachable
+
+# Each user's categories and items are kept as a snapshot that the CRUD
+# handlers update, so catalog pages and the API skip the ORM
+SNAPSHOT_ENABLED = True
+SNAPSHOT_REDIS = True  # Shares snapshots between processes
+SNAPSHOT_CACHE_SIZE = 256  # Snapshots kept in each process
+SNAPSHOT_TTL = 24 * 60 * 60  # Seconds a snapshot stays in Redis
+
+# Largest number of records in one bulk write request
+BULK_MAX_RECORDS = 5000
+
+# Records per query of an export and per transaction of an import
+TRANSFER_BATCH_SIZE = 500
+
+# Item and category names are completed from in-memory prefix indexes
+AUTOCOMPLETE_LIMIT = 10  # Most names in one answer
+AUTOCOMPLETE_CACHE_SIZE = 256  # User indexes kept in each process
+AUTOCOMPLETE_PUBLIC_TTL = 60  # Seconds before the public index is reread
+
+# Compiled templates are kept as bytecode and all loaded at startup
+# TEMPLATE_BYTECODE_CACHE is "filesystem", "redis" or None
+TEMPLATE_BYTECODE_CACHE = "filesystem"
+TEMPLATE_CACHE_DIR = "catalog/.jinja_cache"
+TEMPLATE_CACHE_TIMEOUT = None  # Seconds, Redis only
+TEMPLATE_WARMUP = True
+
+# Public pages and API answers can be reused by browsers and proxies
+HTTP_CACHE_PAGE_MAX_AGE = 60  # Seconds
+HTTP_CACHE_API_MAX_AGE = 30  # Seconds
+
+# HTML and JSON responses are gzip or brotli compressed as they stream
+COMPRESS_ENABLED = True
+COMPRESS_MIN_SIZE = 500  # Bytes
+COMPRESS_LEVEL = 6  # gzip, 1-9
+COMPRESS_BROTLI_QUALITY = 5  # brotli, 0-11
+COMPRESS_FLUSH_SIZE = 16 * 1024  # Bytes between flushes of a stream
+COMPRESS_TYPES = [
+    "text/html", "text/plain", "text/css", "text/csv", "application/json",
+    "application/javascript", "application/x-ndjson", "image/svg+xml"
+]
@@ -1,13 +1,78 @@
 """
 This module contains setup code for interacting with the database.
 
+The engine is created on first use from DATABASE_URL, so importing a
+module that queries the database opens no connection, and each process
+gets its own engine and connection pool after a fork.
+
 """
 
+import os
+import threading
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, scoped_session
 from catalog.db_setup import Base
+from catalog.migrations import migrate
+
+settings = {"url": "sqlite:///catalog/catalog.db"}
+
+_engine = {"pid": None, "engine": None}
+_lock = threading.Lock()
+
+_make_session = sessionmaker()
+
+
+def get_engine():
+    """Returns this process's engine, creating it if needed."""
+
+    with _lock:
+        if _engine["pid"] != os.getpid():
+            _engine["engine"] = create_engine(settings["url"])
+            _engine["pid"] = os.getpid()
+        return _engine["engine"]
+
+
+def session_factory():
+    """Returns a new session bound to this process's engine."""
+
+    return _make_session(bind=get_engine())
+
 
-engine = create_engine("sqlite:///catalog/catalog.db")
-Base.metadata.create_all(bind=engine)
-session_factory = sessionmaker(bind=engine)
+# One session per thread for the request handlers, removed after each
+# request by the teardown installed in `init_app()`
 DBSession = scoped_session(session_factory)
+
+
+def reset():
+    """Forgets the engine and this thread's session.
+
+    Connections inherited from a parent process are left alone rather than
+    closed, since the parent may still be using them.
+    """
+
+    DBSession.registry.clear()
+    with _lock:
+        _engine["pid"] = None
+        _engine["engine"] = None
+
+
+def init_app(app):
+    """Applies the DATABASE_* settings of an app.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    settings["url"] = app.config["DATABASE_URL"]
+    reset()
+
+    if app.config["DATABASE_MIGRATE"]:
+        engine = get_engine()
+        migrate(engine, Base.metadata)
+
+        # No connection is left in the pool for forked workers to inherit
+        engine.dispose()
+
+    @app.teardown_appcontext
+    def remove_session(exc):
+        DBSession.remove()
@@ -9,24 +9,64 @@ Run the following command from the applicaiton root directory:
 
 """
 
-import random
-import string
+import binascii
+import errno
+import os
 from sqlalchemy import (Boolean, Column, create_engine, DateTime, ForeignKey,
-                        Integer, String)
+                        Index, Integer, String, Text)
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
-
-# Used for hashing passwords
-from passlib.apps import custom_app_context as pwd_context
-
+from sqlalchemy.sql import func, select
 
 # Used for generating cryptographically signed messages (tokens)
 # https://www.tutorialspoint.com/cryptography/cryptography_digital_signatures.htm
 from itsdangerous import(TimedJSONWebSignatureSerializer as Serializer,
                          BadSignature, SignatureExpired)
-secret_key = ("".join(random.choice(string.ascii_uppercase + string.digits)
-              for x in xrange(32)))
+
+# Tokens must stay valid across restarts and between worker processes
+SECRET_KEY_FILE = "catalog/secret_key"
+
+
+def load_secret_key(path=SECRET_KEY_FILE):
+    """Returns the key for signing tokens, creating it on first use.
+
+    The CATALOG_SECRET_KEY environment variable takes precedence over the
+    key file, which is created with owner-only permissions.
+
+    Args:
+        path (str): Location of the key file.
+    """
+
+    key = os.environ.get("CATALOG_SECRET_KEY")
+    if key:
+        return key
+
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return f.read().strip()
+
+    # Written aside and linked into place, so no process reads a partial key
+    key = binascii.hexlify(os.urandom(32))
+    tmp_path = "{}.{}".format(path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(key)
+
+    try:
+        os.link(tmp_path, path)
+    except OSError as err:
+        # Another process created it first
+        if err.errno != errno.EEXIST:
+            raise
+        with open(path, "r") as f:
+            key = f.read().strip()
+    finally:
+        os.remove(tmp_path)
+    return key
+
+
+secret_key = load_secret_key()
 
 
 Base = declarative_base()
@@ -43,25 +83,51 @@ class User(Base):
     password_hash = Column(String(250), nullable=False, default=False)
     picture = Column(String(250), nullable=True)
     public = Column(Boolean, nullable=False, default=True)
+    catalog_updated = Column(DateTime, nullable=True)
+    # Kept up to date by catalog.item_counts
+    item_count = Column(Integer, nullable=False, default=0,
+                        server_default="0")
     items = relationship("Item", backref="owner", lazy="dynamic")
     categories = relationship("Category", backref="owner", lazy="dynamic")
 
     def hash_password(self, password):
         """Hashes password during registration"""
 
-        self.password_hash = pwd_context.encrypt(password)
+        # Imported here so this module still runs as a standalone script
+        from catalog.password_manager import hasher
+
+        self.password_hash = hasher.hash(password)
 
     def verify_password(self, password):
         """Called when user needs credentials validated"""
 
-        return pwd_context.verify(password, self.password_hash)
+        from catalog.password_manager import hasher
+
+        return hasher.verify(password, self.password_hash)
+
+    def verify_and_update_password(self, password):
+        """Validates credentials and upgrades an outdated password hash.
+
+        The new hash is set on the record; the caller commits it.
 
-    # def generate_auth_token(self, expiration=600):
-    #     """Serializer encrypts to hide the id of the user"""
+        Args:
+            password (str): User-supplied password.
+        """
 
-    #     ser = Serializer(secret_key, expires_in=expiration)
+        from catalog.password_manager import hasher
 
-    #     return ser.dumps({"id":self.id})
+        valid, new_hash = hasher.verify_and_update(password,
+                                                   self.password_hash)
+        if valid and new_hash is not None:
+            self.password_hash = new_hash
+        return valid
+
+    def generate_auth_token(self, expiration=600):
+        """Serializer encrypts to hide the id of the user"""
+
+        ser = Serializer(secret_key, expires_in=expiration)
+
+        return ser.dumps({"id": self.id})
 
     @staticmethod
     def verify_auth_token(token):
@@ -87,6 +153,9 @@ class Category(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(80), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"))
+    # Kept up to date by catalog.item_counts
+    item_count = Column(Integer, nullable=False, default=0,
+                        server_default="0")
     user_id_rel = relationship("User")
 
     @property
@@ -96,7 +165,8 @@ class Category(Base):
         return {
             "id": self.id,
             "name": self.name,
-            "user_id": self.user_id
+            "user_id": self.user_id,
+            "item_count": self.item_count
         }
 
 
@@ -111,12 +181,39 @@ class Item(Base):
     image_file = Column(String(250), nullable=True, default=None)
     image_url = Column(String(250), nullable=True, default=None)
     create_date = Column(DateTime, default=func.now())
-    category_name = (Column(String(80), ForeignKey("categories.name"),
-                     default="Unsorted"))
+
+    # Items point at the category record, so renaming a category is a
+    # single-row update. Older databases keep an unused category_name
+    # column, copied into category_id by `migrations.py`.
+    category_id = Column(Integer, ForeignKey("categories.id"))
     category = relationship(Category)
     user_id = Column(Integer, ForeignKey("users.id"))
     user_id_rel = relationship("User")
 
+    # Category pages are read in (name, id) order from the first index, so
+    # a page costs the same anywhere in a large category. Item URLs name
+    # the item, so names are unique in each user's catalog.
+    __table_args__ = (Index("ix_items_category_id_name", "category_id",
+                            "name"),
+                      Index("ix_items_user_id_name", "user_id", "name",
+                            unique=True))
+
+    @hybrid_property
+    def category_name(self):
+        """Name of the item's category.
+
+        In queries it is a subquery on the category ID. Joining `Category`
+        is cheaper when many rows need it.
+        """
+
+        return self.category.name if self.category is not None else None
+
+    @category_name.expression
+    def category_name(cls):
+        return (select([Category.name])
+                .where(Category.id == cls.category_id)
+                .as_scalar().label("category_name"))
+
     @property
     def serialize(self):
         """Retruns serialized data for RESTful API feature."""
@@ -131,5 +228,51 @@ class Item(Base):
         }
 
 
-engine = create_engine("sqlite:///catalog/catalog.db")
-Base.metadata.create_all(engine)
+class Revocation(Base):
+    """Class for an OAuth token waiting to be revoked at its provider."""
+
+    __tablename__ = "revocations"
+
+    id = Column(Integer, primary_key=True)
+    provider = Column(String(20), nullable=False)
+    # Provider tokens have no documented maximum length
+    access_token = Column(Text, nullable=False)
+    provider_user_id = Column(String(250), nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt = Column(DateTime, nullable=False, default=func.now())
+    last_error = Column(String(250), nullable=True)
+
+
+class ChangeLog(Base):
+    """Class for one entry of the append-only log of catalog changes."""
+
+    __tablename__ = "change_log"
+
+    # AUTOINCREMENT keeps SQLite from reusing the IDs, which are sync tokens
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    kind = Column(String(20), nullable=False)
+    action = Column(String(20), nullable=False)
+    record_id = Column(Integer, nullable=False)
+    data = Column(Text, nullable=True)
+    created = Column(DateTime, nullable=False, default=func.now())
+
+
+class ChangeLogLock(Base):
+    """Class for the single row that orders writes to the change log.
+
+    A transaction updates it before logging changes and holds its lock
+    until it ends, so change log entries commit in ID order.
+    """
+
+    __tablename__ = "change_log_lock"
+
+    id = Column(Integer, primary_key=True)
+    writes = Column(Integer, nullable=False, default=0)
+
+
+if __name__ == "__main__":
+    engine = create_engine("sqlite:///catalog/catalog.db")
+    Base.metadata.create_all(engine)
@@ -0,0 +1,134 @@
+"""
+This module contains the HTTP caching policy of the public views and API.
+
+Public pages and API answers carry `Last-Modified`, taken from the time
+their owners' catalogs last changed, and a public `Cache-Control` with a
+short max-age, so browsers and a front proxy can reuse them. Responses
+vary on the session cookie. A response that sets a cookie, or whose
+session changed and will set one, is marked private instead, so a shared
+cache never hands one visitor's session to another. A request whose
+`If-Modified-Since` is still current gets a 304 before anything is
+queried or rendered.
+
+"""
+
+from flask import make_response, request, session
+from sqlalchemy import func
+from werkzeug.http import is_resource_modified
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Item, User
+
+# Cache policies, replaced by `init_app()`
+settings = {"page_max_age": 60, "api_max_age": 30}
+
+
+def _seconds(value):
+    # HTTP dates have no fractions of a second
+    if value is None:
+        return None
+    return value.replace(microsecond=0)
+
+
+def catalog_last_modified(owner):
+    """Returns when a user's catalog last changed, or None if unknown.
+
+    Args:
+        owner (:obj:`UserSnapshot`): The catalog's owner.
+    """
+
+    if owner.catalog_updated is not None:
+        return _seconds(owner.catalog_updated)
+
+    # Catalogs not changed since `catalog_updated` was added
+    db_session = session_factory()
+    try:
+        newest = (db_session.query(func.max(Item.create_date))
+                  .filter(Item.user_id == owner.id).scalar())
+    finally:
+        db_session.close()
+    return _seconds(newest)
+
+
+def api_last_modified(user_id=None):
+    """Returns when any catalog, or one user's catalog, last changed.
+
+    Args:
+        user_id (int): Restricts the answer to one user's catalog.
+    """
+
+    db_session = session_factory()
+    try:
+        updated = db_session.query(func.max(User.catalog_updated))
+        created = db_session.query(func.max(Item.create_date))
+        if user_id is not None:
+            updated = updated.filter(User.id == user_id)
+            created = created.filter(Item.user_id == user_id)
+        times = [t for t in (updated.scalar(), created.scalar()) if t]
+    finally:
+        db_session.close()
+    return _seconds(max(times)) if times else None
+
+
+def not_modified(last_modified, policy):
+    """Returns a 304 response if the client's copy is current, or None.
+
+    Args:
+        last_modified (:obj:`datetime`): When the resource last changed.
+        policy (callable): `public_page` or `public_api`.
+    """
+
+    if last_modified is None or request.method not in ("GET", "HEAD"):
+        return None
+    if is_resource_modified(request.environ, last_modified=last_modified):
+        return None
+    return policy(make_response("", 304), last_modified)
+
+
+def public(response, last_modified, max_age):
+    """Marks a response as cacheable by browsers and shared caches.
+
+    Args:
+        response: A view's return value.
+        last_modified (:obj:`datetime`): When the resource last changed.
+        max_age (int): Seconds the response may be reused unchecked.
+    """
+
+    response = make_response(response)
+    if (response.status_code not in (200, 304) or
+            request.method not in ("GET", "HEAD")):
+        return response
+
+    # The session is saved after the view, so its cookie is not set yet
+    if session.modified or "Set-Cookie" in response.headers:
+        response.cache_control.private = True
+        return response
+
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.vary.add("Cookie")
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+
+def public_page(response, last_modified):
+    """Applies the public page policy to a response."""
+
+    return public(response, last_modified, settings["page_max_age"])
+
+
+def public_api(response, last_modified):
+    """Applies the API policy to a response."""
+
+    return public(response, last_modified, settings["api_max_age"])
+
+
+def init_app(app):
+    """Applies the HTTP_CACHE_* settings of an app.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    settings["page_max_age"] = app.config["HTTP_CACHE_PAGE_MAX_AGE"]
+    settings["api_max_age"] = app.config["HTTP_CACHE_API_MAX_AGE"]
@@ -0,0 +1,135 @@
+"""
+This module maintains the item counters of users and categories.
+
+`User.item_count` and `Category.item_count` change in the same
+transaction as the items they count, through relative UPDATEs, so two
+writers committing at once never lose each other's changes and a
+rollback undoes both. `recount()` recomputes the counters from the items
+table, for databases that predate them or were edited by hand. Run it
+with catalog/scripts/repair_counts.py.
+
+"""
+
+from collections import defaultdict
+from sqlalchemy import bindparam, func, select
+from catalog.db_setup import Category, Item, User
+
+
+class Changes(object):
+    """Collects counter changes so each row is updated once.
+
+    Attributes:
+        users (dict): User IDs mapped to the change of their count.
+        categories (dict): Category IDs mapped to the change of their
+            count.
+    """
+
+    def __init__(self):
+        self.users = defaultdict(int)
+        self.categories = defaultdict(int)
+
+    def added(self, user_id, category_id, count=1):
+        """Counts items added to a category."""
+
+        self.users[user_id] += count
+        self.categories[category_id] += count
+
+    def removed(self, user_id, category_id, count=1):
+        """Counts items removed from a category."""
+
+        self.users[user_id] -= count
+        self.categories[category_id] -= count
+
+    def moved(self, from_category_id, to_category_id, count=1):
+        """Counts items moved between two categories of one user."""
+
+        if from_category_id != to_category_id:
+            self.categories[from_category_id] -= count
+            self.categories[to_category_id] += count
+
+    def apply(self, db_session):
+        """Writes the changes in the session's current transaction."""
+
+        _update(db_session, User.__table__, self.users)
+        _update(db_session, Category.__table__, self.categories)
+        self.users.clear()
+        self.categories.clear()
+
+
+def _update(db_session, table, deltas):
+    params = [{"b_id": record_id, "b_delta": delta}
+              for record_id, delta in deltas.items()
+              if delta and record_id is not None]
+    if not params:
+        return
+
+    db_session.execute(
+        table.update()
+        .where(table.c.id == bindparam("b_id"))
+        .values(item_count=table.c.item_count + bindparam("b_delta")),
+        params)
+
+
+def added(db_session, user_id, category_id, count=1):
+    """Counts items added to a category in the current transaction.
+
+    Args:
+        db_session (:obj:`Session`): The session that adds the items.
+        user_id (int): Owner of the items.
+        category_id (int): Category of the items.
+        count (int): Number of items.
+    """
+
+    changes = Changes()
+    changes.added(user_id, category_id, count)
+    changes.apply(db_session)
+
+
+def removed(db_session, user_id, category_id, count=1):
+    """Counts items deleted from a category in the current transaction."""
+
+    changes = Changes()
+    changes.removed(user_id, category_id, count)
+    changes.apply(db_session)
+
+
+def moved(db_session, from_category_id, to_category_id, count=1):
+    """Counts items moved to another category in the current transaction."""
+
+    changes = Changes()
+    changes.moved(from_category_id, to_category_id, count)
+    changes.apply(db_session)
+
+
+def recount(connection, user_id=None):
+    """Recomputes counters that differ from the items table.
+
+    Args:
+        connection: A session, connection or engine to run the UPDATEs
+            on. A session's caller commits them.
+        user_id (int): Restricts the repair to one user and their
+            categories.
+
+    Returns:
+        dict: Numbers of "users" and "categories" rows corrected, and
+            the set of "user_ids" whose counters changed.
+    """
+
+    fixed = {"user_ids": set()}
+    for name, table, key in (("users", User.__table__, Item.user_id),
+                             ("categories", Category.__table__,
+                              Item.category_id)):
+        actual = (select([func.count(Item.id)])
+                  .where(key == table.c.id).as_scalar())
+        wrong = ((table.c.item_count != actual) |
+                 table.c.item_count.is_(None))
+        owner = table.c.id if name == "users" else table.c.user_id
+        if user_id is not None:
+            wrong = wrong & (owner == user_id)
+        fixed["user_ids"].update(
+            row[0] for row in connection.execute(
+                select([owner]).where(wrong).distinct()))
+        query = table.update().where(wrong).values(item_count=actual)
+        fixed[name] = connection.execute(query).rowcount
+
+    return fixed
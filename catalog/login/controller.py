@@ -3,31 +3,29 @@ This module contains functions for user login and various signup methods.
 
 """
 
+import base64
 import json
 import random
 import string
 import re
 import os
-import requests
+import time
+import urllib
+import urlparse
 from flask import (abort, Blueprint, flash, g, jsonify, make_response,
                    redirect, render_template, request, url_for)
 from flask import session as login_session
 from catalog.db_setup import User, Category
 from catalog.connection_manager import DBSession
+from catalog.password_manager import PasswordBusy
+from catalog import (catalog_snapshot, change_log, page_cache, session_store,
+                     user_service)
+from catalog.login import http_client, provider_config, revocation
 from sqlalchemy.orm.exc import NoResultFound
 
-# Google Plus specific
-from oauth2client.client import flow_from_clientsecrets
-from oauth2client.client import FlowExchangeError
-from oauth2client.client import OAuth2Credentials
-
-# Twitter specific
-# https://github.com/joestump/python-oauth2
-import oauth2 as oauth
-import base64
-import time
-import urllib
-import urlparse
+# The provider libraries (oauth2client, httplib2 and python-oauth2) are
+# imported by the views that use them, so workers only load them once a
+# user logs in with that provider
 
 # For standard login validation
 USER_RE = re.compile(r"^[a-zA-Z0-9_]{7,20}$")
@@ -37,7 +35,8 @@ PASS_RE = re.compile(r"^.{12,24}$")
 # Login now accessed in other modules via @bp_login.route(URL)
 bp_login = Blueprint("bp_login", __name__, template_folder="templates")
 
-session = DBSession()
+# Proxy to the current thread's session, removed after each request
+session = DBSession
 
 
 def create_user(logses):
@@ -58,7 +57,10 @@ def create_user(logses):
     # All new users get a permanent default folder called "Unsorted"
     new_category = Category(name="Unsorted", user_id=user.id)
     session.add(new_category)
+    catalog_snapshot.category_saved(session, new_category)
+    change_log.category_changed(session, new_category, change_log.CREATE)
     session.commit()
+    user_service.invalidate(user.id, email)
 
     # They also get their own directory for storing image files
     upload_dir = "catalog/static/uploads"
@@ -70,18 +72,13 @@ def create_user(logses):
 
 
 def get_user_info(usrid):
-    """Uses user ID to get a user's database record.
+    """Uses user ID to get a cached snapshot of a user's database record.
 
     Args:
         userid (int): User's accociated database `id` key value.
     """
 
-    try:
-        user = session.query(User).filter_by(id=usrid).one()
-        return user
-    except NoResultFound:
-        msg = "Could not find that user's data."
-        return None
+    return user_service.get_user(usrid)
 
 
 def get_user_id(email):
@@ -91,12 +88,10 @@ def get_user_id(email):
         email (str): User's associated email address.
     """
 
-    try:
-        user = session.query(User).filter_by(email=email).one()
-        return user.id
-    except NoResultFound:
-        msg = "Could not find that user's data."
+    user = user_service.get_user_by_email(email)
+    if user is None:
         return None
+    return user.id
 
 
 def gen_csrf_token():
@@ -106,40 +101,33 @@ def gen_csrf_token():
         string.ascii_uppercase + string.digits) for x in xrange(32))
 
 
+def provider_unavailable(provider):
+    """Builds the response for a provider call that failed or timed out.
+
+    Args:
+        provider (str): Display name of the OAuth provider.
+    """
+
+    msg = "{} could not be reached. Please try again.".format(provider)
+    response = make_response(jsonify(response=msg), 504)
+    return response
+
+
 def purge_session():
     """Clears out all login_session values."""
 
     access_token = login_session["access_token"]
     provider = login_session["provider"]
 
+    # Tokens are revoked in the background, so logout never waits on them
     if provider == "google":
-        revoke_url = ("https://accounts.google.com/o/oauth2/revoke?token={}"
-                      .format(access_token))
-        revoke_data = requests.get(revoke_url)
-        revoke_obj = json.loads(revoke_data.text)
-
-        if "error" not in revoke_obj.keys():
-            del login_session["gplus_id"]
-        else:
-            msg = ("Error @purge_session -- {}"
-                   .format(revoke_obj["error_description"]))
-            response = make_response(jsonify(response=msg), 401)
-            return response
+        revocation.enqueue("google", access_token)
+        del login_session["gplus_id"]
 
     if provider == "facebook":
-        facebook_id = login_session["facebook_id"]
-        revoke_url = ("https://graph.facebook.com/{}/permissions?"
-                      "access_token={}".format(facebook_id, access_token))
-        revoke_data = requests.get(revoke_url)
-        revoke_obj = json.loads(revoke_data.text)
-
-        if "error" not in revoke_obj.keys():
-            del login_session["facebook_id"]
-        else:
-            msg = ("Error @purge_session -- {}"
-                   .format(revoke_obj["error"]["message"]))
-            response = make_response(jsonify(response=msg), 401)
-            return response
+        revocation.enqueue("facebook", access_token,
+                           login_session["facebook_id"])
+        del login_session["facebook_id"]
 
     if provider == "twitter":
         del login_session["twt_token_secret"]
@@ -251,14 +239,27 @@ def signup():
                                    PASSD_CNF=fm_passd_cnf, ERRORS=errors)
         else:
             user = User(username=fm_username, email=fm_email)
-            user.hash_password(fm_passd)
+            try:
+                user.hash_password(fm_passd)
+            except PasswordBusy:
+                flash("Signup is busy. Please try again.")
+                state = login_session["state"]
+                response = make_response(render_template(
+                    "signup.html", STATE=state, USERNAME=fm_username,
+                    EMAIL=fm_email, EMAIL_CNF=fm_email_cnf, PASSD="",
+                    PASSD_CNF="", ERRORS={}), 503)
+                return response
             session.add(user)
             session.commit()
 
             # Create default permanent "Unsorted" folder and image directory
             new_category = Category(name="Unsorted", user_id=user.id)
             session.add(new_category)
+            catalog_snapshot.category_saved(session, new_category)
+            change_log.category_changed(session, new_category,
+                                        change_log.CREATE)
             session.commit()
+            user_service.invalidate(user.id, fm_email)
             upload_dir = "catalog/static/uploads"
             user_dir = os.path.join(upload_dir, str(user.id))
             os.mkdir(user_dir)
@@ -334,6 +335,7 @@ def user_settings():
                                         PUBLIC=user.public, PROVIDER=provider,
                                         ERRORS=errors), code=302)
             else:
+                old_email = user.email
                 user.email = fm_email
                 login_session["email"] = fm_email
 
@@ -341,6 +343,11 @@ def user_settings():
                 if fm_yn == "N":
                     user.public = False
 
+                page_cache.catalog_changed(session, user.id)
+                session.commit()
+                user_service.invalidate(user.id, old_email)
+                user_service.invalidate(email=fm_email)
+
                 flash("You have successfully updated your settings.")
                 return redirect(url_for("bp_main.welcome"), code=302)
         else:
@@ -406,15 +413,40 @@ def user_settings():
                 flash("No account changes made.")
                 return redirect(url_for("bp_main.welcome"), code=302)
             else:
+                old_email = user.email
                 user.username = fm_username
                 user.email = fm_email
 
                 if skip_passd is False:
-                    user.hash_password(fm_passd)
+                    try:
+                        user.hash_password(fm_passd)
+                    except PasswordBusy:
+                        session.rollback()
+                        errors["err_busy"] = ("Settings are busy. Please "
+                                              "try again.")
+                        state = login_session["state"]
+                        response = make_response(render_template(
+                            "settings.html", STATE=state, MSG="",
+                            USERNAME=user.username, EMAIL=user.email,
+                            EMAIL_CNF=user.email, PASSD="", PASSD_CNF="",
+                            USERID=user.id, PUBLIC=user.public,
+                            PROVIDER=provider, ERRORS=errors), 503)
+                        return response
 
                 login_session["username"] = user.username
                 login_session["email"] = user.email
 
+                page_cache.catalog_changed(session, user.id)
+                session.commit()
+                user_service.invalidate(user.id, old_email)
+                user_service.invalidate(email=user.email)
+
+                # Signs out the account's other sessions once the new
+                # password is stored
+                if skip_passd is False:
+                    session_store.revoke_user_sessions(
+                        user.id, keep=getattr(login_session, "sid", None))
+
                 flash("You have successfully updated your settings.")
                 return redirect(url_for("bp_main.welcome"), code=302)
         else:
@@ -454,7 +486,18 @@ def login():
             response = make_response(msg, 404)
             return response
 
-        if user.verify_password(fm_passd) is True:
+        try:
+            valid = user.verify_and_update_password(fm_passd)
+        except PasswordBusy:
+            msg = "<strong>Login is busy. Please try again.</strong>"
+            response = make_response(msg, 503)
+            return response
+
+        if valid is True:
+            # Saves the upgraded hash when the hashing settings changed
+            if user in session.dirty:
+                session.commit()
+
             login_session["provider"] = "catalog"
             login_session["user_id"] = user.id
             login_session["username"] = user.username
@@ -520,8 +563,8 @@ def connect_gpl():
     """Callback for client-site Google Plus OAuth login."""
 
     # Google OAuth login credentials from client_secrets_gpl.json
-    client_id = json.loads(open("catalog/login/client_secrets_gpl.json", "r")
-                           .read())["web"]["client_id"]
+    gpl_secrets = provider_config.secrets().google
+    client_id = gpl_secrets.client_id
 
     # Checks integrity of state value generated at login()
     # This guards against cross-site forgery attacks
@@ -531,12 +574,21 @@ def connect_gpl():
     # Grabs the one-time use code sent from from client
     code = request.data
 
+    # Google Plus specific
+    import httplib2
+    from oauth2client.client import FlowExchangeError, OAuth2WebServerFlow
+
     # Exchanging the one-time code to get credentials
     try:
-        oauth_flow = (flow_from_clientsecrets(
-            "catalog/login/client_secrets_gpl.json", scope=""))
-        oauth_flow.redirect_uri = "postmessage"
-        credentials = oauth_flow.step2_exchange(code)
+        oauth_flow = OAuth2WebServerFlow(
+            client_id, gpl_secrets.client_secret, scope="",
+            redirect_uri="postmessage", auth_uri=gpl_secrets.auth_uri,
+            token_uri=gpl_secrets.token_uri)
+
+        # oauth2client makes this call with httplib2, outside the pool
+        timeout = http_client.client.total_timeout("google")
+        credentials = oauth_flow.step2_exchange(
+            code, http=httplib2.Http(timeout=timeout))
     except FlowExchangeError:
         msg = "Failed to upgrade the authorization code."
         response = make_response(jsonify(response=msg), 401)
@@ -546,7 +598,10 @@ def connect_gpl():
     access_token = credentials.access_token
     auth_url = ("https://www.googleapis.com/oauth2/v1/tokeninfo?"
                 "access_token={}".format(access_token))
-    auth_data = requests.get(auth_url)
+    try:
+        auth_data = http_client.client.get("google", auth_url)
+    except http_client.ProviderError:
+        return provider_unavailable("Google")
     auth_obj = json.loads(auth_data.text)
 
     # Error and token checks
@@ -574,11 +629,17 @@ def connect_gpl():
         flash("Current user is already connected.")
         return redirect(url_for("bp_main.welcome"), code=302)
 
-    credentials = login_session["access_token"] = credentials.access_token
+    login_session["access_token"] = access_token
     login_session["gplus_id"] = gplus_id
+
+    # The token is only used for the profile once it passed the checks
     userinfo_url = "https://www.googleapis.com/oauth2/v1/userinfo"
-    params = {"access_token": credentials, "alt": "json"}
-    user_data = requests.get(userinfo_url, params=params)
+    params = {"access_token": access_token, "alt": "json"}
+    try:
+        user_data = http_client.client.get("google", userinfo_url,
+                                           params=params)
+    except http_client.ProviderError:
+        return provider_unavailable("Google")
 
     # Extract data
     user_data = json.loads(user_data.text)
@@ -609,10 +670,9 @@ def connect_fb():
     if request.args.get("state") != login_session["state"]:
         abort(401)
 
-    client_id = json.loads(open("catalog/login/client_secrets_fb.json", "r")
-                           .read())["web"]["app_id"]
-    client_secret = (json.loads(open("catalog/login/client_secrets_fb.json",
-                                     "r").read())["web"]["app_secret"])
+    fb_secrets = provider_config.secrets().facebook
+    client_id = fb_secrets.app_id
+    client_secret = fb_secrets.app_secret
 
     exchange_token = request.data
 
@@ -621,13 +681,26 @@ def connect_fb():
                 "&fb_exchange_token={}"
                 .format(client_id, client_secret, exchange_token))
 
-    auth_data = requests.get(auth_url)
+    try:
+        auth_data = http_client.client.get("facebook", auth_url)
+    except http_client.ProviderError:
+        return provider_unavailable("Facebook")
     auth_obj = json.loads(auth_data.text)
     token = auth_obj["access_token"]
+
+    # The profile and picture only depend on the token, so they are
+    # fetched together
     user_url = ("https://graph.facebook.com/v2.9/me?access_token={}"
                 "&fields=name,id,email".format(token))
-    user_data = requests.get(user_url)
+    pic_url = ("https://graph.facebook.com/v2.9/me/picture?access_token={}"
+               "&redirect=0&height=200&width=200").format(token)
+    try:
+        user_data, pic_data = http_client.client.get_many("facebook", [
+            (user_url, {}), (pic_url, {})])
+    except http_client.ProviderError:
+        return provider_unavailable("Facebook")
     user_obj = json.loads(user_data.text)
+    pic_obj = json.loads(pic_data.text)
 
     login_session["provider"] = "facebook"
     name = login_session["username"] = user_obj["name"]
@@ -637,11 +710,6 @@ def connect_fb():
     # The token must be stored in the login_session in order to properly logout
     login_session["access_token"] = token
 
-    pic_url = ("https://graph.facebook.com/v2.9/me/picture?access_token={}"
-               "&redirect=0&height=200&width=200").format(token)
-    pic_data = requests.get(pic_url)
-    pic_obj = json.loads(pic_data.text)
-
     picture = login_session["picture"] = pic_obj["data"]["url"]
     user_id = get_user_id(email)
 
@@ -668,18 +736,18 @@ def auth_request(endpoint, method, fname="", body=""):
         body: (str): For Twitter's verifier code.
     """
 
+    # Twitter specific
+    # https://github.com/joestump/python-oauth2
+    import oauth2 as oauth
+
     state = gen_csrf_token()
 
     # Grab some values for params and oauth
-    consumer_key = (json.loads(open("catalog/login/client_secrets_twt.json",
-                                    "r").read())["web"]["consumer_key"])
-    consumer_key_sec = json.loads(open("catalog/login/client_secrets_twt.json",
-                                       "r").read())["web"]["client_secret"]
-    oauth_token = json.loads(open("catalog/login/client_secrets_twt.json", "r")
-                             .read())["web"]["access_token"]
-    oauth_token_sec = (json.loads(
-        open("catalog/login/client_secrets_twt.json", "r")
-        .read())["web"]["access_token_secret"])
+    twt_secrets = provider_config.secrets().twitter
+    consumer_key = twt_secrets.consumer_key
+    consumer_key_sec = twt_secrets.consumer_secret
+    oauth_token = twt_secrets.access_token
+    oauth_token_sec = twt_secrets.access_token_secret
 
     # Parameters required to make an authorized Twitter request
     params = {}
@@ -707,35 +775,9 @@ def auth_request(endpoint, method, fname="", body=""):
     signature_method = oauth.SignatureMethod_HMAC_SHA1()
     req.sign_request(signature_method, consumer, token)
 
-    # Get the key values from the request object and sort them
-    # OAuth spec says to sort lexigraphically
-    # The first item is not specified in the Twitter docs,
-    # so we exclude it
-    req_keys = sorted(req.keys()[1:])
-
-    # Build the required Authorization header value
-    # https://dev.twitter.com/oauth/overview/authorizing-requests
-    auth_header = "OAuth "
-
-    for k in req_keys:
-        val = urllib.quote(req[k])
-        k = urllib.quote(k)
-        auth_header += k
-        auth_header += '="'
-        auth_header += val
-        auth_header += '"'
-
-        if k == "oauth_version":
-            break
-        else:
-            auth_header += ", "
-
-    # Need to encode the header data
-    header = urllib.urlencode({"Authorization": auth_header})
-
-    client = oauth.Client(consumer, token)
-    data = client.request(endpoint, method=method, body=body,
-                          headers=header)[1]
+    # Sent like `oauth.Client.request()`, but through the provider pool
+    data = http_client.oauth_request("twitter", consumer, token, endpoint,
+                                     method=method, body=body)
     return data
 
 
@@ -761,7 +803,10 @@ def connect_twt():
     authenticate_url = "https://api.twitter.com/oauth/authenticate"
 
     # Execute signed request
-    token_data = auth_request(request_token_url, "POST", "connect_twt")
+    try:
+        token_data = auth_request(request_token_url, "POST", "connect_twt")
+    except http_client.ProviderError:
+        return provider_unavailable("Twitter")
 
     # https://docs.python.org/2/library/urlparse.html?highlight=parse_qs#urlparse.parse_qs
     token_dic = dict(urlparse.parse_qsl(token_data))
@@ -775,8 +820,12 @@ def connect_twt():
 
         # Now with the authorized request made, we can use the oauth_token
         # and send the redirect url to the authorization page to client
-        result = requests.get(authenticate_url,
-                              params={"oauth_token": oauth_token})
+        try:
+            result = http_client.client.get(
+                "twitter", authenticate_url,
+                params={"oauth_token": oauth_token})
+        except http_client.ProviderError:
+            return provider_unavailable("Twitter")
 
         # http://docs.python-requests.org/en/latest/api/
         # Return the redirect url for authenticate page
@@ -813,11 +862,14 @@ def auth_twt():
         oauth_token_secret = request.args.get("oauth_token_secret")
         login_session["twt_token_secret"] = oauth_token_secret
 
-        auth_request(access_token_url, "GET", "auth_twt", req_body)
         user_cred_url = ("https://api.twitter.com/1.1/account/"
                          "verify_credentials.json?include_email=true")
 
-        user_data = json.loads(auth_request(user_cred_url, "GET"))
+        try:
+            auth_request(access_token_url, "GET", "auth_twt", req_body)
+            user_data = json.loads(auth_request(user_cred_url, "GET"))
+        except http_client.ProviderError:
+            return provider_unavailable("Twitter")
 
         # Save for current session
         name = login_session["username"] = user_data["name"]
@@ -0,0 +1,301 @@
+"""
+This module contains the shared HTTP client for calls to OAuth providers.
+
+All provider calls go through one `requests.Session`, so TLS connections to
+Google, Facebook and Twitter are pooled and kept alive between logins. Each
+provider has its own (connect, read) timeout, failed connections and 5xx
+answers to idempotent requests are retried a limited number of times, and
+the latency of every call is recorded per provider. Independent calls can
+be made concurrently with `get_many()`. `requests` is only imported by the
+first call, and its errors are raised as `ProviderError`.
+
+`PROVIDER_BASE_URLS` can point a provider at another origin, such as the
+fake provider server in `catalog/scripts/fake_provider.py`.
+
+"""
+
+import logging
+import os
+import threading
+import time
+from cookielib import DefaultCookiePolicy
+from multiprocessing.pool import ThreadPool
+
+log = logging.getLogger(__name__)
+
+# Origins used by each provider's endpoints
+PROVIDER_ORIGINS = {
+    "google": ["https://www.googleapis.com", "https://accounts.google.com"],
+    "facebook": ["https://graph.facebook.com"],
+    "twitter": ["https://api.twitter.com"]
+}
+
+
+class ProviderError(Exception):
+    """Raised when a provider could not be reached or did not answer."""
+
+    pass
+
+
+class ProviderStats(object):
+    """Call count, error count and latency totals for one provider."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms, failed):
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if failed:
+            self.errors += 1
+
+    def as_dict(self):
+        mean = self.total_ms / self.calls if self.calls else 0.0
+        return {"calls": self.calls, "errors": self.errors,
+                "mean_ms": round(mean, 1), "max_ms": round(self.max_ms, 1)}
+
+
+class ProviderClient(object):
+    """Pooled, keep-alive HTTP client with per-provider settings.
+
+    Args:
+        pool_size (int): Connections kept open per provider host.
+        retries (int): Retries for failed connections and 5xx answers.
+        backoff (float): Backoff factor in seconds between retries.
+        timeouts (dict): Provider name to (connect, read) seconds.
+        base_urls (dict): Provider name to an origin replacing its own.
+        fanout_workers (int): Threads making concurrent calls.
+    """
+
+    def __init__(self, pool_size=10, retries=2, backoff=0.2, timeouts=None,
+                 base_urls=None, fanout_workers=8):
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._workers = None
+        self._session_pid = None
+        self._session = None
+        self.configure(pool_size, retries, backoff, timeouts, base_urls,
+                       fanout_workers)
+
+    def configure(self, pool_size, retries, backoff, timeouts, base_urls,
+                  fanout_workers):
+        """Replaces the settings and the connection pool of the client."""
+
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeouts = timeouts or {}
+        self.base_urls = base_urls or {}
+        self.fanout_workers = fanout_workers
+        self._pid = None
+        self._session_pid = None
+
+    @property
+    def session(self):
+        """The process's `requests.Session`, created on the first call.
+
+        `requests` is only imported then, so workers that never talk to a
+        provider do not load it, and a forked process does not reuse its
+        parent's connections.
+        """
+
+        with self._lock:
+            if self._session_pid != os.getpid():
+                self._session = self._make_session()
+                self._session_pid = os.getpid()
+            return self._session
+
+    def _make_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from requests.packages.urllib3.util.retry import Retry
+
+        # Only idempotent methods are retried after a read error or a 5xx
+        retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                      status_forcelist=(500, 502, 503, 504),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=len(PROVIDER_ORIGINS) * 2,
+                              pool_maxsize=self.pool_size, max_retries=retry)
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        # Cookies set for one user's call must not leak into another's
+        no_cookies = DefaultCookiePolicy(allowed_domains=[])
+        session.cookies.set_policy(no_cookies)
+        return session
+
+    def url(self, provider, url):
+        """Rewrites `url` to the provider's configured base URL, if any."""
+
+        base_url = self.base_urls.get(provider)
+        if base_url is None:
+            return url
+
+        for origin in PROVIDER_ORIGINS.get(provider, []):
+            if url.startswith(origin):
+                return base_url.rstrip("/") + url[len(origin):]
+        return url
+
+    def request(self, provider, method, url, **kwargs):
+        """Sends a request to a provider and records its latency.
+
+        Args:
+            provider (str): "google", "facebook" or "twitter".
+            method (str): HTTP action verb.
+            url (str): Endpoint of the provider API.
+            **kwargs: Passed on to `requests.Session.request()`.
+
+        Raises:
+            ProviderError: The connection failed or timed out.
+        """
+
+        session = self.session
+        from requests import RequestException
+
+        kwargs.setdefault("timeout", self.timeouts.get(provider))
+        failed = True
+        start = time.time()
+
+        try:
+            response = session.request(method, self.url(provider, url),
+                                       **kwargs)
+            failed = response.status_code >= 500
+            return response
+        except RequestException as err:
+            raise ProviderError("{} {} failed: {}".format(provider, method,
+                                                          err))
+        finally:
+            elapsed_ms = (time.time() - start) * 1000
+            with self._lock:
+                stats = self._stats.setdefault(provider, ProviderStats())
+                stats.record(elapsed_ms, failed)
+            log.debug("%s %s %s took %.1f ms", provider, method, url,
+                      elapsed_ms)
+
+    def total_timeout(self, provider):
+        """Returns the provider timeout as one number, for other clients."""
+
+        timeout = self.timeouts.get(provider)
+        if isinstance(timeout, tuple):
+            return sum(timeout)
+        return timeout
+
+    def get(self, provider, url, **kwargs):
+        """Sends a GET request to a provider."""
+
+        return self.request(provider, "GET", url, **kwargs)
+
+    def _get_workers(self):
+        # Thread pools do not survive a fork, so each process makes its own
+        with self._lock:
+            if self._pid != os.getpid():
+                self._workers = ThreadPool(self.fanout_workers)
+                self._pid = os.getpid()
+            return self._workers
+
+    def get_many(self, provider, calls):
+        """Sends independent GET requests to a provider concurrently.
+
+        Args:
+            provider (str): "google", "facebook" or "twitter".
+            calls (list): (url, kwargs) pairs, one per request.
+
+        Returns:
+            list: The responses, in the order of `calls`. The first failed
+            call raises its exception.
+        """
+
+        workers = self._get_workers()
+        results = [workers.apply_async(self.get, (provider, url), kwargs)
+                   for url, kwargs in calls]
+        return [result.get() for result in results]
+
+    def stats(self):
+        """Returns the latency metrics of every provider called so far."""
+
+        with self._lock:
+            return dict((name, stats.as_dict())
+                        for name, stats in self._stats.items())
+
+
+client = ProviderClient()
+
+
+def init_app(app):
+    """Applies the PROVIDER_* settings of an app to the shared client.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    config = app.config
+    client.configure(config["PROVIDER_POOL_SIZE"], config["PROVIDER_RETRIES"],
+                     config["PROVIDER_BACKOFF"], config["PROVIDER_TIMEOUTS"],
+                     config["PROVIDER_BASE_URLS"],
+                     config["PROVIDER_FANOUT_WORKERS"])
+
+
+def oauth_request(provider, consumer, token, uri, method="GET", body="",
+                  headers=None):
+    """Signs and sends a request the way python-oauth2's `Client` does.
+
+    `oauth.Client` is an httplib2 client, so its calls cannot share the
+    pool. This is its `request()` with only the transport replaced: the
+    signature and the placement of the OAuth parameters are the same.
+
+    Args:
+        provider (str): "google", "facebook" or "twitter".
+        consumer (:obj:`oauth.Consumer`): The application's credentials.
+        token (:obj:`oauth.Token`): The access token.
+        uri (str): Endpoint of the provider API.
+        method (str): HTTP action verb.
+        body (str): Request body.
+        headers (dict): Request headers.
+
+    Returns:
+        str: The response body, like the second value `Client.request()`
+        returns.
+    """
+
+    import oauth2 as oauth
+    from urlparse import parse_qs, urlparse, urlunparse
+
+    form_type = "application/x-www-form-urlencoded"
+
+    headers = dict(headers or {})
+
+    if method == "POST":
+        headers["Content-Type"] = headers.get("Content-Type", form_type)
+
+    is_form_encoded = headers.get("Content-Type") == form_type
+
+    if is_form_encoded and body:
+        parameters = parse_qs(body)
+    else:
+        parameters = None
+
+    req = oauth.Request.from_consumer_and_token(
+        consumer, token=token, http_method=method, http_url=uri,
+        parameters=parameters, body=body, is_form_encoded=is_form_encoded)
+    req.sign_request(oauth.SignatureMethod_HMAC_SHA1(), consumer, token)
+
+    scheme, netloc, path, params, query, fragment = urlparse(uri)
+    realm = urlunparse((scheme, netloc, "", None, None, None))
+
+    if is_form_encoded:
+        body = req.to_postdata()
+    elif method == "GET":
+        uri = req.to_url()
+    else:
+        headers.update(req.to_header(realm=realm))
+
+    response = client.request(provider, method, uri, data=body,
+                              headers=headers)
+    return response.content
@@ -0,0 +1,154 @@
+"""
+This module contains the cached store for the OAuth provider secrets.
+
+The client secrets of Google, Facebook and Twitter are read from their JSON
+files once, at startup, into an immutable `ProviderSecrets` snapshot that
+request handlers share. The files are only read again when one of their
+modification times changes, checked at most once every
+PROVIDER_SECRETS_CHECK_INTERVAL seconds by each process. This needs no
+signal handling, so it works the same in every worker whether or not the
+server loaded the app before forking. A file that fails to load keeps the
+previous snapshot in use.
+
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+GoogleSecrets = namedtuple("GoogleSecrets", [
+    "client_id", "client_secret", "auth_uri", "token_uri"])
+FacebookSecrets = namedtuple("FacebookSecrets", ["app_id", "app_secret"])
+TwitterSecrets = namedtuple("TwitterSecrets", [
+    "consumer_key", "consumer_secret", "access_token", "access_token_secret"])
+ProviderSecrets = namedtuple("ProviderSecrets", [
+    "google", "facebook", "twitter"])
+
+
+def parse_secrets(files):
+    """Builds a `ProviderSecrets` snapshot from the decoded JSON files.
+
+    Args:
+        files (dict): Provider name to the decoded contents of its file.
+    """
+
+    gpl = files["google"]["web"]
+    fb = files["facebook"]["web"]
+    twt = files["twitter"]["web"]
+
+    return ProviderSecrets(
+        google=GoogleSecrets(gpl["client_id"], gpl["client_secret"],
+                             gpl["auth_uri"], gpl["token_uri"]),
+        facebook=FacebookSecrets(fb["app_id"], fb["app_secret"]),
+        twitter=TwitterSecrets(twt["consumer_key"], twt["client_secret"],
+                               twt["access_token"],
+                               twt["access_token_secret"]))
+
+
+class SecretsStore(object):
+    """Holds the current provider secrets and reloads them when changed.
+
+    Args:
+        paths (dict): Provider name to the path of its secrets file.
+        check_interval (float): Minimum seconds between mtime checks.
+    """
+
+    def __init__(self, paths, check_interval=5):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self.configure(paths, check_interval)
+
+    def configure(self, paths, check_interval):
+        """Replaces the file paths and forces a reload on the next read."""
+
+        self.paths = dict(paths)
+        self.check_interval = check_interval
+        self._mtimes = None
+        self._checked = 0
+        self._stale = True
+
+    def _stat(self):
+        return dict((name, os.stat(path).st_mtime)
+                    for name, path in self.paths.items())
+
+    def load(self):
+        """Reads every secrets file and replaces the snapshot.
+
+        Raises:
+            IOError, ValueError, KeyError: A file is missing or malformed.
+        """
+
+        mtimes = self._stat()
+        files = {}
+        for name, path in self.paths.items():
+            with open(path, "r") as f:
+                files[name] = json.load(f)
+
+        self._snapshot = parse_secrets(files)
+        self._mtimes = mtimes
+        self._stale = False
+        log.info("Loaded OAuth provider secrets")
+        return self._snapshot
+
+    def _refresh(self):
+        # Only one thread reloads; the others keep using the old snapshot
+        if not self._lock.acquire(False):
+            return
+        try:
+            self._checked = time.time()
+            if not self._stale and self._stat() == self._mtimes:
+                return
+            self.load()
+        except (IOError, OSError, ValueError, KeyError) as err:
+            self._stale = False
+            log.error("Keeping previous OAuth provider secrets: %s", err)
+        finally:
+            self._lock.release()
+
+    def get(self):
+        """Returns the current `ProviderSecrets` snapshot."""
+
+        if self._snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    return self.load()
+
+        if self._stale or time.time() - self._checked >= self.check_interval:
+            self._refresh()
+        return self._snapshot
+
+
+store = SecretsStore({
+    "google": "catalog/login/client_secrets_gpl.json",
+    "facebook": "catalog/login/client_secrets_fb.json",
+    "twitter": "catalog/login/client_secrets_twt.json"
+})
+
+
+def secrets():
+    """Returns the current OAuth provider secrets."""
+
+    return store.get()
+
+
+def init_app(app):
+    """Loads the secrets files named by the PROVIDER_SECRETS_* settings.
+
+    Later edits to the files are found by the modification time check of
+    `SecretsStore.get()`.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    config = app.config
+    store.configure(config["PROVIDER_SECRETS_FILES"],
+                    config["PROVIDER_SECRETS_CHECK_INTERVAL"])
+
+    # Fails at startup rather than on the first login
+    store.load()
@@ -0,0 +1,215 @@
+"""
+This module contains the background queue for OAuth token revocations.
+
+Logging out only clears the local session. The provider token is written
+to the `revocations` table in the same request, and a background worker
+sends the revoke calls to Google or Facebook, retrying failures with an
+exponential backoff. Pending rows survive restarts and are picked up again
+by the next worker that starts.
+
+Every process runs its own worker, so a worker claims the due rows before
+sending them: it moves their `next_attempt` past a lease with a conditional
+UPDATE, and only the worker whose UPDATE changed the row sends it. A row
+claimed by a worker that died is due again once the lease runs out.
+
+"""
+
+import json
+import logging
+from datetime import datetime, timedelta
+from catalog.background import BatchWorker
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Revocation
+from catalog.login import http_client
+
+log = logging.getLogger(__name__)
+
+# Revocation settings, replaced by `init_app()`
+settings = {
+    "max_attempts": 8,
+    "backoff": 30,
+    "max_backoff": 6 * 60 * 60,
+    "batch_size": 20,
+    "lease": 5 * 60
+}
+
+
+class RevokeFailed(Exception):
+    """Raised when a provider did not confirm a revocation."""
+
+    pass
+
+
+def revoke_google(access_token, provider_user_id):
+    """Revokes a Google token. Unknown or expired tokens count as done."""
+
+    revoke_url = ("https://accounts.google.com/o/oauth2/revoke?token={}"
+                  .format(access_token))
+    revoke_data = http_client.client.get("google", revoke_url)
+
+    if revoke_data.status_code == 200:
+        return
+    if revoke_data.status_code == 400 and "invalid_token" in revoke_data.text:
+        return
+    raise RevokeFailed("Google answered {}".format(revoke_data.status_code))
+
+
+def revoke_facebook(access_token, provider_user_id):
+    """Removes the app's Facebook permissions for a user."""
+
+    revoke_url = ("https://graph.facebook.com/{}/permissions?"
+                  "access_token={}".format(provider_user_id, access_token))
+    revoke_data = http_client.client.request("facebook", "DELETE", revoke_url)
+
+    try:
+        revoke_obj = json.loads(revoke_data.text)
+    except ValueError:
+        raise RevokeFailed("Facebook answered {}"
+                           .format(revoke_data.status_code))
+
+    if "error" not in revoke_obj.keys():
+        return
+
+    # Code 190 means the token is already invalid
+    if revoke_obj["error"].get("code") == 190:
+        return
+    raise RevokeFailed(revoke_obj["error"].get("message", "Unknown error"))
+
+
+REVOKERS = {
+    "google": revoke_google,
+    "facebook": revoke_facebook
+}
+
+
+def claim_due(db_session, now):
+    """Claims the revocations that are due for this worker.
+
+    Each row is claimed with an UPDATE that only matches while its
+    `next_attempt` is unchanged, so a row due for several workers goes to
+    the one whose UPDATE counts it. The claims are committed at once.
+
+    Args:
+        db_session (:obj:`Session`): The worker's database session.
+        now (:obj:`datetime`): Current time.
+
+    Returns:
+        list: IDs of the claimed rows.
+    """
+
+    due = (db_session.query(Revocation.id, Revocation.next_attempt)
+           .filter(Revocation.next_attempt <= now)
+           .order_by(Revocation.next_attempt)
+           .limit(settings["batch_size"]).all())
+    lease = now + timedelta(seconds=settings["lease"])
+
+    claimed = []
+    for row in due:
+        updated = (db_session.query(Revocation)
+                   .filter(Revocation.id == row.id,
+                           Revocation.next_attempt == row.next_attempt)
+                   .update({"next_attempt": lease},
+                           synchronize_session=False))
+        if updated:
+            claimed.append(row.id)
+
+    db_session.commit()
+    return claimed
+
+
+def process_due(jobs=None):
+    """Sends the revocations that are due and reschedules failures.
+
+    Args:
+        jobs (list): Wake-up signals from `enqueue()`; not used.
+
+    Returns:
+        int: Number of revocations attempted.
+    """
+
+    db_session = session_factory()
+
+    try:
+        now = datetime.utcnow()
+        claimed = claim_due(db_session, now)
+        if not claimed:
+            return 0
+
+        revocations = (db_session.query(Revocation.id, Revocation.provider,
+                                        Revocation.access_token,
+                                        Revocation.provider_user_id,
+                                        Revocation.attempts)
+                       .filter(Revocation.id.in_(claimed)).all())
+
+        for revocation in revocations:
+            row = db_session.query(Revocation).filter_by(id=revocation.id)
+            try:
+                REVOKERS[revocation.provider](revocation.access_token,
+                                              revocation.provider_user_id)
+            except (http_client.ProviderError, RevokeFailed) as err:
+                attempts = revocation.attempts + 1
+
+                if attempts >= settings["max_attempts"]:
+                    log.warning("Giving up revoking %s token %d: %s",
+                                revocation.provider, revocation.id, err)
+                    row.delete(synchronize_session=False)
+                else:
+                    delay = min(settings["backoff"] * 2 ** (attempts - 1),
+                                settings["max_backoff"])
+                    retry = now + timedelta(seconds=delay)
+                    row.update({"attempts": attempts,
+                                "last_error": str(err)[:250],
+                                "next_attempt": retry},
+                               synchronize_session=False)
+            else:
+                row.delete(synchronize_session=False)
+
+        db_session.commit()
+        return len(revocations)
+    finally:
+        db_session.close()
+
+
+worker = BatchWorker("oauth-revoker", process_due, periodic=process_due,
+                     period=60)
+
+
+def init_app(app):
+    """Applies the REVOCATION_* settings of an app.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    config = app.config
+    settings["max_attempts"] = config["REVOCATION_MAX_ATTEMPTS"]
+    settings["backoff"] = config["REVOCATION_BACKOFF"]
+    settings["lease"] = config["REVOCATION_LEASE"]
+    worker.period = config["REVOCATION_POLL_INTERVAL"]
+
+    # Picks up revocations left pending by earlier processes
+    app.before_first_request(worker.start)
+
+
+def enqueue(provider, access_token, provider_user_id=None):
+    """Stores a token for revocation and wakes the worker.
+
+    The row is committed on a session of its own, so whatever the request
+    has pending is left for the request to commit or roll back.
+
+    Args:
+        provider (str): "google" or "facebook".
+        access_token (str): The token to revoke.
+        provider_user_id (str): The user's ID at the provider, if needed.
+    """
+
+    db_session = session_factory()
+    try:
+        db_session.add(Revocation(provider=provider,
+                                  access_token=access_token,
+                                  provider_user_id=provider_user_id,
+                                  next_attempt=datetime.utcnow()))
+        db_session.commit()
+    finally:
+        db_session.close()
+    worker.put(None)
@@ -3,34 +3,40 @@ This module controls CRUD operations for Category and Item data.
 
 """
 
+import base64
 import json
 import os
 import re
 import time
-from flask import (abort, Blueprint, flash, g, jsonify, make_response,
-                   redirect, render_template, request, url_for)
+from flask import (abort, Blueprint, current_app, flash, g, jsonify,
+                   make_response, redirect, render_template, request,
+                   Response, url_for)
 from flask import session as login_session
 
 # For password protecting resources
 # https://flask-httpauth.readthedocs.io/en/latest/
 from flask_httpauth import HTTPBasicAuth
 
-from sqlalchemy import asc, desc, join
+from sqlalchemy import and_, asc, desc, join, or_
 from catalog.db_setup import Base, Category, Item, User
 from catalog.login import controller as login_utils
+from catalog.login import provider_config
+from catalog.password_manager import PasswordBusy
+from catalog import (autocomplete, bulk_writer, catalog_snapshot,
+                     change_log, http_cache, item_counts, page_cache,
+                     token_manager, transfer, upload_manager)
 from catalog.rlimiter import controller as rlimiter
 from catalog.connection_manager import DBSession
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.orm import contains_eager
 from sqlalchemy.orm.exc import NoResultFound
 
 # For photo upload feature
 from werkzeug.exceptions import RequestEntityTooLarge
-from werkzeug.utils import secure_filename
 BASE_URL = "http://localhost"
 
 auth = HTTPBasicAuth()
-session = DBSession()
+# Proxy to the current thread's session, removed after each request
+session = DBSession
 bp_main = Blueprint("bp_main", __name__, template_folder="templates")
 
 
@@ -73,47 +79,195 @@ class Image(object):
             filename.rsplit(".", 1)[1].lower() in allowed_ext
 
 
-# @bp_main.route("/token")
-# @auth.login_required
-# def get_auth_token():
-#     """Generates a temporary token for accessing protected resources.
+def image_url(user_id, filename):
+    """Returns the URL of an image file placed without the upload forms.
 
-#     The generated token is passed as an argument in `verify_password()`
-#     and used as a more secure verification alternative to username
-#     (email in this project) and password.
-#     """
+    Args:
+        user_id (int): User's database record number.
+        filename (str): Image file's filename.
+    """
+
+    return Image(BASE_URL, user_id, filename).path_url
+
+
+def category_named(categories, name):
+    """Returns the category a form selected by name.
+
+    Args:
+        categories (list): The user's `Category` records.
+        name (unicode): Category name sent by the client.
+    """
+
+    for category in categories:
+        if category.name == name:
+            return category
+    abort(400)
+
+
+def encode_cursor(name, item_id):
+    """Returns the page cursor that points at an item of a category page.
+
+    Args:
+        name (unicode): Name of the first or last item shown on a page.
+        item_id (int): Its database record number.
+    """
 
-#     token = g.user.generate_auth_token()
-#     response = make_response(jsonify(token=token.decode("ascii")), 200)
-#     return response
+    value = json.dumps([name, item_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(value.encode("utf-8")).rstrip("=")
 
 
-# @auth.verify_password
-# def verify_password(email_or_token, password):
-#     """Callback for @auth.login_required.
+def decode_cursor(value):
+    """Returns the (name, id) pair of a page cursor from a URL.
 
-#     Handles the `@auth.login_required` to protect sensitive resources.
+    Args:
+        value (unicode): Cursor made by `encode_cursor()`.
+    """
 
-#     Args:
-#         email_or_token (str): User email address or token generated by
-#         `get_auth_token()`.
-#         password (str): User's hashed password.
-#     """
+    try:
+        padded = str(value) + "=" * (-len(value) % 4)
+        name, item_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (TypeError, ValueError, UnicodeError):
+        abort(400)
+    if not isinstance(name, basestring) or not isinstance(item_id, int):
+        abort(400)
+    return name, item_id
 
-#     user_id = User.verify_auth_token(email_or_token)
 
-#     if user_id is True:
-#         user = session.query(User).filter_by(id=user_id).one()
-#     else:
-#         # xxx Why can't we use one() here? It returns None??
-#         user = (session.query(User).filter_by(email=email_or_token)
-#                 .one_or_none())
+def cursor_in_category(category_id, cursor):
+    """Checks if a page cursor points at an item of a category.
 
-#         if not user or not user.verify_password(password):
-#             return False
+    Args:
+        category_id (int): The category's database record number.
+        cursor (tuple): The (name, id) pair of a decoded cursor.
+    """
 
-#     g.user = user
-#     return True
+    name, item_id = cursor
+    query = session.query(Item.id).filter_by(id=item_id, name=name,
+                                             category_id=category_id)
+    return query.first() is not None
+
+
+def item_page(category_id, after=None, before=None):
+    """Returns one page of a category's items, ordered by name.
+
+    Pages are found by the (name, id) of the item next to them rather than
+    by an offset, so every page costs one range read of the category's
+    index, however deep it is.
+
+    Args:
+        category_id (int): The category's database record number.
+        after (tuple): Cursor of the item before the page.
+        before (tuple): Cursor of the item after the page.
+
+    Returns:
+        tuple: The items, the cursor of the previous page and the cursor of
+        the next page, None when there is no such page.
+    """
+
+    size = current_app.config["CATEGORY_PAGE_SIZE"]
+    query = session.query(Item).filter(Item.category_id == category_id)
+
+    if before is not None:
+        name, item_id = before
+        items = (query.filter(Item.name <= name,
+                              or_(Item.name < name, Item.id < item_id))
+                 .order_by(desc(Item.name), desc(Item.id))
+                 .limit(size + 1).all())
+        more_before, more_after = len(items) > size, True
+        items = items[:size][::-1]
+    else:
+        if after is not None:
+            name, item_id = after
+            query = query.filter(Item.name >= name,
+                                 or_(Item.name > name, Item.id > item_id))
+        items = (query.order_by(asc(Item.name), asc(Item.id))
+                 .limit(size + 1).all())
+        more_before, more_after = after is not None, len(items) > size
+        items = items[:size]
+
+    if not items:
+        return items, None, None
+    prev_cursor = (encode_cursor(items[0].name, items[0].id)
+                   if more_before else None)
+    next_cursor = (encode_cursor(items[-1].name, items[-1].id)
+                   if more_after else None)
+    return items, prev_cursor, next_cursor
+
+
+def data_not_found():
+    """Returns the 404 response for missing users, categories and items."""
+
+    msg = ("<strong>Data not found. That user may have deleted"
+           "their account.</strong>")
+    response = make_response(msg, 404)
+    return response
+
+
+@bp_main.route("/api/1.0/token")
+@rlimiter.rate_limiter(limit=30, per=60 * 1)
+@auth.login_required
+def get_auth_token():
+    """Generates a temporary token for accessing protected resources.
+
+    The generated token is passed as an argument in `verify_password()`
+    and used as a more secure verification alternative to username
+    (email in this project) and password.
+    """
+
+    if g.user is None:
+        # A token cannot be traded for a longer-lived one
+        abort(403)
+
+    token = token_manager.issue(g.user)
+    response = make_response(jsonify(
+        token=token.decode("ascii"),
+        duration=token_manager.settings["expiration"]), 200)
+    return response
+
+
+@auth.verify_password
+def verify_password(email_or_token, password):
+    """Callback for @auth.login_required.
+
+    Handles the `@auth.login_required` to protect sensitive resources.
+    Tokens are checked first and set only `g.user_id`, without touching
+    the database; email and password logins also set `g.user`.
+
+    Args:
+        email_or_token (str): User email address or token generated by
+        `get_auth_token()`.
+        password (str): User's plain-text password.
+    """
+
+    user_id = token_manager.verify(email_or_token)
+
+    if user_id is not None:
+        g.user_id = user_id
+        g.user = None
+        return True
+
+    if not password:
+        return False
+
+    user = (session.query(User).filter_by(email=email_or_token)
+            .first())
+
+    try:
+        if not user or not user.verify_and_update_password(password):
+            return False
+    except PasswordBusy:
+        abort(503)
+    except ValueError:
+        # OAuth accounts have no usable password hash
+        return False
+
+    # Saves the upgraded hash when the hashing settings changed
+    if user in session.dirty:
+        session.commit()
+
+    g.user_id = user.id
+    g.user = user
+    return True
 
 
 @bp_main.route("/api/1.0/", methods=["GET", "POST"])
@@ -125,7 +279,8 @@ def send_api_data():
 
     + limit: Restricts the number or results returned.
     + q: Specify categories or items.
-    + user_id: Restrict results to a specific user.
+    + user_id: Restrict results to a specific user, whose item count is
+      added to the response.
     + search: Get a specific item.
 
     Example GET request path:
@@ -133,6 +288,7 @@ def send_api_data():
     """
 
     data = {}
+    extra = {}
     params = {}
     query = request.args.get("q")
     limit = request.args.get("limit")
@@ -144,48 +300,368 @@ def send_api_data():
     if user_id is not None:
         params["user_id"] = user_id
 
-    if query is not None:
-        if query.lower() == "categories":
-            db_result = (session.query(Category).filter_by(**params)
-                         .order_by(Category.name).all())
-        elif query.lower() == "items":
-            db_result = (session.query(Item).filter_by(**params)
-                         .order_by(asc(Item.category_name)).all())
+    # Answers from the newest change to the catalogs in scope
+    try:
+        scope = int(user_id) if user_id is not None else None
+    except ValueError:
+        scope = None
+
+    last_modified = http_cache.api_last_modified(scope)
+    response = http_cache.not_modified(last_modified, http_cache.public_api)
+    if response is not None:
+        return response
+
+    if query is not None and query.lower() not in ("categories", "items"):
+        abort(400)
+    categories = query is not None and query.lower() == "categories"
+
+    # One user's catalog is answered from its snapshot, without the ORM
+    owner = login_utils.get_user_info(scope) if scope is not None else None
+
+    if owner is not None:
+        snapshot = catalog_snapshot.get(scope)
+        if categories:
+            db_result = [cat for cat in catalog_snapshot.categories(snapshot)
+                         if name is None or cat["name"] == name]
+            rows = [(cat["name"], cat) for cat in db_result]
         else:
-            abort(400)
+            db_result = [catalog_snapshot.item_data(item)
+                         for item in catalog_snapshot.items(snapshot)
+                         if name is None or item["name"] == name]
+            rows = [(item["category"], item) for item in db_result]
+        if owner.public is not True:
+            rows = []
+        else:
+            extra["item_count"] = catalog_snapshot.item_count(snapshot)
+    elif categories:
+        db_result = (session.query(Category).filter_by(**params)
+                     .order_by(Category.name).all())
+        rows = [(cat.name, cat.serialize) for cat in db_result
+                if cat.owner.public is True]
     else:
-        db_result = (session.query(Item).order_by(asc(Item.category_name))
-                     .all())
+        db_result = (session.query(Item).filter_by(**params)
+                     .join(Item.category)
+                     .options(contains_eager(Item.category))
+                     .order_by(asc(Category.name)).all())
+        rows = [(item.category_name, item.serialize) for item in db_result
+                if item.owner.public is True]
 
     data_length = len(db_result)
 
     if limit is not None and int(limit) < data_length:
         data_length = int(limit)
     if data_length > 0:
-        if query is not None:
-            if query.lower() == "categories":
-                for cat in db_result:
-                    if cat.owner.public is True:
-                        data.setdefault(cat.name, []).append(cat.serialize)
-            else:
-                for item in db_result:
-                    if item.owner.public is True:
-                        (data.setdefault(item.category_name, [])
-                         .append(item.serialize))
+        for group, record in rows:
+            data.setdefault(group, []).append(record)
 
+        # Listings of one kind are flattened, the full catalog is grouped
+        if query is not None:
             vals = data.values()
             data = [x for li in vals for x in li]
-        else:
-            for item in db_result:
-                if item.owner.public is True:
-                    data.setdefault(item.category_name,
-                                    []).append(item.serialize)
 
         msg = "Data found."
     else:
         msg = "No data found."
 
-    return make_response(jsonify(data=data, response=msg, status="200"), 200)
+    response = make_response(jsonify(data=data, response=msg, status="200",
+                                     **extra), 200)
+    return http_cache.public_api(response, last_modified)
+
+
+@bp_main.route("/api/1.0/changes")
+@rlimiter.rate_limiter(limit=300, per=30 * 1)
+def send_api_changes():
+    """Change feed request handler.
+
+    Returns the item and category changes made after a sync token, oldest
+    first, in JSON format. Parameters are as follows:
+
+    + since: Token from an earlier answer. Without it, no changes are
+      returned, only the current token.
+    + limit: Most changes returned, 100 by default and at most 1000.
+    + user_id: Restrict changes to a specific user.
+
+    Each change has its `token`, `kind` ("item" or "category"), `action`
+    ("create", "update" or "delete"), record `id`, `user_id`, the record
+    as `send_api_data()` shows it (None for deletes) and its `time`.
+    Item data also has the `category_id`; a category rename only lists
+    the category, whose entry has the new name. A consumer downloads the
+    catalog once after reading the current token, then asks for the
+    changes since the `next` token of each answer until `more` is false.
+    Changes replayed over newer data are harmless.
+
+    Example GET request path:
+        /api/1.0/changes?since=120&limit=50
+    """
+
+    try:
+        since = request.args.get("since")
+        since = int(since) if since is not None else None
+        limit = min(int(request.args.get("limit", 100)), 1000)
+        user_id = request.args.get("user_id")
+        user_id = int(user_id) if user_id is not None else None
+    except ValueError:
+        abort(400)
+
+    if limit < 1 or (since is not None and since < 0):
+        abort(400)
+
+    # New consumers start from the current token
+    if since is None:
+        response = make_response(jsonify(
+            data=[], next=str(change_log.latest()), more=False,
+            response="Current sync token.", status="200"), 200)
+        return response
+
+    changes, more = change_log.changes_since(since, limit, user_id)
+    next_token = changes[-1]["token"] if changes else str(since)
+    msg = "Changes found." if changes else "No changes found."
+
+    response = make_response(jsonify(data=changes, next=next_token,
+                                     more=more, response=msg, status="200"),
+                             200)
+    return response
+
+
+@bp_main.route("/api/1.0/autocomplete")
+@rlimiter.rate_limiter(limit=300, per=30 * 1)
+def send_api_autocomplete():
+    """Name autocomplete request handler.
+
+    Returns the item and category names starting with a prefix, ignoring
+    case and ordered by name, in JSON format. Answers come from the
+    in-memory indexes of `catalog.autocomplete`. Parameters are as
+    follows:
+
+    + prefix: Start of the names.
+    + q: categories or items, to complete one kind of name.
+    + user_id: Completes the names of one public catalog, or of the
+      signed-in user's own. All public catalogs by default.
+    + limit: Most names returned, at most AUTOCOMPLETE_LIMIT.
+
+    Example GET request path:
+        /api/1.0/autocomplete?prefix=uni&q=items&user_id=2
+    """
+
+    max_limit = current_app.config["AUTOCOMPLETE_LIMIT"]
+    prefix = request.args.get("prefix")
+    query = request.args.get("q")
+    try:
+        limit = min(int(request.args.get("limit", max_limit)), max_limit)
+        user_id = request.args.get("user_id")
+        user_id = int(user_id) if user_id is not None else None
+    except ValueError:
+        abort(400)
+
+    kinds = {None: None, "categories": autocomplete.CATEGORY,
+             "items": autocomplete.ITEM}
+    if prefix is None or limit < 1 or query not in kinds:
+        abort(400)
+
+    data = []
+    if user_id is None:
+        index = autocomplete.public_index()
+        data = index.search(prefix, kinds[query], limit)
+    else:
+        owner = login_utils.get_user_info(user_id)
+        if owner is None:
+            abort(404)
+
+        # Private catalogs only complete for their owner
+        if owner.public is True or login_session.get("user_id") == user_id:
+            index = autocomplete.user_index(user_id)
+            data = index.search(prefix, kinds[query], limit)
+
+    msg = "Data found." if data else "No data found."
+    return make_response(jsonify(data=data, response=msg, status="200"),
+                         200)
+
+
+def bulk_write(write, on_deleted=None):
+    """Applies a JSON batch of writes for the authenticated user.
+
+    Args:
+        write (function): `bulk_writer.write_items` or
+            `bulk_writer.write_categories`.
+        on_deleted (function): Called with the rows of deleted records
+            before the commit.
+    """
+
+    try:
+        creates, updates, deletes = bulk_writer.parse(
+            request.get_json(silent=True))
+    except bulk_writer.BulkError as err:
+        response = make_response(jsonify(response=str(err), status="400"),
+                                 400)
+        return response
+
+    atomic = request.args.get("atomic") == "1"
+    results, deleted = write(session, g.user_id, creates, updates, deletes,
+                             atomic)
+    if deleted and on_deleted is not None:
+        on_deleted(deleted)
+
+    counts = dict((status, 0) for status in
+                  ("created", "updated", "deleted", "error", "skipped"))
+    for result in results:
+        counts[result["status"]] += 1
+
+    if atomic and counts["error"]:
+        session.rollback()
+        status = 400
+        msg = "No changes made, some records are invalid."
+    else:
+        session.commit()
+        status = 200
+        msg = ("Some records are invalid." if counts["error"]
+               else "All records applied.")
+
+    response = make_response(jsonify(
+        data=results, created=counts["created"], updated=counts["updated"],
+        deleted=counts["deleted"], errors=counts["error"], response=msg,
+        status=str(status)), status)
+    return response
+
+
+@bp_main.route("/api/1.0/items/bulk", methods=["POST"])
+@rlimiter.rate_limiter(limit=30, per=60 * 1)
+@auth.login_required
+def bulk_items():
+    """Bulk item write handler.
+
+    Takes a JSON object with optional "create", "update" and "delete"
+    lists and applies them to the authenticated user's items in one
+    transaction. With `?atomic=1`, nothing is written if any record is
+    invalid. Each record gets a result with its `op`, `index` in its
+    list, `status` and item `id`, or the `error` that stopped it.
+
+    Example POST body:
+        {"create": [{"name": "Ball", "category": "Soccer"}],
+         "update": [{"id": 4, "description": "Size 5"}],
+         "delete": [{"id": 9}]}
+    """
+
+    def delete_images(deleted):
+        # Image files go once the deletes are committed
+        for row in deleted:
+            if row.image_file is not None and row.image_url is not None:
+                imginst = Image(BASE_URL, g.user_id, row.image_file)
+                upload_manager.delete_after_commit(session,
+                                                   imginst.path_local)
+
+    return bulk_write(bulk_writer.write_items, delete_images)
+
+
+@bp_main.route("/api/1.0/categories/bulk", methods=["POST"])
+@rlimiter.rate_limiter(limit=30, per=60 * 1)
+@auth.login_required
+def bulk_categories():
+    """Bulk category write handler.
+
+    Works like `bulk_items()`. Creates have a "name", updates an "id" and
+    a new "name" and deletes an "id". Items of deleted categories are
+    moved to "Unsorted".
+    """
+
+    return bulk_write(bulk_writer.write_categories)
+
+
+@bp_main.route("/api/1.0/export")
+@rlimiter.rate_limiter(limit=30, per=60 * 1)
+@auth.login_required
+def export_catalog():
+    """Catalog export handler.
+
+    Streams the authenticated user's account, categories and items.
+    Optional parameters are as follows:
+
+    + format: "ndjson" (default) or "csv".
+    + table: Table of a CSV export, "items" by default.
+    + tar: With 1, bundles all tables and the upload files in a tar
+      archive.
+    + images: With 0, leaves the upload files out of a tar archive.
+
+    Example GET request path:
+        /api/1.0/export?format=csv&tar=1
+    """
+
+    fmt = request.args.get("format", "ndjson")
+    table = request.args.get("table", "items")
+    if fmt not in ("ndjson", "csv") or table not in transfer.TABLES:
+        abort(400)
+
+    if request.args.get("tar") == "1":
+        images = request.args.get("images") != "0"
+        body = transfer.export_tar(fmt, g.user_id, images=images)
+        mimetype = "application/x-tar"
+        filename = "catalog.tar"
+    elif fmt == "ndjson":
+        body = transfer.export_ndjson(g.user_id)
+        mimetype = "application/x-ndjson"
+        filename = "catalog.ndjson"
+    else:
+        body = transfer.export_csv(table, g.user_id)
+        mimetype = "text/csv"
+        filename = "{}.csv".format(table)
+
+    response = Response(body, mimetype=mimetype)
+    response.headers["Content-Disposition"] = (
+        "attachment; filename={}".format(filename))
+    return response
+
+
+@bp_main.route("/api/1.0/import", methods=["POST"])
+@rlimiter.rate_limiter(limit=30, per=60 * 1)
+@auth.login_required
+def import_catalog():
+    """Catalog import handler.
+
+    Reads an export from the request body and adds its categories and
+    items to the authenticated user's catalog, committing in batches.
+    Existing categories are kept and existing items, matched by name, are
+    updated. Parameters are as follows:
+
+    + format: "ndjson" (default), "csv" or "tar".
+    + table: Table of a CSV body, "items" by default.
+    + skip: Records to pass over, the `position` of an interrupted import.
+
+    The answer has the `position` after the last committed record, the
+    counts of `applied` and `failed` records and the first errors.
+
+    Example POST request path:
+        /api/1.0/import?format=tar
+    """
+
+    fmt = request.args.get("format", "ndjson")
+    table = request.args.get("table", "items")
+    try:
+        skip = int(request.args.get("skip", 0))
+    except ValueError:
+        abort(400)
+    if fmt not in ("ndjson", "csv", "tar") or skip < 0:
+        abort(400)
+
+    importer = transfer.Importer(user_id=g.user_id, image_url=image_url,
+                                 skip=skip)
+    stream = request.stream
+
+    try:
+        if fmt == "ndjson":
+            importer.run(transfer.read_ndjson(stream))
+        elif fmt == "csv":
+            importer.run(transfer.read_csv(table, stream))
+        else:
+            importer.run(transfer.read_tar(stream, importer))
+    except transfer.TransferError as err:
+        response = make_response(jsonify(
+            response=str(err), status="400", **importer.report), 400)
+        return response
+
+    msg = ("Some records could not be imported." if importer.failed
+           else "Import complete.")
+    response = make_response(jsonify(response=msg, status="200",
+                                     **importer.report), 200)
+    return response
 
 
 @bp_main.route("/")
@@ -193,22 +669,18 @@ def welcome():
     """Handle for application main page."""
 
     if "username" in login_session:
-        user_id = login_session["user_id"]
-        db_categories = (session.query(Category).filter_by(user_id=user_id)
-                         .order_by(asc(Category.name)).all())
-        db_items = (session.query(Item).filter_by(user_id=user_id)
-                    .order_by(desc(Item.create_date)).limit(7).all())
-
-        return render_template("catalog.html", CATEGORIES=db_categories,
-                               RECENT_ITEMS=db_items)
+        snapshot = catalog_snapshot.get(login_session["user_id"])
+        return render_template(
+            "catalog.html",
+            CATEGORIES=catalog_snapshot.categories(snapshot),
+            ITEM_COUNT=catalog_snapshot.item_count(snapshot),
+            RECENT_ITEMS=catalog_snapshot.recent_items(snapshot))
     else:
         state = login_session["state"] = login_utils.gen_csrf_token()
-        gpl_id = json.loads(open("catalog/login/client_secrets_gpl.json", "r")
-                            .read())["web"]["client_id"]
-        fb_id = json.loads(open("catalog/login/client_secrets_fb.json", "r")
-                           .read())["web"]["app_id"]
+        secrets = provider_config.secrets()
         return render_template("login.html", STATE=state,
-                               GPL_ID=gpl_id, FB_ID=fb_id)
+                               GPL_ID=secrets.google.client_id,
+                               FB_ID=secrets.facebook.app_id)
 
 
 @bp_main.route("/<username>/<int:user_id>")
@@ -220,28 +692,41 @@ def user_public_page(user_id, username):
         username (str): User's registered username passed from URL.
     """
 
-    try:
-        db_user = session.query(User).filter_by(id=user_id).one()
-        db_categories = (session.query(Category).filter_by(user_id=user_id)
-                         .order_by(asc(Category.name)).all())
-        db_items = (session.query(Item).filter_by(user_id=user_id)
-                    .order_by(desc(Item.create_date)).limit(7).all())
-    except NoResultFound:
-        msg = ("<strong>Data not found. That user may have deleted"
-               "their account.</strong>")
-        response = make_response(msg, 404)
-        return response
-
     owner = login_utils.get_user_info(user_id)
 
-    if db_user.public is False:
+    if owner is None:
+        return data_not_found()
+
+    if owner.public is False:
         flash("That user set their data to private.")
         return redirect(url_for("bp_main.welcome"), code=302)
-    else:
-        msg = "Now visiting the page of {}".format(username)
+
+    def render():
+        snapshot = catalog_snapshot.get(user_id)
+
+        msg = "Now visiting the page of {}".format(owner.username)
         flash(msg)
-        return render_template("catalog_public.html", CATEGORIES=db_categories,
-                               RECENT_ITEMS=db_items, OWNER=owner)
+        return render_template(
+            "catalog_public.html",
+            CATEGORIES=catalog_snapshot.categories(snapshot),
+            ITEM_COUNT=catalog_snapshot.item_count(snapshot),
+            RECENT_ITEMS=catalog_snapshot.recent_items(snapshot), OWNER=owner)
+
+    # The page shows flashed messages, so pending ones must be rendered
+    if "_flashes" in login_session:
+        return render()
+
+    last_modified = http_cache.catalog_last_modified(owner)
+    response = http_cache.not_modified(last_modified, http_cache.public_page)
+    if response is not None:
+        return response
+
+    # The username in the URL can be anything, so the page is cached under
+    # the owner's own
+    key = url_for("bp_main.user_public_page", username=owner.username,
+                  user_id=user_id)
+    page = page_cache.cached(user_id, key, render)
+    return http_cache.public_page(page, last_modified)
 
 
 @bp_main.route("/<path:category_name>/<int:user_id>/")
@@ -253,33 +738,79 @@ def show_category(category_name, user_id):
         user_id (int): User ID value passed from the URL.
     """
 
-    try:
+    # Pages after or before an item, the first page without either
+    after = request.args.get("after")
+    before = request.args.get("before")
+    after = decode_cursor(after) if after is not None else None
+    before = decode_cursor(before) if before is not None else None
+
+    def query():
         db_category = (session.query(Category)
                        .filter_by(user_id=user_id, name=category_name).one())
-        db_items = (session.query(Item)
-                    .filter_by(user_id=user_id, category_name=category_name)
-                    .order_by(asc(Item.name)).all())
-    except NoResultFound:
-        msg = ("<strong>Data not found. That user may have deleted"
-               "their account.</strong>")
-        response = make_response(msg, 404)
-        return response
+        db_items, prev_cursor, next_cursor = item_page(db_category.id,
+                                                       after, before)
+        pages = {
+            "PREV_URL": (url_for("bp_main.show_category",
+                                 category_name=category_name,
+                                 user_id=user_id, before=prev_cursor)
+                         if prev_cursor else None),
+            "NEXT_URL": (url_for("bp_main.show_category",
+                                 category_name=category_name,
+                                 user_id=user_id, after=next_cursor)
+                         if next_cursor else None)
+        }
+        return db_category, db_items, pages
 
     # Allows to add more personalized info about item's creator
     owner = login_utils.get_user_info(user_id)
 
     # Determine whether to show the public view or the owner view
-    if "username" not in login_session or owner.id != login_session["user_id"]:
-        if owner.public is False:
-            flash("That user set their data to private.")
-            return redirect(url_for("bp_main.welcome"), code=302)
-        else:
-            return render_template("category_public.html",
-                                   CATEGORY=db_category,
-                                   ITEMS=db_items, OWNER=owner)
-    else:
+    if ("username" in login_session and owner is not None and
+            owner.id == login_session["user_id"]):
+        try:
+            db_category, db_items, pages = query()
+        except NoResultFound:
+            return data_not_found()
         return render_template("category.html", CATEGORY=db_category,
-                               ITEMS=db_items)
+                               ITEMS=db_items, **pages)
+
+    if owner is None:
+        return data_not_found()
+    if owner.public is False:
+        flash("That user set their data to private.")
+        return redirect(url_for("bp_main.welcome"), code=302)
+
+    def render():
+        try:
+            db_category, db_items, pages = query()
+        except NoResultFound:
+            return data_not_found()
+        page = render_template("category_public.html", CATEGORY=db_category,
+                               ITEMS=db_items, OWNER=owner, **pages)
+
+        # Only pages next to an item of the category are cached, so
+        # made-up cursors are answered without filling the cache
+        cursor = before or after
+        if cursor is not None and not cursor_in_category(db_category.id,
+                                                         cursor):
+            return make_response(page)
+        return page
+
+    last_modified = http_cache.catalog_last_modified(owner)
+    response = http_cache.not_modified(last_modified, http_cache.public_page)
+    if response is not None:
+        return response
+
+    # Pages are cached under their decoded cursor, so other query strings
+    # and encodings share an entry
+    key = request.path
+    if before is not None:
+        key += "?before=" + encode_cursor(*before)
+    elif after is not None:
+        key += "?after=" + encode_cursor(*after)
+
+    page = page_cache.cached(user_id, key, render)
+    return http_cache.public_page(page, last_modified)
 
 
 @bp_main.route("/<path:category_name>/<path:item_name>/<int:user_id>")
@@ -292,39 +823,56 @@ def item_info(category_name, item_name, user_id):
         user_id (int): User ID value passed from the URL.
     """
 
-    try:
+    def query():
         db_category = (session.query(Category)
                        .filter_by(user_id=user_id, name=category_name).one())
         db_item = (session.query(Item)
                    .filter_by(user_id=user_id, name=item_name).one())
-    except NoResultFound:
-        msg = ("<strong>Data not found. That user may have deleted"
-               "their account.</strong>")
-        response = make_response(msg, 404)
-        return response
 
-    owner = login_utils.get_user_info(db_category.user_id)
+        # We need the image path for the client view (img-tag src value)
+        img_src = None
+        img_filename = db_item.image_file
 
-    # We need the image path for the client view (img-tag src value)
-    img_src = None
-    img_filename = db_item.image_file
+        if img_filename is not None:
+            user_img = Image(BASE_URL, user_id, img_filename)
+            img_src = user_img.path_html
 
-    if img_filename is not None:
-        user_img = Image(BASE_URL, user_id, img_filename)
-        img_src = user_img.path_html
+        return db_category, db_item, img_src
 
-    if "username" not in login_session or owner.id != login_session["user_id"]:
-        if owner.public is False:
-            flash("That user set their data to private.")
-            return redirect(url_for("bp_main.welcome"), code=302)
-        else:
-            return render_template("item_public.html", ITEM=db_item,
-                                   ITEM_IMAGE=img_src, CATEGORY=db_category,
-                                   OWNER=owner)
-    else:
+    owner = login_utils.get_user_info(user_id)
+
+    if ("username" in login_session and owner is not None and
+            owner.id == login_session["user_id"]):
+        try:
+            db_category, db_item, img_src = query()
+        except NoResultFound:
+            return data_not_found()
         return render_template("item.html", ITEM=db_item, ITEM_IMAGE=img_src,
                                CATEGORY=db_category)
 
+    if owner is None:
+        return data_not_found()
+    if owner.public is False:
+        flash("That user set their data to private.")
+        return redirect(url_for("bp_main.welcome"), code=302)
+
+    def render():
+        try:
+            db_category, db_item, img_src = query()
+        except NoResultFound:
+            return data_not_found()
+        return render_template("item_public.html", ITEM=db_item,
+                               ITEM_IMAGE=img_src, CATEGORY=db_category,
+                               OWNER=owner)
+
+    last_modified = http_cache.catalog_last_modified(owner)
+    response = http_cache.not_modified(last_modified, http_cache.public_page)
+    if response is not None:
+        return response
+
+    page = page_cache.cached(user_id, request.path, render)
+    return http_cache.public_page(page, last_modified)
+
 
 @bp_main.route("/item/new", methods=["GET", "POST"])
 def create_item():
@@ -350,7 +898,8 @@ def create_item():
         try:
             img_obj = request.files["fm-image"]
         except RequestEntityTooLarge:
-            msg = "<strong>File size exceeded 1 MB limit.</strong>"
+            msg = ("<strong>File size exceeded {} MB limit.</strong>"
+                   .format(upload_manager.max_upload_mb()))
             return make_response(msg, 200)
 
         # For the new image file to add to the database, image save path
@@ -361,9 +910,10 @@ def create_item():
 
         if (Image.valid_img_request(img_obj) and
                 Image.valid_img_file(img_obj.filename)):
-            new_imgfile = secure_filename(img_obj.filename)
+            new_imgfile = upload_manager.content_name(img_obj)
 
-            # Check if and image file with that name already exists
+            # Files are named after their content, so this finds the same
+            # image on another item
             dup = (session.query(Item)
                    .filter_by(user_id=user_id, image_file=new_imgfile).count())
             if dup != 0:
@@ -373,7 +923,14 @@ def create_item():
             imginst = Image(BASE_URL, user_id, new_imgfile)
             img_path_loc = imginst.path_local
             img_path_url = imginst.path_url
-            img_obj.save(img_path_loc)
+
+            try:
+                upload_manager.save_upload(img_obj, img_path_loc)
+            except upload_manager.UploadError as err:
+                msg = "<strong>{}</strong>".format(err)
+                return make_response(msg, 200)
+
+            upload_manager.discard_on_rollback(session, img_path_loc)
 
         # Next we handle the rest of the form fields
         fm_name = request.form["fm-name"]
@@ -381,6 +938,7 @@ def create_item():
         fm_category = request.form["category_name"]
         db_items = (session.query(Item)
                     .filter_by(user_id=user_id, name=fm_name).count())
+        category = category_named(db_categories, fm_category)
 
         if fm_name == "":
             fm_name = "No title ({}|{})".format(user_id, int(time.time()))
@@ -390,10 +948,13 @@ def create_item():
 
         new_item = Item(name=fm_name, description=fm_description,
                         image_file=new_imgfile, image_url=img_path_url,
-                        category_name=fm_category, user_id=user_id)
+                        category=category, user_id=user_id)
 
         # Add to db and redirect
         session.add(new_item)
+        item_counts.added(session, user_id, category.id)
+        catalog_snapshot.item_saved(session, new_item)
+        change_log.item_changed(session, new_item, change_log.CREATE)
         session.commit()
         flash("New item added!")
         return redirect(url_for("bp_main.welcome"), code=302)
@@ -445,17 +1006,18 @@ def edit_item(item_name, user_id):
         try:
             img_obj = request.files["fm-image"]
         except RequestEntityTooLarge:
-            msg = "<strong>File size exceeded 1 MB limit.</strong>"
+            msg = ("<strong>File size exceeded {} MB limit.</strong>"
+                   .format(upload_manager.max_upload_mb()))
             return make_response(msg, 200)
 
         if fm_name == "":
             fm_name = "No title ({}|{})".format(user_id, int(time.time()))
 
-        # Remove old image file before updating
-        if db_item.image_file is not None:
-            old_imginst = Image(BASE_URL, user_id, db_item.image_file)
-            old_imgfile = old_imginst.path_local
-            os.remove(old_imgfile)
+        # Item names are unique in each user's catalog
+        if (fm_name != db_item.name and session.query(Item)
+                .filter_by(user_id=user_id, name=fm_name).count()):
+            flash("That item already exists!")
+            return redirect(url_for("bp_main.welcome"), code=302)
 
         new_imgfile = None
         img_path_loc = None
@@ -463,19 +1025,47 @@ def edit_item(item_name, user_id):
 
         if (Image.valid_img_request(img_obj) and
                 Image.valid_img_file(img_obj.filename)):
-            new_imgfile = secure_filename(img_obj.filename)
+            new_imgfile = upload_manager.content_name(img_obj)
+
+            # Two items never share a file, so deleting one keeps the other
+            dup = (session.query(Item)
+                   .filter(Item.user_id == user_id, Item.id != db_item.id,
+                           Item.image_file == new_imgfile).count())
+            if dup != 0:
+                msg = "<strong>That file already exists.</strong>"
+                return make_response(msg, 200)
+
             imginst = Image(BASE_URL, user_id, new_imgfile)
             img_path_loc = imginst.path_local
             img_path_url = imginst.path_url
-            img_obj.save(img_path_loc)
+
+            try:
+                upload_manager.save_upload(img_obj, img_path_loc)
+            except upload_manager.UploadError as err:
+                msg = "<strong>{}</strong>".format(err)
+                return make_response(msg, 200)
+
+        # Remove old image file once the update is committed
+        # A new file with the same name has already replaced it
+        if db_item.image_file != new_imgfile:
+            if db_item.image_file is not None:
+                old_imginst = Image(BASE_URL, user_id, db_item.image_file)
+                old_imgfile = old_imginst.path_local
+                upload_manager.delete_after_commit(session, old_imgfile)
+            if img_path_loc is not None:
+                upload_manager.discard_on_rollback(session, img_path_loc)
 
         # Update, commit and redirect
         db_item.name = fm_name
         db_item.description = fm_description
         db_item.image_file = new_imgfile
         db_item.image_url = img_path_url
-        db_item.category_name = fm_category
+        category = category_named(db_categories, fm_category)
+        item_counts.moved(session, db_item.category_id, category.id)
+        db_item.category = category
         session.add(db_item)
+        catalog_snapshot.item_saved(session, db_item)
+        change_log.item_changed(session, db_item, change_log.UPDATE)
         session.commit()
         flash("Item data updated!")
         return redirect(url_for("bp_main.welcome"), code=302)
@@ -518,14 +1108,17 @@ def delete_item(item_name, user_id):
             flash("You are not authorized to delete this.")
             return redirect(url_for("bp_main.welcome"), code=302)
 
-        # Delete the image file in Uploads/< user_id >
+        # Delete the image file in Uploads/< user_id > after the commit
         if db_item.image_file is not None and db_item.image_url is not None:
             imginst = Image(BASE_URL, user_id, db_item.image_file)
             img_path_loc = imginst.path_local
-            os.remove(img_path_loc)
+            upload_manager.delete_after_commit(session, img_path_loc)
 
         # Delete item record and redirect
         session.delete(db_item)
+        item_counts.removed(session, db_item.user_id, db_item.category_id)
+        catalog_snapshot.item_deleted(session, db_item)
+        change_log.item_changed(session, db_item, change_log.DELETE)
         session.commit()
         flash("Item deleted!")
         return redirect(url_for("bp_main.welcome"), code=302)
@@ -562,6 +1155,8 @@ def create_category():
 
         new_category = Category(user_id=user_id, name=fm_name)
         session.add(new_category)
+        catalog_snapshot.category_saved(session, new_category)
+        change_log.category_changed(session, new_category, change_log.CREATE)
         session.commit()
 
         flash("Category added!")
@@ -613,9 +1208,18 @@ def edit_category(category_name, user_id):
         elif fm_category_name == db_category.name:
             flash("Category name unchanged!")
             return redirect(url_for("bp_main.welcome"), code=302)
+        elif (session.query(Category)
+              .filter_by(user_id=user_id, name=fm_category_name).count()):
+            flash("That category already exists!")
+            return redirect(url_for("bp_main.welcome"), code=302)
         else:
+            # Items reference the category by ID, so they follow the
+            # new name
             db_category.name = fm_category_name
             session.add(db_category)
+            catalog_snapshot.category_saved(session, db_category)
+            change_log.category_changed(session, db_category,
+                                        change_log.UPDATE)
             session.commit()
 
             flash("Category name changed!")
@@ -671,11 +1275,22 @@ def delete_category(category_name, user_id):
             flash("Cancelled deletion.")
             return redirect(url_for("bp_main.welcome"), code=302)
 
-        (session.query(Item)
-         .filter_by(user_id=user_id, category_name=category_name)
-         .update({Item.category_name: "Unsorted"},
-                 synchronize_session="evaluate"))
+        # Deleted categories hand their items to "Unsorted"
+        if db_category.name == bulk_writer.UNSORTED:
+            flash("Cannot delete that category!")
+            return redirect(url_for("bp_main.welcome"), code=302)
+
+        unsorted = bulk_writer.unsorted_category(session, user_id)
+        change_log.items_moved(session, db_category, unsorted)
+        moved = (session.query(Item)
+                 .filter_by(category_id=db_category.id)
+                 .update({Item.category_id: unsorted.id},
+                         synchronize_session="evaluate"))
+        item_counts.moved(session, db_category.id, unsorted.id, moved)
         session.delete(db_category)
+        catalog_snapshot.category_deleted(session, db_category,
+                                          moved_to="Unsorted")
+        change_log.category_changed(session, db_category, change_log.DELETE)
         session.commit()
         flash("Category deleted!")
         return redirect(url_for("bp_main.welcome"), code=302)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+"""
+This script brings an existing database up to date with the models.
+
+`create_all()` only creates missing tables, so columns and indexes added
+to a model later are added here with ALTER TABLE and CREATE INDEX, and
+string columns that became Text are widened. Rows that would break a new
+unique index are renamed first. Data that moved to a new column is copied
+over once the column exists, new item counters are computed and the
+change log lock row is added. It runs when the application connects to
+the database, and can also be run by hand from the application root
+directory:
+
+    python catalog/migrations.py
+
+"""
+
+import logging
+import os
+import sys
+from sqlalchemy import Text, inspect, text
+
+log = logging.getLogger(__name__)
+
+
+def add_missing_columns(engine, metadata):
+    """Adds model columns that are missing from existing tables.
+
+    New columns must be nullable or have a server default, as existing
+    rows get no value.
+
+    Args:
+        engine (:obj:`Engine`): The database to update.
+        metadata (:obj:`MetaData`): The models' table definitions.
+
+    Returns:
+        list: "table.column" names of the columns added.
+    """
+
+    inspector = inspect(engine)
+    table_names = set(inspector.get_table_names())
+    added = []
+
+    for table in metadata.sorted_tables:
+        if table.name not in table_names:
+            continue
+
+        existing = set(column["name"]
+                       for column in inspector.get_columns(table.name))
+
+        for column in table.columns:
+            if column.name in existing:
+                continue
+
+            column_type = column.type.compile(dialect=engine.dialect)
+            engine.execute("ALTER TABLE {} ADD COLUMN {} {}".format(
+                table.name, column.name, column_type))
+            added.append("{}.{}".format(table.name, column.name))
+            log.info("Added column %s.%s", table.name, column.name)
+
+    return added
+
+
+def add_missing_indexes(engine, metadata):
+    """Creates model indexes that are missing from existing tables.
+
+    Args:
+        engine (:obj:`Engine`): The database to update.
+        metadata (:obj:`MetaData`): The models' table definitions.
+
+    Returns:
+        list: Names of the indexes created.
+    """
+
+    inspector = inspect(engine)
+    table_names = set(inspector.get_table_names())
+    added = []
+
+    for table in metadata.sorted_tables:
+        if table.name not in table_names:
+            continue
+
+        existing = set(index["name"]
+                       for index in inspector.get_indexes(table.name))
+
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+
+            index.create(bind=engine)
+            added.append(index.name)
+            log.info("Created index %s", index.name)
+
+    return added
+
+
+def widen_text_columns(engine, metadata):
+    """Turns length-limited string columns that became Text into Text.
+
+    SQLite does not enforce string lengths, so its tables are left as
+    they are.
+
+    Args:
+        engine (:obj:`Engine`): The database to update.
+        metadata (:obj:`MetaData`): The models' table definitions.
+
+    Returns:
+        list: "table.column" names of the columns changed.
+    """
+
+    if engine.dialect.name == "sqlite":
+        return []
+
+    inspector = inspect(engine)
+    table_names = set(inspector.get_table_names())
+    changed = []
+
+    for table in metadata.sorted_tables:
+        if table.name not in table_names:
+            continue
+
+        lengths = dict((column["name"], getattr(column["type"], "length",
+                                                None))
+                       for column in inspector.get_columns(table.name))
+
+        for column in table.columns:
+            if (not isinstance(column.type, Text) or
+                    lengths.get(column.name) is None):
+                continue
+
+            if engine.dialect.name == "mysql":
+                statement = "ALTER TABLE {} MODIFY {} TEXT {}NULL"
+            else:
+                statement = "ALTER TABLE {} ALTER COLUMN {} TYPE TEXT"
+            engine.execute(statement.format(
+                table.name, column.name,
+                "" if column.nullable else "NOT "))
+            changed.append("{}.{}".format(table.name, column.name))
+            log.info("Changed column %s.%s to TEXT", table.name,
+                     column.name)
+
+    return changed
+
+
+def rename_duplicate_items(engine):
+    """Renames items whose name their owner already uses.
+
+    Item names are unique in each catalog, and an older database may hold
+    duplicates that would stop the unique index from being created. The
+    oldest item keeps the name, the others get their ID appended.
+
+    Args:
+        engine (:obj:`Engine`): The database to update.
+
+    Returns:
+        int: Number of items renamed.
+    """
+
+    indexes = set(index["name"]
+                  for index in inspect(engine).get_indexes("items"))
+    if "ix_items_user_id_name" in indexes:
+        return 0
+
+    with engine.begin() as connection:
+        duplicates = connection.execute(text(
+            "SELECT id, name FROM items WHERE EXISTS ("
+            " SELECT 1 FROM items AS other"
+            " WHERE other.user_id = items.user_id"
+            " AND other.name = items.name AND other.id < items.id)")
+        ).fetchall()
+
+        for item_id, name in duplicates:
+            suffix = u" ({})".format(item_id)
+            connection.execute(
+                text("UPDATE items SET name = :name WHERE id = :id"),
+                name=name[:80 - len(suffix)] + suffix, id=item_id)
+
+    if duplicates:
+        log.info("Renamed %d item(s) with duplicate names",
+                 len(duplicates))
+    return len(duplicates)
+
+
+def backfill_category_ids(engine):
+    """Points the items of an older database at their category records.
+
+    Items used to reference their category by name. Each one gets the ID
+    of its owner's category of that name, or of the owner's "Unsorted"
+    category when there is none, as happened to the items of a category
+    that was renamed.
+
+    Args:
+        engine (:obj:`Engine`): The database to update.
+
+    Returns:
+        int: Number of items updated.
+    """
+
+    columns = set(column["name"]
+                  for column in inspect(engine).get_columns("items"))
+    if "category_name" not in columns:
+        return 0
+
+    count = text("SELECT COUNT(*) FROM items WHERE category_id IS NULL")
+
+    with engine.begin() as connection:
+        missing = connection.execute(count).scalar()
+        if not missing:
+            return 0
+
+        connection.execute(text(
+            "UPDATE items SET category_id = ("
+            " SELECT MIN(categories.id) FROM categories"
+            " WHERE categories.user_id = items.user_id"
+            " AND categories.name = items.category_name)"
+            " WHERE category_id IS NULL"))
+        connection.execute(text(
+            "UPDATE items SET category_id = ("
+            " SELECT MIN(categories.id) FROM categories"
+            " WHERE categories.user_id = items.user_id"
+            " AND categories.name = 'Unsorted')"
+            " WHERE category_id IS NULL"))
+        updated = missing - connection.execute(count).scalar()
+
+    log.info("Set the category_id of %d item(s)", updated)
+    return updated
+
+
+def add_change_log_lock(engine):
+    """Adds the row that orders change log writers, if it is missing.
+
+    Args:
+        engine (:obj:`Engine`): The database to update.
+    """
+
+    if engine.execute("SELECT COUNT(*) FROM change_log_lock").scalar():
+        return
+    engine.execute("INSERT INTO change_log_lock (id, writes) VALUES (1, 0)")
+    log.info("Added the change log lock row")
+
+
+def migrate(engine, metadata):
+    """Creates missing tables, columns and indexes and fills new columns.
+
+    Args:
+        engine (:obj:`Engine`): The database to update.
+        metadata (:obj:`MetaData`): The models' table definitions.
+
+    Returns:
+        list: "table.column" names of the columns added.
+    """
+
+    metadata.create_all(bind=engine)
+    added = add_missing_columns(engine, metadata)
+    rename_duplicate_items(engine)
+    add_missing_indexes(engine, metadata)
+    widen_text_columns(engine, metadata)
+    backfill_category_ids(engine)
+    add_change_log_lock(engine)
+
+    if "users.item_count" in added or "categories.item_count" in added:
+        # Imported here so this module has no model dependency otherwise
+        from catalog import item_counts
+
+        with engine.begin() as connection:
+            fixed = item_counts.recount(connection)
+        log.info("Counted the items of %d user(s) and %d category(ies)",
+                 fixed["users"], fixed["categories"])
+    return added
+
+
+if __name__ == "__main__":
+    # Makes the catalog package importable when run from the application root
+    sys.path.insert(0, os.getcwd())
+
+    from catalog.connection_manager import get_engine
+    from catalog.db_setup import Base
+
+    added = migrate(get_engine(), Base.metadata)
+    print "Added columns: {}".format(", ".join(added) or "none")
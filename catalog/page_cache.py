@@ -0,0 +1,285 @@
+"""
+This module contains the cache for rendered public catalog pages.
+
+Pages are stored under the owner's catalog version. The CRUD and settings
+handlers call `catalog_changed()`, which bumps it when their transaction
+commits, so an edit makes all of the owner's cached pages unreachable at
+once. Lookups try an in-process LRU
+cache first, then Redis, which is shared by every process.
+
+Only one renderer per page runs at a time. Other requests for the same
+page get the last rendered copy, even if it is from an older version,
+or wait for the renderer when there is none. If Redis is unreachable,
+versions are tracked per process, which misses other processes' edits, so
+pages are only cached locally and for PAGE_CACHE_FALLBACK_TTL seconds.
+
+"""
+
+import logging
+import threading
+import time
+import zlib
+from datetime import datetime
+from redis import RedisError
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from catalog import user_service
+from catalog.cache import LRUCache, MISSING
+from catalog.db_setup import User
+from catalog.redis_manager import get_redis
+
+log = logging.getLogger(__name__)
+
+# Page cache settings, replaced by `init_app()`
+settings = {
+    "enabled": True,
+    "redis": True,
+    "ttl": 300,
+    "lock_timeout": 10,
+    "wait": 2.0,
+    "fallback_ttl": 5
+}
+
+pages = LRUCache(maxsize=512)
+
+# Versions are only tracked here when Redis is not used or unreachable
+local_versions = {}
+
+# Key for owners parked on `Session.info` until the transaction ends
+PENDING_CHANGES = "page_cache.changes"
+
+# Renders of different pages rarely share a stripe, so a fixed set of
+# locks stands in for one lock per page
+_stripes = [threading.Lock() for x in xrange(64)]
+
+
+def _version_key(user_id):
+    return "catalog-version:{}".format(user_id)
+
+
+def current_version(user_id):
+    """Returns a user's catalog version and whether it is shared.
+
+    Returns:
+        tuple: The version, and False when it is this process's fallback
+        for an unreachable Redis, so data cached under it should only be
+        kept for `settings["fallback_ttl"]` seconds.
+    """
+
+    if settings["redis"]:
+        try:
+            return int(get_redis().get(_version_key(user_id)) or 0), True
+        except RedisError as err:
+            log.debug("Page cache using local versions: %s", err)
+            return local_versions.get(user_id, 0), False
+    return local_versions.get(user_id, 0), True
+
+
+def version(user_id):
+    """Returns the current catalog version of a user."""
+
+    return current_version(user_id)[0]
+
+
+def cache_ttl(shared, ttl):
+    """Returns how long to cache data tagged with a version.
+
+    Args:
+        shared (bool): Second value of `current_version()`.
+        ttl (int): Seconds to keep the data under a shared version, or
+            None to keep it until it is evicted.
+    """
+
+    if shared:
+        return ttl
+    return settings["fallback_ttl"]
+
+
+def bump(user_id):
+    """Invalidates every cached page of a user.
+
+    Args:
+        user_id (int): Owner whose catalog data changed.
+    """
+
+    local_versions[user_id] = local_versions.get(user_id, 0) + 1
+    if settings["redis"]:
+        try:
+            get_redis().incr(_version_key(user_id))
+        except RedisError as err:
+            log.warning("Could not bump catalog version: %s", err)
+
+
+def catalog_changed(db_session, user_id):
+    """Records a change to a user's catalog in the current transaction.
+
+    Sets the user's `catalog_updated` time, and bumps the catalog version
+    once the transaction commits, so no page is cached from data that is
+    not committed yet.
+
+    Args:
+        db_session (:obj:`Session`): The session that owns the change.
+        user_id (int): Owner whose catalog data changed.
+    """
+
+    (db_session.query(User).filter_by(id=user_id)
+     .update({"catalog_updated": datetime.utcnow()},
+             synchronize_session=False))
+    db_session.info.setdefault(PENDING_CHANGES, set()).add(user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(db_session):
+    for user_id in db_session.info.pop(PENDING_CHANGES, ()):
+        bump(user_id)
+        user_service.invalidate(user_id)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _after_transaction_end(db_session, transaction):
+    # Changes still pending when the outermost transaction ends were
+    # rolled back
+    if transaction.parent is None:
+        db_session.info.pop(PENDING_CHANGES, None)
+
+
+def _redis_get(key):
+    if not settings["redis"]:
+        return None
+    try:
+        value = get_redis().get(key)
+    except RedisError:
+        return None
+    if value is None:
+        return None
+    return zlib.decompress(value).decode("utf-8")
+
+
+def _redis_set(key, page):
+    if not settings["redis"]:
+        return
+    value = zlib.compress(page.encode("utf-8"))
+    try:
+        get_redis().setex(key, settings["ttl"], value)
+    except RedisError:
+        pass
+
+
+def _redis_lock(key):
+    # Returns False only when another process holds the render lock
+    if not settings["redis"]:
+        return True
+    try:
+        return bool(get_redis().set("lock:" + key, 1, nx=True,
+                                    ex=settings["lock_timeout"]))
+    except RedisError:
+        return True
+
+
+def _redis_unlock(key):
+    if settings["redis"]:
+        try:
+            get_redis().delete("lock:" + key)
+        except RedisError:
+            pass
+
+
+def _lookup(key, ttl):
+    page = pages.get(key)
+    if page is not MISSING:
+        return page
+
+    page = _redis_get(key)
+    if page is not None:
+        pages.set(key, page, ttl)
+    return page
+
+
+def _store(key, stale_key, page, ttl):
+    pages.set(key, page, ttl)
+    pages.set(stale_key, page, ttl)
+    _redis_set(key, page)
+    _redis_set(stale_key, page)
+
+
+def _wait_for(key, ttl):
+    deadline = time.time() + settings["wait"]
+    while time.time() < deadline:
+        time.sleep(0.05)
+        page = _lookup(key, ttl)
+        if page is not None:
+            return page
+    return None
+
+
+def cached(user_id, path, render):
+    """Returns a public page from the cache, rendering it on a miss.
+
+    Args:
+        user_id (int): Owner of the data shown on the page.
+        path (str): Identifies the page among the owner's pages. It must
+            only take values the owner's data allows, not any value a
+            URL can carry, or requests could fill the cache.
+        render (callable): Builds the page. Only text results are cached,
+            so redirects and error responses pass through.
+    """
+
+    if not settings["enabled"]:
+        return render()
+
+    current, shared = current_version(user_id)
+    ttl = cache_ttl(shared, settings["ttl"])
+    stale_key = "page:{}:{}".format(user_id, path)
+    key = "{}:{}".format(stale_key, current)
+
+    page = _lookup(key, ttl)
+    if page is not None:
+        return page
+
+    stripe = _stripes[hash(key) % len(_stripes)]
+
+    # Another thread of this process is rendering it
+    if not stripe.acquire(False):
+        page = _lookup(stale_key, ttl)
+        if page is not None:
+            return page
+        stripe.acquire()
+
+    try:
+        page = _lookup(key, ttl)
+        if page is not None:
+            return page
+
+        # Another process is rendering it
+        locked = _redis_lock(key)
+        if not locked:
+            page = _lookup(stale_key, ttl) or _wait_for(key, ttl)
+            if page is not None:
+                return page
+
+        try:
+            page = render()
+        finally:
+            if locked:
+                _redis_unlock(key)
+
+        if isinstance(page, basestring):
+            _store(key, stale_key, page, ttl)
+        return page
+    finally:
+        stripe.release()
+
+
+def init_app(app):
+    """Applies the PAGE_CACHE_* settings of an app.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    config = app.config
+    settings["enabled"] = config["PAGE_CACHE_ENABLED"]
+    settings["redis"] = config["PAGE_CACHE_REDIS"]
+    settings["ttl"] = config["PAGE_CACHE_TTL"]
+    settings["fallback_ttl"] = config["PAGE_CACHE_FALLBACK_TTL"]
+    pages.maxsize = config["PAGE_CACHE_SIZE"]
@@ -0,0 +1,205 @@
+"""
+This module contains code for hashing and verifying user passwords.
+
+The hash scheme and its cost come from the app config. Hashes made with any
+other scheme or cost still verify, and `verify_and_update()` returns a fresh
+hash for them so the record can be upgraded on login.
+
+Hashing runs on a small, bounded thread pool. The default pbkdf2_sha256
+scheme is computed by OpenSSL with the GIL released, so a burst of logins
+uses at most `PASSWORD_WORKERS` cores and leaves the rest of the request
+threads free. A request only hands a hash to the pool once it holds one
+of its `PASSWORD_WORKERS` slots, so no work queues up behind the pool, and
+a request that waits `PASSWORD_TIMEOUT` seconds for a slot gives up
+without leaving a hash behind for nobody.
+
+"""
+
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+# Schemes used by earlier releases (passlib's custom_app_context)
+LEGACY_SCHEMES = ["sha512_crypt", "sha256_crypt"]
+
+
+class PasswordBusy(Exception):
+    """Raised when no hashing worker became free in time."""
+
+    pass
+
+
+class Slots(object):
+    """Counting semaphore whose `acquire()` gives up after a timeout.
+
+    Python 2's `threading.Semaphore` can only wait forever or not at all.
+
+    Args:
+        size (int): Number of slots.
+    """
+
+    def __init__(self, size):
+        self.free = size
+        self._cond = threading.Condition(threading.Lock())
+
+    def acquire(self, timeout):
+        """Takes a slot, or returns False once `timeout` seconds pass."""
+
+        deadline = time.time() + timeout
+        with self._cond:
+            while self.free <= 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.free -= 1
+            return True
+
+    def release(self):
+        """Gives a slot back and wakes one waiting thread."""
+
+        with self._cond:
+            self.free += 1
+            self._cond.notify()
+
+
+def build_context(scheme, rounds):
+    """Creates a CryptContext that hashes with `scheme` at `rounds`.
+
+    Hashes with a different scheme or number of rounds are flagged as
+    needing an update.
+
+    Args:
+        scheme (str): Name of a passlib hash scheme.
+        rounds (int): Cost parameter for new hashes.
+    """
+
+    # Used for hashing passwords
+    from passlib.context import CryptContext
+
+    schemes = [scheme] + [s for s in LEGACY_SCHEMES if s != scheme]
+    settings = {
+        scheme + "__default_rounds": rounds,
+        scheme + "__min_rounds": rounds,
+        scheme + "__max_rounds": rounds,
+    }
+    return CryptContext(schemes=schemes, default=scheme, deprecated="auto",
+                        **settings)
+
+
+class PasswordHasher(object):
+    """Runs password hashing on a bounded pool of threads.
+
+    Args:
+        scheme (str): Name of a passlib hash scheme.
+        rounds (int): Cost parameter for new hashes.
+        workers (int): Most hashes computed or waiting at the same time.
+        timeout (float): Seconds to wait for a free worker before giving
+            up. A hash that got a worker always runs to the end.
+    """
+
+    def __init__(self, scheme="pbkdf2_sha256", rounds=29000, workers=2,
+                 timeout=10):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._slots = None
+        self.configure(scheme, rounds, workers, timeout)
+
+    def configure(self, scheme, rounds, workers, timeout):
+        """Replaces the hashing parameters and pool size."""
+
+        self.scheme = scheme
+        self.rounds = rounds
+        self.workers = workers
+        self.timeout = timeout
+        self._context = None
+        self._pid = None
+
+    @property
+    def context(self):
+        """The CryptContext, built on first use so passlib loads lazily."""
+
+        with self._lock:
+            if self._context is None:
+                self._context = build_context(self.scheme, self.rounds)
+            return self._context
+
+    def _get_pool(self):
+        # Pools do not survive a fork, so each process makes its own
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pool = ThreadPool(self.workers)
+                self._slots = Slots(self.workers)
+                self._pid = os.getpid()
+            return self._pool, self._slots
+
+    @staticmethod
+    def _call(slots, func, args):
+        try:
+            return func(*args)
+        finally:
+            slots.release()
+
+    def _run(self, func, *args):
+        pool, slots = self._get_pool()
+
+        # Only as many jobs as workers are ever handed to the pool, so a
+        # job starts as soon as it is submitted
+        if not slots.acquire(self.timeout):
+            raise PasswordBusy("No password worker became free in time.")
+        try:
+            result = pool.apply_async(self._call, (slots, func, args))
+        except Exception:
+            slots.release()
+            raise
+        return result.get()
+
+    def hash(self, password):
+        """Returns a new hash of `password`.
+
+        Args:
+            password (str): The plain-text password.
+        """
+
+        return self._run(self.context.hash, password)
+
+    def verify(self, password, password_hash):
+        """Checks `password` against a stored hash.
+
+        Args:
+            password (str): The plain-text password.
+            password_hash (str): The stored hash.
+        """
+
+        return self._run(self.context.verify, password, password_hash)
+
+    def verify_and_update(self, password, password_hash):
+        """Checks a password and rehashes it if the parameters changed.
+
+        Args:
+            password (str): The plain-text password.
+            password_hash (str): The stored hash.
+
+        Returns:
+            tuple: Whether the password matched, and a new hash to store
+            or None when the stored one is current.
+        """
+
+        return self._run(self.context.verify_and_update, password,
+                         password_hash)
+
+
+hasher = PasswordHasher()
+
+
+def init_app(app):
+    """Applies the PASSWORD_* settings of an app.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    config = app.config
+    hasher.configure(config["PASSWORD_SCHEME"], config["PASSWORD_ROUNDS"],
+                     config["PASSWORD_WORKERS"], config["PASSWORD_TIMEOUT"])
@@ -0,0 +1,47 @@
+"""
+This module contains the shared Redis client.
+
+The client is created on first use from REDIS_URL, so importing a module
+that may use Redis does not open a connection, and each process gets its
+own connection pool after a fork.
+
+"""
+
+import os
+import threading
+from redis import StrictRedis
+
+settings = {"url": "redis://localhost:6379/0"}
+
+_client = {"pid": None, "redis": None}
+_lock = threading.Lock()
+
+
+def get_redis():
+    """Returns this process's Redis client, creating it if needed."""
+
+    with _lock:
+        if _client["pid"] != os.getpid():
+            _client["redis"] = StrictRedis.from_url(settings["url"])
+            _client["pid"] = os.getpid()
+        return _client["redis"]
+
+
+def reset():
+    """Forgets the client, so the next call to `get_redis()` makes one."""
+
+    with _lock:
+        _client["pid"] = None
+        _client["redis"] = None
+
+
+def init_app(app):
+    """Applies the REDIS_URL setting of an app.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    with _lock:
+        settings["url"] = app.config["REDIS_URL"]
+    reset()
@@ -2,15 +2,9 @@
 
 import time
 from flask import g, request
-from flask import Blueprint, Flask, jsonify
+from flask import Blueprint, jsonify
 from functools import update_wrapper
-
-# https://redis.io/
-from redis import Redis
-
-redis = Redis()
-
-app = Flask(__name__)
+from catalog.redis_manager import get_redis
 
 bp_rlimit = Blueprint("bp_rlimit", __name__)
 
@@ -38,7 +32,7 @@ class RateLimit(object):
 
         # Makes sure we set the expiration every time we increment the key
         # This is in case an exception happens between those lines
-        p = redis.pipeline()
+        p = get_redis().pipeline()
 
         # Increase the value of pipline and set it to expire
         # based on the reset value and expiration window
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""This script measures password login throughput.
+
+Client threads log in against one stored hash through the same hashing pool
+the application uses, while a bystander thread times a trivial task to show
+how much other requests are held up. Run it from the application root
+directory, for example:
+
+    python catalog/scripts/bench_login.py --scheme pbkdf2_sha256 \\
+        --rounds 29000 --workers 2 --clients 8 --seconds 10
+
+"""
+
+from __future__ import division
+import argparse
+import os
+import sys
+import threading
+import time
+
+# Makes the catalog package importable when run from the application root
+sys.path.insert(0, os.getcwd())
+
+from catalog.password_manager import PasswordHasher
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument("--scheme", default="pbkdf2_sha256")
+parser.add_argument("--rounds", type=int, default=29000)
+parser.add_argument("--workers", type=int, default=2)
+parser.add_argument("--clients", type=int, default=8)
+parser.add_argument("--seconds", type=float, default=10)
+args = parser.parse_args()
+
+hasher = PasswordHasher(args.scheme, args.rounds, args.workers, timeout=60)
+password = "correct horse battery"
+stored = hasher.hash(password)
+
+latencies = []
+bystander = []
+deadline = time.time() + args.seconds
+
+
+def client():
+    while time.time() < deadline:
+        start = time.time()
+        hasher.verify(password, stored)
+        latencies.append(time.time() - start)
+
+
+def bystander_task():
+    # Stands in for a cheap request served during the login burst
+    while time.time() < deadline:
+        start = time.time()
+        sum(range(1000))
+        bystander.append(time.time() - start)
+        time.sleep(0.01)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(int(len(values) * pct), len(values) - 1)] * 1000
+
+
+threads = [threading.Thread(target=client) for x in xrange(args.clients)]
+threads.append(threading.Thread(target=bystander_task))
+
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+
+print "Scheme:      {} ({} rounds, {} workers, {} clients)".format(
+    args.scheme, args.rounds, args.workers, args.clients)
+print "Logins/sec:  {:.1f}".format(len(latencies) / args.seconds)
+print "Login p50:   {:.1f} ms".format(percentile(latencies, 0.50))
+print "Login p99:   {:.1f} ms".format(percentile(latencies, 0.99))
+print "Bystander p99: {:.2f} ms".format(percentile(bystander, 0.99))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""This script measures end-to-end OAuth login latency.
+
+It starts the fake provider from `fake_provider.py` with a fixed delay per
+answer, points the application at it and times the Facebook and Google
+login callbacks through Flask's test client. With the profile calls made
+concurrently, each login should take about two provider round trips rather
+than one per call. Run it from the application root directory:
+
+    python catalog/scripts/bench_oauth_login.py --delay 100 --logins 20
+
+"""
+
+from __future__ import division
+import argparse
+import os
+import sys
+import threading
+import time
+
+# Makes the catalog package importable when run from the application root
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_provider
+import oauth2client.client
+from catalog import create_app
+from catalog.login import http_client, provider_config
+
+parser = argparse.ArgumentParser(description="OAuth login latency.")
+parser.add_argument("--delay", type=float, default=100,
+                    help="Milliseconds the fake provider waits per answer.")
+parser.add_argument("--logins", type=int, default=20)
+args = parser.parse_args()
+
+app = create_app()
+
+gpl_client_id = provider_config.secrets().google.client_id
+server = fake_provider.make_server(0, args.delay / 1000.0, gpl_client_id)
+thread = threading.Thread(target=server.serve_forever)
+thread.daemon = True
+thread.start()
+
+base_url = "http://127.0.0.1:{}".format(server.server_address[1])
+app.config["PROVIDER_BASE_URLS"] = {"google": base_url,
+                                    "facebook": base_url}
+http_client.init_app(app)
+app.secret_key = "bench"
+
+
+class FakeCredentials(object):
+    """Stands in for the result of oauth2client's code exchange."""
+
+    access_token = "gpl-token"
+    id_token = {"sub": "gpl-1"}
+
+
+class FakeFlow(object):
+    """Replaces the Google code exchange, which cannot be redirected."""
+
+    def step2_exchange(self, code, http=None):
+        # Mimics the exchange round trip the real flow makes
+        time.sleep(args.delay / 1000.0)
+        return FakeCredentials()
+
+
+def time_logins(path, calls):
+    client = app.test_client()
+    timings = []
+
+    for x in xrange(args.logins):
+        with client.session_transaction() as login_session:
+            login_session.clear()
+            login_session["state"] = "bench"
+
+        start = time.time()
+        response = client.post(path + "?state=bench", data="code")
+        timings.append((time.time() - start) * 1000)
+        assert response.status_code == 200, response.data
+
+    timings.sort()
+    print "{:<10} {:>4} provider calls, sequential >= {:>6.0f} ms, " \
+        "median {:>6.0f} ms".format(path.split("_")[-1], calls,
+                                    calls * args.delay,
+                                    timings[len(timings) // 2])
+
+
+# connect_gpl imports the flow class from oauth2client when it runs
+oauth2client.client.OAuth2WebServerFlow = lambda *a, **kw: FakeFlow()
+
+time_logins("/user/connect_fb", 3)
+time_logins("/user/connect_gpl", 3)
+print "Provider stats: {}".format(http_client.client.stats())
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+"""This script measures how long a new worker takes to become ready.
+
+Each run starts a fresh interpreter that imports the application, builds it
+with `create_app()` and serves one request through Flask's test client,
+which is the work a newly started worker does before it can answer. The
+median import, app creation and first response times are printed with the
+modules that took longest to import. Run it from the application root
+directory, for example:
+
+    python catalog/scripts/bench_startup.py --runs 5 --budget 1500
+
+The exit status is 1 when the median time to the first response is over
+the budget, or when a library that should be deferred was imported.
+
+"""
+
+from __future__ import division
+import __builtin__
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Provider and hashing libraries, only needed once a user logs in
+DEFERRED = ["oauth2client", "oauth2", "httplib2", "requests", "passlib"]
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument("--runs", type=int, default=5)
+parser.add_argument("--budget", type=float, default=2000,
+                    help="Milliseconds allowed until the first response.")
+parser.add_argument("--path", default="/catalog/",
+                    help="Path of the first request.")
+parser.add_argument("--top", type=int, default=15,
+                    help="Number of slowest modules to list.")
+parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+
+def profile_imports():
+    """Times every import that loads new modules.
+
+    Returns:
+        dict: Module name to milliseconds spent loading it, not counting
+        the modules it imported in turn.
+    """
+
+    timings = {}
+    nested = []
+    real_import = __builtin__.__import__
+
+    def timed_import(name, *rest, **kwargs):
+        called = time.time()
+        before = set(sys.modules)
+
+        # Time and modules of the imports made while this one runs
+        inner = [0.0, set()]
+        nested.append(inner)
+        start = time.time()
+
+        try:
+            return real_import(name, *rest, **kwargs)
+        finally:
+            elapsed = (time.time() - start) * 1000
+            nested.pop()
+
+            # Python 2 records failed relative lookups as None entries
+            loaded = set(module for module in set(sys.modules) - before
+                         if sys.modules[module] is not None)
+            own = loaded - inner[1]
+            if own:
+                module = min(own, key=len)
+                timings[module] = (timings.get(module, 0.0) + elapsed -
+                                   inner[0])
+
+            # The bookkeeping above is charged to nobody
+            if nested:
+                nested[-1][0] += (time.time() - called) * 1000
+                nested[-1][1].update(loaded)
+
+    __builtin__.__import__ = timed_import
+    return timings
+
+
+def run_child():
+    """Starts the application once and prints its timings as JSON."""
+
+    # Makes the catalog package importable when run from the application
+    # root
+    sys.path.insert(0, os.getcwd())
+
+    timings = profile_imports()
+
+    start = time.time()
+    from catalog import create_app
+    imported = time.time()
+    app = create_app()
+    created = time.time()
+    status = app.test_client().get(args.path).status_code
+    answered = time.time()
+
+    result = {
+        "import_ms": (imported - start) * 1000,
+        "create_ms": (created - imported) * 1000,
+        "first_ms": (answered - created) * 1000,
+        "ready_ms": (answered - start) * 1000,
+        "status": status,
+        "modules": timings,
+        "deferred": [name for name in DEFERRED if name in sys.modules]
+    }
+    sys.stdout.write(json.dumps(result) + "\n")
+    sys.stdout.flush()
+
+    # Skips joining the background workers started by the request
+    os._exit(0)
+
+
+def run_once():
+    """Runs one fresh interpreter and returns its timings."""
+
+    command = [sys.executable, os.path.abspath(__file__), "--child",
+               "--path", args.path]
+    start = time.time()
+    output = subprocess.check_output(command)
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_ms"] = (time.time() - start) * 1000
+    return result
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    runs = [run_once() for x in xrange(args.runs)]
+    ready = median([run["ready_ms"] for run in runs])
+
+    print "Startup over {} runs (median ms)".format(len(runs))
+    for label, key in [("import", "import_ms"), ("create_app", "create_ms"),
+                       ("first response", "first_ms"),
+                       ("ready", "ready_ms"),
+                       ("whole process", "process_ms")]:
+        print "  {:<16} {:>8.1f}".format(label,
+                                         median([run[key] for run in runs]))
+    print "  first response status: {}".format(runs[0]["status"])
+
+    # Module times of the run closest to the median
+    typical = min(runs, key=lambda run: abs(run["ready_ms"] - ready))
+    modules = sorted(typical["modules"].items(), key=lambda item: -item[1])
+
+    packages = {}
+    for name, elapsed in modules:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + elapsed
+
+    print "\nSlowest imports (ms, excluding their own imports)"
+    for name, elapsed in modules[:args.top]:
+        print "  {:<40} {:>8.1f}".format(name, elapsed)
+
+    print "\nImport time per top-level package (ms)"
+    for name, elapsed in sorted(packages.items(),
+                                key=lambda item: -item[1])[:args.top]:
+        print "  {:<40} {:>8.1f}".format(name, elapsed)
+
+    failed = False
+    deferred = sorted(set(name for run in runs for name in run["deferred"]))
+    if deferred:
+        print "\nDeferred libraries imported at startup: {}".format(
+            ", ".join(deferred))
+        failed = True
+
+    if ready > args.budget:
+        print "\nOver budget: {:.1f} ms > {:.1f} ms".format(ready,
+                                                            args.budget)
+        failed = True
+    else:
+        print "\nWithin budget: {:.1f} ms <= {:.1f} ms".format(ready,
+                                                              args.budget)
+
+    sys.exit(1 if failed else 0)
+
+
+if args.child:
+    run_child()
+else:
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+"""This script exports and imports catalogs as CSV, NDJSON or tar streams.
+
+Exports cover every user, or one with --user-id, and are written to
+standard output unless --output is given. Imports read the file record by
+record, commit every --batch-size records and save their position in a
+checkpoint file, so running the same command again after an interruption
+resumes where the last commit left off. Run it from the application root
+directory, for example:
+
+    python catalog/scripts/catalog_transfer.py export --tar --secrets -o all.tar
+    python catalog/scripts/catalog_transfer.py export --format csv --table items
+    python catalog/scripts/catalog_transfer.py import all.tar
+
+Users are matched by email on import. Password hashes are only exported
+with --secrets, so without them imported accounts need a social login or
+a new password.
+
+"""
+
+import argparse
+import json
+import os
+import sys
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+commands = parser.add_subparsers(dest="command")
+
+export_parser = commands.add_parser("export", help="Write an export.")
+export_parser.add_argument("--format", choices=["ndjson", "csv"],
+                           default="ndjson")
+export_parser.add_argument("--table", choices=["users", "categories",
+                                               "items"], default="items",
+                           help="Table of a CSV export without --tar.")
+export_parser.add_argument("--tar", action="store_true",
+                           help="Bundle all tables and the upload files.")
+export_parser.add_argument("--no-images", action="store_true",
+                           help="Leave the upload files out of --tar.")
+export_parser.add_argument("--user-id", type=int)
+export_parser.add_argument("--secrets", action="store_true",
+                           help="Include the users' password hashes.")
+export_parser.add_argument("-o", "--output", help="File to write.")
+
+import_parser = commands.add_parser("import", help="Read an export.")
+import_parser.add_argument("source", help="File to read, - for stdin.")
+import_parser.add_argument("--format", choices=["ndjson", "csv", "tar"],
+                           help="Guessed from the file name by default.")
+import_parser.add_argument("--table", choices=["users", "categories",
+                                               "items"],
+                           help="Table of a CSV file, guessed from its name "
+                                "by default.")
+import_parser.add_argument("--user-id", type=int,
+                           help="Import into this user's catalog.")
+import_parser.add_argument("--batch-size", type=int)
+import_parser.add_argument("--checkpoint",
+                           help="Checkpoint file, SOURCE.checkpoint by "
+                                "default.")
+args = parser.parse_args()
+
+
+def export(transfer):
+    if args.tar:
+        pieces = transfer.export_tar(args.format, args.user_id, args.secrets,
+                                     images=not args.no_images)
+    elif args.format == "ndjson":
+        pieces = transfer.export_ndjson(args.user_id, args.secrets)
+    else:
+        pieces = transfer.export_csv(args.table, args.user_id, args.secrets)
+
+    output = open(args.output, "wb") if args.output else sys.stdout
+    try:
+        for piece in pieces:
+            output.write(piece)
+    finally:
+        if args.output:
+            output.close()
+
+
+def guess_format(source):
+    name = os.path.basename(source).lower()
+    if name.endswith((".tar", ".tar.gz", ".tgz")):
+        return "tar", None
+    if name.endswith(".csv"):
+        return "csv", name[:-4]
+    return "ndjson", None
+
+
+def load_checkpoint(path, source):
+    """Returns the position and user map saved for this source."""
+
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except IOError:
+        return 0, {}
+
+    if checkpoint["source"] != source:
+        sys.exit("{} belongs to {}".format(path, checkpoint["source"]))
+    print >> sys.stderr, "Resuming after record {}".format(
+        checkpoint["position"])
+    return checkpoint["position"], checkpoint["users"]
+
+
+def save_checkpoint(path, source, importer):
+    # Replaced in one step, so a crash leaves the old or the new one
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"source": source, "position": importer.position,
+                   "users": importer.users}, f)
+    os.rename(tmp_path, path)
+
+
+def run_import(transfer, image_url):
+    fmt, table = guess_format(args.source)
+    fmt = args.format or fmt
+    table = args.table or table
+    if fmt == "csv" and table not in transfer.TABLES:
+        sys.exit("Give the table of the CSV file with --table")
+
+    source = (os.path.abspath(args.source) if args.source != "-"
+              else "-")
+    checkpoint = args.checkpoint or (
+        args.source + ".checkpoint" if args.source != "-" else None)
+    skip, users = (load_checkpoint(checkpoint, source) if checkpoint
+                   else (0, {}))
+
+    def on_commit(importer):
+        if checkpoint:
+            save_checkpoint(checkpoint, source, importer)
+        print >> sys.stderr, "Committed through record {}".format(
+            importer.position)
+
+    importer = transfer.Importer(user_id=args.user_id,
+                                 batch_size=args.batch_size,
+                                 image_url=image_url, skip=skip,
+                                 users=users, on_commit=on_commit)
+
+    stream = sys.stdin if args.source == "-" else open(args.source, "rb")
+    try:
+        if fmt == "ndjson":
+            importer.run(transfer.read_ndjson(stream))
+        elif fmt == "csv":
+            importer.run(transfer.read_csv(table, stream))
+        else:
+            importer.run(transfer.read_tar(stream, importer))
+    except transfer.TransferError as err:
+        sys.exit("Stopped after record {}: {}".format(importer.position,
+                                                      err))
+    finally:
+        stream.close()
+
+    for error in importer.errors:
+        print >> sys.stderr, "Record {record}: {error}".format(**error)
+    print >> sys.stderr, "{} records applied, {} failed".format(
+        importer.applied, importer.failed)
+
+    # Finished imports start over when run again
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+
+def main():
+    # Makes the catalog package importable when run from the application
+    # root
+    sys.path.insert(0, os.getcwd())
+
+    from catalog import create_app, transfer
+    from catalog.main.controller import image_url
+    app = create_app()
+
+    with app.app_context():
+        if args.command == "export":
+            export(transfer)
+        else:
+            run_import(transfer, image_url)
+
+
+main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+"""This script runs a fake OAuth provider for local testing.
+
+It answers the Google, Facebook and Twitter endpoints used by the login
+controller with canned data, optionally after a delay to mimic a slow or
+distant provider, or with a number of 503 answers to exercise retries.
+Point the application at it through PROVIDER_BASE_URLS in
+`catalog/__init__.py`:
+
+    app.config["PROVIDER_BASE_URLS"] = {
+        "google": "http://localhost:9000",
+        "facebook": "http://localhost:9000",
+        "twitter": "http://localhost:9000"
+    }
+
+Then run the following command from the application root directory:
+
+    python catalog/scripts/fake_provider.py --port 9000 --delay 150
+
+"""
+
+import argparse
+import json
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+# Canned user profiles returned by each provider
+GOOGLE_USER = {"name": "Fake Google User", "email": "gpl@example.com",
+               "picture": "http://localhost/gpl.png"}
+FACEBOOK_USER = {"name": "Fake Facebook User", "email": "fb@example.com",
+                 "id": "fb-1"}
+TWITTER_USER = {"name": "Fake Twitter User", "email": "twt@example.com",
+                "profile_image_url": "http://localhost/twt.png"}
+
+
+def route(path, client_id):
+    """Returns the content type and body for a provider endpoint."""
+
+    if path == "/oauth2/v1/tokeninfo":
+        return "json", {"user_id": "gpl-1", "issued_to": client_id}
+    if path == "/oauth2/v1/userinfo":
+        return "json", GOOGLE_USER
+    if path == "/o/oauth2/revoke":
+        return "json", {}
+    if path == "/v2.9/oauth/access_token":
+        return "json", {"access_token": "fb-token"}
+    if path == "/v2.9/me":
+        return "json", FACEBOOK_USER
+    if path == "/v2.9/me/picture":
+        return "json", {"data": {"url": "http://localhost/fb.png"}}
+    if path.endswith("/permissions"):
+        return "json", {"success": True}
+    if path == "/oauth/request_token":
+        return "form", ("oauth_token=twt-token&oauth_token_secret=secret"
+                        "&oauth_callback_confirmed=true")
+    if path == "/oauth/access_token":
+        return "form", "oauth_token=twt-token&oauth_token_secret=secret"
+    if path == "/1.1/account/verify_credentials.json":
+        return "json", TWITTER_USER
+    return None, None
+
+
+class ProviderHandler(BaseHTTPRequestHandler):
+    """Serves every provider endpoint from `route()`."""
+
+    # Keep-alive, so the pooled client can reuse its connections
+    protocol_version = "HTTP/1.1"
+
+    # Buffer the header lines so they leave in one packet with the body,
+    # instead of waiting on delayed ACKs between small writes
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def handle_any(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+        url = urlparse.urlparse(self.path)
+        kind, body = route(url.path, self.server.client_id)
+        time.sleep(self.server.delay)
+
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path,
+                                         dict(self.headers)))
+            failing = self.server.failures > 0
+            self.server.failures -= failing
+
+        if failing:
+            self.send_error(503)
+            return
+        if kind is None:
+            self.send_error(404)
+            return
+
+        if kind == "json":
+            body = json.dumps(body)
+            content_type = "application/json"
+        else:
+            content_type = "application/x-www-form-urlencoded"
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    do_GET = do_POST = do_DELETE = handle_any
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class ProviderServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(port, delay=0.0, client_id="", verbose=False, failures=0):
+    """Creates a fake provider server bound to localhost.
+
+    The server's `requests` list holds the method, path and headers of
+    each request it answered.
+
+    Args:
+        port (int): Port to listen on, or 0 to pick a free one.
+        delay (float): Seconds to wait before each answer.
+        client_id (str): Google client ID reported by tokeninfo.
+        verbose (bool): Log every request.
+        failures (int): Number of first requests answered with a 503.
+    """
+
+    server = ProviderServer(("127.0.0.1", port), ProviderHandler)
+    server.delay = delay
+    server.client_id = client_id
+    server.verbose = verbose
+    server.failures = failures
+    server.requests = []
+    server.lock = threading.Lock()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OAuth provider.")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--delay", type=float, default=0,
+                        help="Milliseconds to wait before each answer.")
+    parser.add_argument("--client-id", default="",
+                        help="Google client ID reported by tokeninfo.")
+    parser.add_argument("--failures", type=int, default=0,
+                        help="Number of first requests answered with 503.")
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.delay / 1000.0, args.client_id,
+                         verbose=True, failures=args.failures)
+    print "Fake provider listening on http://localhost:{}".format(args.port)
+    server.serve_forever()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""This script writes precompressed copies of the static CSS and JS files.
+
+For every `.css` and `.js` file under `catalog/static` a `.gz` sibling is
+written, plus a `.br` sibling when the `brotli` package is installed. The
+static view serves them to clients that accept the encoding. Run it from the
+application root directory after changing any stylesheet:
+
+    python catalog/scripts/precompress_static.py
+
+"""
+
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = "catalog/static"
+EXTENSIONS = (".css", ".js")
+
+
+def write_gzip(path, data):
+    with open(path + ".gz", "wb") as raw:
+        # A fixed mtime keeps the output identical between runs
+        gz = gzip.GzipFile(filename="", mode="wb", compresslevel=9,
+                           fileobj=raw, mtime=0)
+        gz.write(data)
+        gz.close()
+
+
+def write_brotli(path, data):
+    with open(path + ".br", "wb") as f:
+        f.write(brotli.compress(data, quality=11))
+
+
+for root, dirs, files in os.walk(STATIC_DIR):
+    for filename in files:
+        if not filename.endswith(EXTENSIONS):
+            continue
+
+        path = os.path.join(root, filename)
+        with open(path, "rb") as f:
+            data = f.read()
+
+        write_gzip(path, data)
+        print "Wrote {}.gz".format(path)
+
+        if brotli is not None:
+            write_brotli(path, data)
+            print "Wrote {}.br".format(path)
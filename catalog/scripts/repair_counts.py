@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""This script recomputes the item counters of users and categories.
+
+The counters are kept up to date by every write, so this is only needed
+after items were changed outside the application, for example by hand in
+the database. Only counters that differ from the items table are updated,
+and the catalogs of their owners are marked as changed, so cached pages
+and snapshots showing the old counts are rebuilt. Run it from the
+application root directory:
+
+    python catalog/scripts/repair_counts.py
+    python catalog/scripts/repair_counts.py --user-id 3
+
+"""
+
+import argparse
+import os
+import sys
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument("--user-id", type=int,
+                    help="Repair one user and their categories.")
+args = parser.parse_args()
+
+
+def main():
+    # Makes the catalog package importable when run from the application
+    # root
+    sys.path.insert(0, os.getcwd())
+
+    from catalog import create_app, item_counts, page_cache
+    from catalog.connection_manager import session_factory
+    app = create_app()
+
+    with app.app_context():
+        db_session = session_factory()
+        try:
+            fixed = item_counts.recount(db_session, args.user_id)
+            # Bumps the page and snapshot versions once committed
+            for user_id in fixed["user_ids"]:
+                page_cache.catalog_changed(db_session, user_id)
+            db_session.commit()
+        finally:
+            db_session.close()
+
+    print "Repaired {users} user(s) and {categories} category(ies)".format(
+        **fixed)
+
+
+main()
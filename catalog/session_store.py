@@ -0,0 +1,293 @@
+"""
+This module contains the server-side store for `login_session`.
+
+Session data is kept in Redis or, for single-node installs, in a SQLite
+file next to the catalog database. The cookie only carries a signed,
+opaque session ID and a revision tag that changes whenever the data is
+saved, so it is only re-sent when the session changes. A session gets a
+new ID, and its old one is deleted, whenever a user signs in or out, so an
+ID planted in a browser before login is useless after it. Sessions with no
+signed-in user, which mostly hold a CSRF state, expire after
+SESSION_ANONYMOUS_TTL seconds instead of the full session lifetime.
+
+Each process keeps recently used sessions in a local LRU cache. A cached
+copy is only used while its revision matches the cookie, so requests that
+land on different processes never see stale data. Revoked sessions may
+still be served from other processes' caches for up to SESSION_LOCAL_TTL
+seconds.
+
+"""
+
+import binascii
+import os
+import sqlite3
+import threading
+import time
+from flask import current_app
+from flask.sessions import (SessionInterface, SessionMixin,
+                            session_json_serializer)
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+from catalog.cache import LRUCache, MISSING
+from catalog.redis_manager import get_redis
+
+
+def new_token(size):
+    """Returns `size` random bytes as a hex string."""
+
+    return binascii.hexlify(os.urandom(size))
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session data with the ID and revision it was loaded under.
+
+    Args:
+        initial (dict): Session values.
+        sid (str): Session ID; a new one is made if not given.
+        rev (str): Revision tag of the stored data.
+
+    Attributes:
+        loaded_user_id (int): The signed-in user when the session was
+            loaded, to tell when that changes.
+    """
+
+    def __init__(self, initial=None, sid=None, rev=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.new = sid is None
+        self.sid = sid or new_token(16)
+        self.rev = rev
+        self.loaded_user_id = self.get("user_id")
+        self.modified = False
+
+
+class RedisSessionBackend(object):
+    """Stores sessions as expiring Redis keys.
+
+    Args:
+        prefix (str): Prefix of every key written.
+    """
+
+    def __init__(self, prefix="session:"):
+        self.prefix = prefix
+
+    def load(self, sid):
+        value = get_redis().get(self.prefix + sid)
+        if value is None:
+            return None
+        rev, payload = value.split(":", 1)
+        return rev, payload
+
+    def save(self, sid, rev, payload, user_id, ttl):
+        pipe = get_redis().pipeline()
+        pipe.setex(self.prefix + sid, ttl, "{}:{}".format(rev, payload))
+        if user_id is not None:
+            user_key = "{}user:{}".format(self.prefix, user_id)
+            pipe.sadd(user_key, sid)
+            pipe.expire(user_key, ttl)
+        pipe.execute()
+
+    def delete(self, sid):
+        get_redis().delete(self.prefix + sid)
+
+    def sids_for_user(self, user_id):
+        user_key = "{}user:{}".format(self.prefix, user_id)
+        return get_redis().smembers(user_key)
+
+
+class SQLiteSessionBackend(object):
+    """Stores sessions in a SQLite file, one connection per thread.
+
+    Args:
+        path (str): Location of the database file.
+        purge_interval (float): Minimum seconds between expiry sweeps.
+    """
+
+    def __init__(self, path, purge_interval=600):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._purged = time.time()
+
+    def _connect(self):
+        # Connections must not be shared across threads or a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                     "sid TEXT PRIMARY KEY, rev TEXT NOT NULL, "
+                     "data TEXT NOT NULL, user_id INTEGER, "
+                     "expires REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_user_id "
+                     "ON sessions (user_id)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def load(self, sid):
+        row = self._connect().execute(
+            "SELECT rev, data FROM sessions WHERE sid = ? AND expires > ?",
+            (sid, time.time())).fetchone()
+        if row is None:
+            return None
+        return str(row[0]), row[1]
+
+    def save(self, sid, rev, payload, user_id, ttl):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)",
+                     (sid, rev, payload, user_id, now + ttl))
+
+        if now - self._purged >= self.purge_interval:
+            self._purged = now
+            conn.execute("DELETE FROM sessions WHERE expires <= ?", (now,))
+
+    def delete(self, sid):
+        self._connect().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def sids_for_user(self, user_id):
+        rows = self._connect().execute(
+            "SELECT sid FROM sessions WHERE user_id = ?", (user_id,))
+        return [str(row[0]) for row in rows]
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface backed by a session backend.
+
+    Args:
+        backend: A `RedisSessionBackend` or `SQLiteSessionBackend`.
+        cache_size (int): Sessions kept in the local cache.
+        local_ttl (float): Seconds a locally cached session is trusted.
+        anonymous_ttl (int): Seconds a session without a signed-in user
+            is stored.
+    """
+
+    salt = "server-session"
+    serializer = session_json_serializer
+    session_class = ServerSession
+
+    def __init__(self, backend, cache_size=1024, local_ttl=30,
+                 anonymous_ttl=3600):
+        self.backend = backend
+        self.anonymous_ttl = anonymous_ttl
+        self.local = LRUCache(maxsize=cache_size, ttl=local_ttl)
+
+    def get_signer(self, app):
+        if not app.secret_key:
+            return None
+        return Signer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        signer = self.get_signer(app)
+        if signer is None:
+            return None
+
+        value = request.cookies.get(app.session_cookie_name)
+        if not value:
+            return self.session_class()
+
+        try:
+            sid, rev = signer.unsign(value).split("-", 1)
+        except (BadSignature, ValueError):
+            return self.session_class()
+
+        cached = self.local.get(sid)
+        if cached is MISSING or cached[0] != rev:
+            cached = self.backend.load(sid)
+            if cached is None:
+                return self.session_class()
+            self.local.set(sid, cached)
+
+        rev, payload = cached
+        return self.session_class(self.serializer.loads(payload), sid, rev)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # A session emptied during the request is removed everywhere
+        if not session:
+            if session.modified and not session.new:
+                self.revoke(session.sid)
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain, path=path)
+            return
+
+        # Unchanged sessions need no write and no new cookie
+        if not session.modified:
+            return
+
+        # Signing in or out moves the session to a new ID
+        user_id = session.get("user_id")
+        if user_id != session.loaded_user_id and not session.new:
+            self.revoke(session.sid)
+            session.sid = new_token(16)
+            session.loaded_user_id = user_id
+
+        rev = new_token(4)
+        payload = self.serializer.dumps(dict(session))
+        if user_id is None:
+            ttl = self.anonymous_ttl
+        else:
+            ttl = int(app.permanent_session_lifetime.total_seconds())
+        self.backend.save(session.sid, rev, payload, user_id, ttl)
+        self.local.set(session.sid, (rev, payload))
+
+        value = self.get_signer(app).sign("{}-{}".format(session.sid, rev))
+        response.set_cookie(app.session_cookie_name, value,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app))
+
+    def revoke(self, sid):
+        """Deletes a stored session."""
+
+        self.backend.delete(sid)
+        self.local.delete(sid)
+
+    def revoke_user(self, user_id, keep=None):
+        """Deletes every stored session of a user.
+
+        Args:
+            user_id (int): The user's ID.
+            keep (str): Session ID to leave alone, such as the current one.
+        """
+
+        for sid in self.backend.sids_for_user(user_id):
+            if sid != keep:
+                self.revoke(sid)
+
+
+def revoke_user_sessions(user_id, keep=None):
+    """Signs a user out everywhere, except optionally one session."""
+
+    interface = current_app.session_interface
+    if isinstance(interface, ServerSessionInterface):
+        interface.revoke_user(user_id, keep)
+
+
+def init_app(app):
+    """Installs the session store chosen by the SESSION_* settings.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    config = app.config
+    if config["SESSION_BACKEND"] == "redis":
+        backend = RedisSessionBackend()
+    elif config["SESSION_BACKEND"] == "sqlite":
+        backend = SQLiteSessionBackend(config["SESSION_SQLITE_PATH"])
+    else:
+        # Keeps Flask's signed cookie sessions
+        return
+
+    app.session_interface = ServerSessionInterface(
+        backend, config["SESSION_LOCAL_CACHE_SIZE"],
+        config["SESSION_LOCAL_TTL"], config["SESSION_ANONYMOUS_TTL"])
@@ -0,0 +1,169 @@
+"""
+This module replaces Flask's static file view.
+
+Static URLs built with `url_for("static", ...)` get a `v` query parameter
+holding a fingerprint of the file content, and responses to fingerprinted
+URLs are cached for a year. CSS and JavaScript are served from precompressed
+`.br`/`.gz` siblings when the client accepts them (see
+`catalog/scripts/precompress_static.py`).
+
+With `STATIC_SENDFILE_MODE` set to "x-accel-redirect" (nginx) or
+"x-sendfile" (Apache, lighttpd) only headers are produced and the front
+proxy streams the bytes. Otherwise the file is streamed from Python with
+support for range requests.
+
+"""
+
+import hashlib
+import mimetypes
+import os
+from flask import abort, current_app, request
+from flask.helpers import safe_join
+from werkzeug.wsgi import wrap_file
+
+# Content types that have precompressed variants
+PRECOMPRESSED_TYPES = set(["text/css", "application/javascript"])
+
+# Preferred content encodings and the matching file suffixes
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# Length of the content fingerprint in URLs
+FINGERPRINT_LENGTH = 12
+
+# Maps a path to its (mtime, size, fingerprint)
+_fingerprints = {}
+
+
+def fingerprint(path):
+    """Returns a short content hash for a file, cached by mtime and size.
+
+    Args:
+        path (str): Path of the file on disk.
+    """
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    cached = _fingerprints.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+
+    value = digest.hexdigest()[:FINGERPRINT_LENGTH]
+    _fingerprints[path] = (stat.st_mtime, stat.st_size, value)
+    return value
+
+
+def add_fingerprint(endpoint, values):
+    """URL defaults callback that adds the `v` parameter to static URLs.
+
+    Args:
+        endpoint (str): Endpoint of the URL being built.
+        values (dict): View arguments of the URL being built.
+    """
+
+    if endpoint != "static" or "v" in values or "filename" not in values:
+        return
+
+    path = safe_join(current_app.static_folder, values["filename"])
+    value = fingerprint(path)
+
+    if value is not None:
+        values["v"] = value
+
+
+def _pick_variant(path, mimetype):
+    """Finds a fresh precompressed sibling the client accepts.
+
+    Returns:
+        tuple: Path to serve and its content encoding (or None).
+    """
+
+    if mimetype not in PRECOMPRESSED_TYPES:
+        return path, None
+
+    mtime = os.path.getmtime(path)
+
+    for encoding, suffix in ENCODINGS:
+        variant = path + suffix
+        if (request.accept_encodings[encoding] and
+                os.path.isfile(variant) and
+                os.path.getmtime(variant) >= mtime):
+            return variant, encoding
+
+    return path, None
+
+
+def serve_static(filename):
+    """View function for the "static" endpoint.
+
+    Args:
+        filename (str): Path below the static folder passed from the URL.
+    """
+
+    app = current_app
+    config = app.config
+    path = safe_join(app.static_folder, filename)
+
+    if not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    send_path, encoding = _pick_variant(path, mimetype)
+    stat = os.stat(send_path)
+    mode = config["STATIC_SENDFILE_MODE"]
+
+    if mode == "x-accel-redirect":
+        rv = app.response_class(mimetype=mimetype)
+        rel_path = os.path.relpath(send_path, app.static_folder)
+        rv.headers["X-Accel-Redirect"] = (config["STATIC_ACCEL_PREFIX"] +
+                                          rel_path.replace(os.sep, "/"))
+    elif mode == "x-sendfile":
+        rv = app.response_class(mimetype=mimetype)
+        rv.headers["X-Sendfile"] = os.path.abspath(send_path)
+    else:
+        data = wrap_file(request.environ, open(send_path, "rb"))
+        rv = app.response_class(data, mimetype=mimetype,
+                                direct_passthrough=True)
+        rv.content_length = stat.st_size
+
+    if encoding is not None:
+        rv.headers["Content-Encoding"] = encoding
+    if mimetype in PRECOMPRESSED_TYPES:
+        rv.vary.add("Accept-Encoding")
+
+    rv.last_modified = int(stat.st_mtime)
+    rv.set_etag("{}-{}-{}".format(int(stat.st_mtime), stat.st_size,
+                                  encoding or "identity"))
+
+    # A fingerprinted URL never changes content, so it can be kept forever
+    version = request.args.get("v")
+    if version is not None and version == fingerprint(path):
+        rv.headers["Cache-Control"] = ("public, max-age={}, immutable"
+                                       .format(config["STATIC_MAX_AGE"]))
+    else:
+        rv.cache_control.public = True
+        rv.cache_control.max_age = app.get_send_file_max_age(filename)
+
+    # The front proxy answers range requests itself in the offloaded modes
+    if mode is None:
+        return rv.make_conditional(request, accept_ranges=True,
+                                   complete_length=stat.st_size)
+    return rv.make_conditional(request)
+
+
+def init_app(app):
+    """Installs the static view and URL fingerprinting on an app.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    app.view_functions["static"] = serve_static
+    app.url_defaults(add_fingerprint)
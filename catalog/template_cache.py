@@ -0,0 +1,97 @@
+"""
+This module contains the Jinja bytecode cache and template warmup.
+
+Compiled templates are stored as bytecode, either in a directory or in
+Redis, so a new worker loads them instead of compiling them again. At
+startup every template of the application and its blueprints is loaded
+once, which moves the remaining compile or load cost out of the first
+requests. The templates' sources are still checked, so an edited template
+is recompiled as before.
+
+"""
+
+import logging
+import os
+import time
+from jinja2 import FileSystemBytecodeCache, MemcachedBytecodeCache
+from catalog.redis_manager import get_redis
+
+log = logging.getLogger(__name__)
+
+
+class RedisBytecodeClient(object):
+    """Memcache-style client for Jinja on top of the shared Redis client.
+
+    Looks Redis up on every call, so the cache keeps working after a fork.
+    """
+
+    def get(self, key):
+        return get_redis().get(key)
+
+    def set(self, key, value, timeout=None):
+        get_redis().set(key, value, ex=timeout)
+
+
+def make_bytecode_cache(kind, directory=None, timeout=None):
+    """Returns a Jinja bytecode cache, or None when `kind` is None.
+
+    Args:
+        kind (str): "filesystem", "redis" or None.
+        directory (str): Where the filesystem cache keeps its files.
+        timeout (int): Seconds the Redis cache keeps an entry, or None.
+    """
+
+    if kind is None:
+        return None
+    if kind == "filesystem":
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return FileSystemBytecodeCache(directory)
+    if kind == "redis":
+        return MemcachedBytecodeCache(RedisBytecodeClient(),
+                                      prefix="jinja2/bytecode/",
+                                      timeout=timeout)
+    raise ValueError("Unknown template bytecode cache: {}".format(kind))
+
+
+def warm_templates(app):
+    """Loads every HTML template so none is compiled during a request.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+
+    Returns:
+        int: Number of templates loaded.
+    """
+
+    start = time.time()
+    names = [name for name in app.jinja_env.list_templates()
+             if name.endswith(".html")]
+
+    for name in names:
+        app.jinja_env.get_template(name)
+
+    log.info("Loaded %d templates in %.1f ms", len(names),
+             (time.time() - start) * 1000)
+    return len(names)
+
+
+def init_app(app):
+    """Applies the TEMPLATE_* settings of an app.
+
+    Must run before the app's Jinja environment is first used.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    config = app.config
+    bytecode_cache = make_bytecode_cache(config["TEMPLATE_BYTECODE_CACHE"],
+                                         config["TEMPLATE_CACHE_DIR"],
+                                         config["TEMPLATE_CACHE_TIMEOUT"])
+
+    app.jinja_options = dict(app.jinja_options,
+                             bytecode_cache=bytecode_cache)
+
+    if config["TEMPLATE_WARMUP"]:
+        warm_templates(app)
@@ -0,0 +1,69 @@
+"""
+This module contains the signed API tokens used by HTTP Basic clients.
+
+A client trades its email and password for a token once, at
+`/catalog/api/1.0/token`, and then sends the token as the Basic auth
+username. Tokens carry the user ID and their expiry under the persistent
+`secret_key`, so checking one needs neither a database lookup nor a
+password hash. Tokens verified recently are kept in an LRU cache until
+they expire, which skips the signature check as well. Entries are keyed
+by the signing key too, so a token cached under an old key is checked
+again, and refused, once the key changes.
+
+"""
+
+import time
+from itsdangerous import (TimedJSONWebSignatureSerializer as Serializer,
+                          BadSignature, SignatureExpired)
+from catalog.cache import LRUCache, MISSING
+from catalog.db_setup import secret_key
+
+# Token settings, replaced by `init_app()`
+settings = {"expiration": 600}
+
+verified = LRUCache(maxsize=1024)
+
+
+def issue(user):
+    """Returns a signed token for a user.
+
+    Args:
+        user (:obj:`User`): The authenticated user.
+    """
+
+    return user.generate_auth_token(settings["expiration"])
+
+
+def verify(token):
+    """Returns the user ID a token was issued for, or None if invalid.
+
+    Args:
+        token (str): Token from `issue()`.
+    """
+
+    user_id = verified.get((secret_key, token))
+    if user_id is not MISSING:
+        return user_id
+
+    try:
+        data, header = Serializer(secret_key).loads(token,
+                                                    return_header=True)
+    except (SignatureExpired, BadSignature):
+        return None
+
+    user_id = data.get("id")
+    if user_id is not None:
+        verified.set((secret_key, token), user_id,
+                     ttl=header["exp"] - time.time())
+    return user_id
+
+
+def init_app(app):
+    """Applies the API_TOKEN_* settings of an app.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    settings["expiration"] = app.config["API_TOKEN_EXPIRATION"]
+    verified.maxsize = app.config["API_TOKEN_CACHE_SIZE"]
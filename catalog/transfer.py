@@ -0,0 +1,571 @@
+"""
+This module streams catalogs in and out as CSV, NDJSON or tar archives.
+
+Exports read the `users`, `categories` and `items` tables in ID order, one
+batch per query, and yield the output piece by piece. A tar archive holds
+the rows as members (`catalog.ndjson`, or one CSV file per table) followed
+by the upload files under `uploads/<user_id>/`. Its members are spooled to
+temporary files to learn their sizes, so memory use does not grow with
+the catalog.
+
+Imports read records one at a time and apply them in batches through
+`bulk_writer`, one transaction per batch, so the change log and snapshots
+stay current. Users are matched by email, and categories and items by
+name within their owner's catalog, which makes importing the same records
+twice harmless. After each commit, the importer reports its position in
+the input so an interrupted import can resume from that checkpoint.
+
+"""
+
+import csv
+import json
+import os
+import tarfile
+import tempfile
+import time
+from datetime import datetime
+from werkzeug.utils import secure_filename
+from catalog import bulk_writer
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Category, Item, User
+from catalog.upload_manager import JPEG_MAGIC, PNG_MAGIC
+
+# Transfer settings, replaced by `init_app()`
+settings = {"batch_size": 500, "upload_folder": "catalog/static/uploads"}
+
+TABLES = ("users", "categories", "items")
+
+# Exported columns of each table, the password hash is only added on
+# request
+FIELDS = {
+    "users": ["id", "username", "email", "picture", "public"],
+    "categories": ["id", "name", "user_id"],
+    "items": ["id", "name", "description", "image_file", "category_name",
+              "user_id", "create_date"]
+}
+
+MODELS = {"users": User, "categories": Category, "items": Item}
+
+# Size of the pieces file contents are copied in
+CHUNK_SIZE = 64 * 1024
+
+# Errors kept in an import report
+MAX_ERRORS = 100
+
+# Name of the member with the rows in NDJSON archives
+NDJSON_MEMBER = "catalog.ndjson"
+
+
+class TransferError(Exception):
+    """Raised for input that cannot be imported."""
+
+
+def _fields(table, secrets):
+    if table == "users" and secrets:
+        return FIELDS[table] + ["password_hash"]
+    return FIELDS[table]
+
+
+def iter_rows(table, user_id=None, secrets=False):
+    """Yields the rows of a table as dicts, in ID order.
+
+    Each batch is read in its own short session, so no connection is held
+    while the caller writes the output.
+
+    Args:
+        table (str): One of TABLES.
+        user_id (int): Restricts the rows to one user's catalog.
+        secrets (bool): Includes the users' password hashes.
+    """
+
+    model = MODELS[table]
+    fields = _fields(table, secrets)
+    columns = [getattr(model, field) for field in fields]
+    owner = model.id if table == "users" else model.user_id
+    last_id = 0
+
+    while True:
+        db_session = session_factory()
+        try:
+            query = db_session.query(*columns).filter(model.id > last_id)
+            if user_id is not None:
+                query = query.filter(owner == user_id)
+            rows = (query.order_by(model.id)
+                    .limit(settings["batch_size"]).all())
+        finally:
+            db_session.close()
+
+        if not rows:
+            return
+        for row in rows:
+            yield dict(zip(fields, row))
+        last_id = rows[-1].id
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def export_ndjson(user_id=None, secrets=False):
+    """Yields the lines of an NDJSON export of all tables.
+
+    Each line is a JSON object with the row's columns and its "table".
+    """
+
+    for table in TABLES:
+        for row in iter_rows(table, user_id, secrets):
+            record = dict((key, _plain(value)) for key, value in row.items())
+            record["table"] = table
+            yield json.dumps(record, sort_keys=True) + "\n"
+
+
+class _Line(object):
+    # File object that keeps the last line a csv.writer wrote
+
+    def __init__(self):
+        self.value = ""
+
+    def write(self, value):
+        self.value = value
+
+
+def _csv_value(value):
+    value = _plain(value)
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+
+def export_csv(table, user_id=None, secrets=False):
+    """Yields the lines of a CSV export of one table, header first."""
+
+    fields = _fields(table, secrets)
+    line = _Line()
+    writer = csv.writer(line)
+
+    writer.writerow(fields)
+    yield line.value
+    for row in iter_rows(table, user_id, secrets):
+        writer.writerow([_csv_value(row[field]) for field in fields])
+        yield line.value
+
+
+def _spool(lines):
+    # Writes an export to a temporary file, returning it with its size
+    spooled = tempfile.TemporaryFile()
+    for line in lines:
+        spooled.write(line)
+    size = spooled.tell()
+    spooled.seek(0)
+    return spooled, size
+
+
+def _tar_member(name, fileobj, size, mtime):
+    # A tar header, the contents and the padding to the next block
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime
+    info.mode = 0o644
+    yield info.tobuf(tarfile.GNU_FORMAT)
+
+    while True:
+        chunk = fileobj.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+    remainder = size % tarfile.BLOCKSIZE
+    if remainder:
+        yield tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+
+
+def export_tar(fmt="ndjson", user_id=None, secrets=False, images=True):
+    """Yields the pieces of a tar archive of an export.
+
+    Args:
+        fmt (str): "ndjson" or "csv".
+        user_id (int): Restricts the export to one user's catalog.
+        secrets (bool): Includes the users' password hashes.
+        images (bool): Adds the upload files of the exported items.
+    """
+
+    now = int(time.time())
+
+    if fmt == "ndjson":
+        members = [(NDJSON_MEMBER, export_ndjson(user_id, secrets))]
+    else:
+        members = [("{}.csv".format(table),
+                    export_csv(table, user_id, secrets))
+                   for table in TABLES]
+
+    for name, lines in members:
+        spooled, size = _spool(lines)
+        try:
+            for piece in _tar_member(name, spooled, size, now):
+                yield piece
+        finally:
+            spooled.close()
+
+    if images:
+        for row in iter_rows("items", user_id):
+            if row["image_file"] is None:
+                continue
+            path = os.path.join(settings["upload_folder"],
+                                str(row["user_id"]), row["image_file"])
+            try:
+                image = open(path, "rb")
+            except IOError:
+                # Files removed since the row was written are skipped
+                continue
+            try:
+                stat = os.fstat(image.fileno())
+                name = "uploads/{}/{}".format(row["user_id"],
+                                              row["image_file"])
+                for piece in _tar_member(name, image, stat.st_size,
+                                         int(stat.st_mtime)):
+                    yield piece
+            finally:
+                image.close()
+
+    # End of archive
+    yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+
+
+def read_ndjson(lines):
+    """Yields (table, row) pairs from NDJSON lines."""
+
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            raise TransferError("Line {} is not valid JSON.".format(number))
+        if not isinstance(row, dict) or row.get("table") not in TABLES:
+            raise TransferError("Line {} has no known table.".format(number))
+        yield row.pop("table"), row
+
+
+# Columns that are empty in CSV files when they have no value
+CSV_NULLABLE = set(["picture", "image_file", "create_date", "id"])
+
+
+def read_csv(table, lines):
+    """Yields (table, row) pairs from the lines of a CSV export."""
+
+    if table not in TABLES:
+        raise TransferError("Unknown table {}.".format(table))
+
+    for row in csv.DictReader(lines):
+        record = {}
+        for key, value in row.items():
+            if key is None:
+                raise TransferError("A CSV row has extra values.")
+            value = value.decode("utf-8") if value is not None else None
+            if key in CSV_NULLABLE and value == "":
+                value = None
+            if key == "public" and value is not None:
+                value = value not in ("0", "False", "false", "")
+            record[key] = value
+        yield table, record
+
+
+def read_tar(fileobj, importer):
+    """Yields (table, row) pairs from a tar archive of an export.
+
+    The archive is read as a stream. Upload files are handed to the
+    importer's `save_file()` as they come.
+    """
+
+    try:
+        archive = tarfile.open(fileobj=fileobj, mode="r|*")
+    except tarfile.TarError:
+        raise TransferError("The archive cannot be read.")
+
+    for member in archive:
+        if not member.isfile():
+            continue
+
+        name = member.name
+        if name == NDJSON_MEMBER:
+            for record in read_ndjson(archive.extractfile(member)):
+                yield record
+        elif name.endswith(".csv") and name[:-4] in TABLES:
+            for record in read_csv(name[:-4], archive.extractfile(member)):
+                yield record
+        elif name.startswith("uploads/") and name.count("/") == 2:
+            dirname, filename = name.split("/")[1:]
+            if dirname.isdigit():
+                importer.save_file(int(dirname), filename,
+                                   archive.extractfile(member))
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Importer(object):
+    """Applies imported records in batches, one transaction per batch.
+
+    Args:
+        user_id (int): Imports into this user's catalog, ignoring user
+            records and the owners named in the rows. Without it, users
+            are imported too and rows keep their owners.
+        batch_size (int): Records per transaction.
+        image_url (function): Returns the URL of an image file from the
+            user ID and the file name, as `bulk_writer.write_items` takes.
+        skip (int): Records already imported by an earlier run.
+        users (dict): User ID map of an earlier run, from `users`.
+        on_commit (function): Called with the importer after each commit,
+            to save a checkpoint of `position` and `users`.
+    """
+
+    def __init__(self, user_id=None, batch_size=None, image_url=None,
+                 skip=0, users=None, on_commit=None):
+        self.user_id = user_id
+        self.batch_size = batch_size or settings["batch_size"]
+        self.image_url = image_url
+        self.skip = skip
+        self.on_commit = on_commit
+
+        # Exported user IDs mapped to the IDs they were imported as
+        self.users = dict((int(key), value)
+                          for key, value in (users or {}).items())
+
+        self.position = skip
+        self.applied = 0
+        self.failed = 0
+        self.errors = []
+        self._batch = []
+
+    def _error(self, position, message):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"record": position, "error": message})
+
+    def _owner(self, row):
+        # ID of the imported owner of a row, None if it is unknown
+        if self.user_id is not None:
+            return self.user_id
+        return self.users.get(_int(row.get("user_id")))
+
+    def run(self, records):
+        """Imports (table, row) pairs, such as the readers yield.
+
+        Returns:
+            :obj:`Importer`: The importer, with its counters updated.
+        """
+
+        try:
+            for index, (table, row) in enumerate(records):
+                if index < self.skip:
+                    continue
+                self._batch.append((index, table, row))
+                if len(self._batch) >= self.batch_size:
+                    self.flush()
+        except TransferError:
+            # Keeps the records read before the bad input
+            self.flush()
+            raise
+        self.flush()
+        return self
+
+    def flush(self):
+        """Applies and commits the pending records."""
+
+        if not self._batch:
+            return
+
+        db_session = session_factory()
+        try:
+            # Consecutive records of one table and owner go together
+            group = []
+            for record in self._batch:
+                if group and not self._same_group(group[-1], record):
+                    self._apply(db_session, group)
+                    group = []
+                group.append(record)
+            self._apply(db_session, group)
+            db_session.commit()
+        finally:
+            db_session.close()
+
+        self.position = self._batch[-1][0] + 1
+        self._batch = []
+        if self.on_commit is not None:
+            self.on_commit(self)
+
+    def _same_group(self, first, second):
+        return (first[1] == second[1] and
+                (first[1] == "users" or
+                 self._owner(first[2]) == self._owner(second[2])))
+
+    def _apply(self, db_session, group):
+        table = group[0][1]
+        if table == "users":
+            self._apply_users(db_session, group)
+            return
+
+        owner = self._owner(group[0][2])
+        if owner is None:
+            for position, table, row in group:
+                self._error(position, "Unknown user.")
+            return
+
+        if table == "categories":
+            self._apply_categories(db_session, owner, group)
+        else:
+            self._apply_items(db_session, owner, group)
+
+    def _apply_users(self, db_session, group):
+        if self.user_id is not None:
+            return
+
+        emails = set(row.get("email") for position, table, row in group)
+        existing = dict(db_session.query(User.email, User.id)
+                        .filter(User.email.in_(list(emails))))
+
+        for position, table, row in group:
+            old_id = _int(row.get("id"))
+            email = row.get("email")
+            if old_id is None or not email or not row.get("username"):
+                self._error(position, "Users need an id, username and "
+                                      "email.")
+                continue
+
+            if email not in existing:
+                user = User(username=row["username"], email=email,
+                            picture=row.get("picture"),
+                            public=row.get("public", True) is not False,
+                            password_hash=row.get("password_hash") or "")
+                db_session.add(user)
+                db_session.flush()
+                existing[email] = user.id
+                self.applied += 1
+            self.users[old_id] = existing[email]
+
+    def _apply_categories(self, db_session, owner, group):
+        names = set(row.get("name") for position, table, row in group)
+        known = set(name for (name,) in db_session.query(Category.name)
+                    .filter(Category.user_id == owner,
+                            Category.name.in_(list(names))))
+
+        creates, positions = [], []
+        for position, table, row in group:
+            if row.get("name") in known:
+                continue
+            known.add(row.get("name"))
+            creates.append({"name": row.get("name")})
+            positions.append(position)
+
+        results, deleted = bulk_writer.write_categories(
+            db_session, owner, creates, [], [])
+        self._count(results, positions)
+
+    def _apply_items(self, db_session, owner, group):
+        names = set(row.get("name") for position, table, row in group)
+        known = dict(db_session.query(Item.name, Item.id)
+                     .filter(Item.user_id == owner,
+                             Item.name.in_(list(names))))
+
+        creates, create_positions = [], []
+        updates, update_positions = [], []
+        for position, table, row in group:
+            record = {"name": row.get("name")}
+            if row.get("category_name") is not None:
+                record["category"] = row["category_name"]
+            if row.get("description") is not None:
+                record["description"] = row["description"]
+            if self.image_url is not None:
+                record["image_file"] = row.get("image_file")
+
+            if record["name"] in known:
+                record["id"] = known[record["name"]]
+                updates.append(record)
+                update_positions.append(position)
+            else:
+                creates.append(record)
+                create_positions.append(position)
+
+        results, deleted = bulk_writer.write_items(
+            db_session, owner, creates, updates, [],
+            image_url=self.image_url)
+        self._count(results, create_positions + update_positions)
+
+    def _count(self, results, positions):
+        # Results come in the order of the records they were made from
+        for result, position in zip(results, positions):
+            if result["status"] == "error":
+                self._error(position, result["error"])
+            else:
+                self.applied += 1
+
+    def save_file(self, user_id, filename, fileobj):
+        """Writes an upload file from an archive into the upload folder.
+
+        Files of unknown users, or that are not PNG or JPEG images, are
+        skipped.
+
+        Args:
+            user_id (int): Exported ID of the file's owner.
+            filename (str): Name of the image file.
+            fileobj: File object with its contents.
+        """
+
+        owner = (self.user_id if self.user_id is not None
+                 else self.users.get(user_id))
+        if owner is None or filename != secure_filename(filename):
+            return
+
+        header = fileobj.read(len(PNG_MAGIC))
+        if not (header.startswith(PNG_MAGIC) or
+                header.startswith(JPEG_MAGIC)):
+            return
+
+        user_dir = os.path.join(settings["upload_folder"], str(owner))
+        if not os.path.isdir(user_dir):
+            os.makedirs(user_dir)
+
+        # Written next to its final path and renamed, so a file is never
+        # seen half written
+        handle, tmp_path = tempfile.mkstemp(dir=user_dir, prefix=".import")
+        try:
+            with os.fdopen(handle, "wb") as image:
+                image.write(header)
+                while True:
+                    chunk = fileobj.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    image.write(chunk)
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, os.path.join(user_dir, filename))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    @property
+    def report(self):
+        """Returns the counters of the import as a dict."""
+
+        return {"position": self.position, "applied": self.applied,
+                "failed": self.failed, "errors": self.errors}
+
+
+def init_app(app):
+    """Applies the TRANSFER_* settings of an app.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    settings["batch_size"] = app.config["TRANSFER_BATCH_SIZE"]
+    settings["upload_folder"] = app.config["UPLOAD_FOLDER"]
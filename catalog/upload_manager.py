@@ -0,0 +1,449 @@
+"""
+This module contains code for streaming image uploads to disk.
+
+Werkzeug's form parser writes every uploaded file into the stream returned
+by `Request._get_file_stream()` one chunk at a time. `UploadRequest` hands
+it an `UploadStream`, which spools those chunks into a temporary file inside
+the upload folder while hashing them and sniffing the image header, so no
+upload is ever held in memory as a whole. Saved images are named after
+their SHA-1 digest, so the same image uploaded twice gets the same name.
+
+File removals are deferred: handlers schedule them on the database session
+and they are only carried out, in batches on a background worker, after
+the transaction commits. A periodic sweep reclaims files that no item
+references any more; every process schedules it, but only one of them
+runs it per interval.
+
+"""
+
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import time
+from functools import partial
+from flask import current_app, Request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from catalog.background import BatchWorker
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Item
+
+log = logging.getLogger(__name__)
+
+# Keys for paths parked on `Session.info` until the transaction ends
+PENDING_DELETES = "upload_manager.deletes"
+PENDING_DISCARDS = "upload_manager.discards"
+
+# File signatures of the accepted image formats
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+JPEG_MAGIC = b"\xff\xd8\xff"
+
+# PNG signature (8) + IHDR length and type (8) + width and height (8)
+HEADER_SIZE = 24
+
+# JPEG start-of-frame markers carry the image size
+# (0xC4, 0xC8 and 0xCC share the range but are not frames)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+
+class UploadError(Exception):
+    """Raised when an uploaded file cannot be accepted."""
+
+    pass
+
+
+class UploadStream(object):
+    """Writable file object that spools an upload to a temporary file.
+
+    The SHA-1 digest and the file header are collected as the chunks are
+    written, so neither validation nor naming needs to read the file back.
+
+    Args:
+        tmp_dir (str): Directory for the temporary file. It should be on the
+            same filesystem as the upload folder so `commit()` is atomic.
+    """
+
+    def __init__(self, tmp_dir):
+        fd, self.path = tempfile.mkstemp(prefix="upload-", dir=tmp_dir)
+        self._file = os.fdopen(fd, "w+b")
+        self._sha1 = hashlib.sha1()
+        self.header = b""
+        self.size = 0
+        self.committed = False
+
+    def __getattr__(self, name):
+        # Everything else (read, seek, tell...) goes to the real file
+        return getattr(self._file, name)
+
+    def write(self, data):
+        """Writes a chunk to disk and feeds the hash and header buffer.
+
+        Args:
+            data (str): A chunk of the uploaded file.
+        """
+
+        if len(self.header) < HEADER_SIZE:
+            self.header += data[:HEADER_SIZE - len(self.header)]
+        self._sha1.update(data)
+        self.size += len(data)
+        self._file.write(data)
+
+    @property
+    def digest(self):
+        """Hex SHA-1 digest of the bytes written so far."""
+
+        return self._sha1.hexdigest()
+
+    @property
+    def kind(self):
+        """Image type sniffed from the file signature ("png", "jpeg")."""
+
+        if self.header.startswith(PNG_MAGIC):
+            return "png"
+        if self.header.startswith(JPEG_MAGIC):
+            return "jpeg"
+        return None
+
+    def dimensions(self):
+        """Reads the image width and height from the file headers.
+
+        Only the PNG IHDR chunk or the JPEG marker segments are read; the
+        image data itself is never decoded.
+        """
+
+        if self.kind == "png":
+            if (len(self.header) < HEADER_SIZE or
+                    self.header[12:16] != b"IHDR"):
+                return None
+            return struct.unpack(">II", self.header[16:24])
+        if self.kind == "jpeg":
+            return self._jpeg_dimensions()
+        return None
+
+    def _jpeg_dimensions(self):
+        """Walks the JPEG marker segments until a start-of-frame is found."""
+
+        self._file.flush()
+        self._file.seek(2)
+
+        while True:
+            marker = self._file.read(2)
+            if len(marker) < 2 or marker[0] != b"\xff":
+                return None
+
+            # Markers may be padded with any number of 0xFF fill bytes
+            code = ord(marker[1])
+            while code == 0xFF:
+                code = ord(self._file.read(1) or b"\x00")
+
+            length = self._file.read(2)
+            if len(length) < 2:
+                return None
+            length = struct.unpack(">H", length)[0]
+
+            if code in JPEG_SOF_MARKERS:
+                frame = self._file.read(5)
+                if len(frame) < 5:
+                    return None
+                height, width = struct.unpack(">xHH", frame)
+                return width, height
+
+            # Skip the segment body without reading it
+            self._file.seek(length - 2, os.SEEK_CUR)
+
+    def validate(self, max_dimension):
+        """Checks the sniffed type and header dimensions of the upload.
+
+        Args:
+            max_dimension (int): Largest accepted width or height in pixels.
+        """
+
+        if self.kind is None:
+            raise UploadError("Only PNG and JPEG images are accepted.")
+
+        size = self.dimensions()
+        if size is None or 0 in size:
+            raise UploadError("Could not read the image dimensions.")
+        if max(size) > max_dimension:
+            raise UploadError("Image dimensions exceeded {0}x{0} pixels."
+                              .format(max_dimension))
+
+    def commit(self, path):
+        """Moves the temporary file to its final location.
+
+        Args:
+            path (str): Destination path of the image file.
+        """
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+        # mkstemp() creates files only the owner can read
+        os.chmod(self.path, 0o644)
+        os.rename(self.path, path)
+        self.committed = True
+
+    def close(self):
+        """Closes the file and discards it unless it was committed."""
+
+        self._file.close()
+
+        if not self.committed:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class UploadRequest(Request):
+    """Flask request class that streams file uploads to disk."""
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        tmp_dir = os.path.join(current_app.config["UPLOAD_FOLDER"], ".tmp")
+
+        if not os.path.isdir(tmp_dir):
+            os.makedirs(tmp_dir)
+
+        return UploadStream(tmp_dir)
+
+
+def content_name(file_obj):
+    """Returns the file name of an upload, derived from its content.
+
+    The name is the hex SHA-1 digest of the file and an extension for its
+    type, so an image that is already saved can be found by name.
+
+    Args:
+        file_obj (:obj:`FileStorage`): Item from Flask's Request.files.
+    """
+
+    stream = file_obj.stream
+    if isinstance(stream, UploadStream):
+        digest = stream.digest
+        extension = {"png": "png", "jpeg": "jpg"}.get(stream.kind)
+    else:
+        # Uploads parsed by a plain Request are hashed the usual way
+        sha1 = hashlib.sha1()
+        stream.seek(0)
+        for chunk in iter(partial(stream.read, 64 * 1024), b""):
+            sha1.update(chunk)
+        stream.seek(0)
+        digest = sha1.hexdigest()
+        extension = None
+
+    if extension is None:
+        extension = file_obj.filename.rsplit(".", 1)[-1].lower()
+    return "{}.{}".format(digest, extension)
+
+
+def save_upload(file_obj, path):
+    """Validates an uploaded image and moves it into place.
+
+    Args:
+        file_obj (:obj:`FileStorage`): Item from Flask's Request.files.
+        path (str): Destination path of the image file.
+    """
+
+    stream = file_obj.stream
+
+    # Uploads parsed by a plain Request are copied the usual way
+    if not isinstance(stream, UploadStream):
+        file_obj.save(path)
+        return
+
+    stream.validate(current_app.config["UPLOAD_MAX_DIMENSION"])
+    stream.commit(path)
+
+
+def max_upload_mb():
+    """Returns the request size limit in megabytes for error messages."""
+
+    return current_app.config["MAX_CONTENT_LENGTH"] // (1024 * 1024)
+
+
+def remove_files(paths):
+    """Removes a batch of files, ignoring ones that are already gone.
+
+    Args:
+        paths (:obj:`list` of :obj:`str`): Paths of the files to remove.
+    """
+
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                log.warning("Could not remove %s: %s", path, err)
+
+
+def sweep_orphans(upload_dir, grace):
+    """Removes upload files that no item record references.
+
+    Files younger than `grace` seconds are left alone, since they may
+    belong to a request whose transaction has not committed yet.
+
+    Args:
+        upload_dir (str): The upload folder with one directory per user.
+        grace (int): Minimum age in seconds of a file to be reclaimed.
+
+    Returns:
+        tuple: Number of files removed and bytes reclaimed.
+    """
+
+    db_session = session_factory()
+
+    try:
+        referenced = set(
+            (str(user_id), image_file) for user_id, image_file in
+            db_session.query(Item.user_id, Item.image_file)
+            .filter(Item.image_file.isnot(None)))
+    finally:
+        db_session.close()
+
+    cutoff = time.time() - grace
+    removed = reclaimed = 0
+
+    for dirname in os.listdir(upload_dir):
+        user_dir = os.path.join(upload_dir, dirname)
+
+        # Only the per-user directories and leftover temporary files
+        if not os.path.isdir(user_dir) or not (dirname.isdigit() or
+                                                dirname == ".tmp"):
+            continue
+
+        for filename in os.listdir(user_dir):
+            if (dirname, filename) in referenced:
+                continue
+
+            path = os.path.join(user_dir, filename)
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime > cutoff:
+                    continue
+                os.remove(path)
+            except OSError:
+                continue
+
+            removed += 1
+            reclaimed += stat.st_size
+
+    if removed:
+        log.info("Reclaimed %d orphaned upload(s), %d bytes", removed,
+                 reclaimed)
+
+    return removed, reclaimed
+
+
+def sweep_once(upload_dir, grace, interval):
+    """Runs `sweep_orphans()` unless another process swept recently.
+
+    Each worker process schedules its own sweep, so they take turns
+    through an exclusive lock on a file in the upload folder that holds
+    the time of the last sweep. A process that finds the lock taken, or a
+    sweep less than half an interval old, skips its turn.
+
+    Args:
+        upload_dir (str): The upload folder with one directory per user.
+        grace (int): Minimum age in seconds of a file to be reclaimed.
+        interval (int): Seconds between scheduled sweeps.
+
+    Returns:
+        tuple: The result of `sweep_orphans()`, or None if skipped.
+    """
+
+    with open(os.path.join(upload_dir, ".sweep"), "a+") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            return None
+
+        try:
+            lock.seek(0)
+            try:
+                last = float(lock.read() or 0)
+            except ValueError:
+                last = 0
+            if time.time() - last < interval / 2.0:
+                return None
+
+            result = sweep_orphans(upload_dir, grace)
+            lock.seek(0)
+            lock.truncate()
+            lock.write(repr(time.time()))
+            lock.flush()
+            return result
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+deleter = BatchWorker("upload-deleter", remove_files)
+
+
+def init_app(app):
+    """Configures the deletion worker and its orphan sweep for an app.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    deleter.batch_size = app.config["UPLOAD_DELETE_BATCH"]
+    deleter.period = app.config["UPLOAD_GC_INTERVAL"]
+    deleter.periodic = partial(sweep_once, app.config["UPLOAD_FOLDER"],
+                               app.config["UPLOAD_GC_GRACE"],
+                               app.config["UPLOAD_GC_INTERVAL"])
+
+    # Started per process so forked workers each run their own thread, and
+    # `sweep_once()` keeps their sweeps from overlapping
+    app.before_first_request(deleter.start)
+
+
+def delete_after_commit(db_session, path):
+    """Schedules a file removal for when the transaction commits.
+
+    Nothing is removed if the transaction rolls back instead.
+
+    Args:
+        db_session (:obj:`Session`): The session that owns the change.
+        path (str): Path of the file to remove.
+    """
+
+    db_session.info.setdefault(PENDING_DELETES, []).append(path)
+
+
+def discard_on_rollback(db_session, path):
+    """Schedules removal of a freshly saved file if the transaction fails.
+
+    Args:
+        db_session (:obj:`Session`): The session that owns the change.
+        path (str): Path of the newly saved file.
+    """
+
+    db_session.info.setdefault(PENDING_DISCARDS, []).append(path)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(db_session):
+    for path in db_session.info.pop(PENDING_DELETES, ()):
+        deleter.put(path)
+
+    # The new files are now referenced by committed records
+    db_session.info.pop(PENDING_DISCARDS, None)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _after_transaction_end(db_session, transaction):
+    # Only the outermost transaction decides the outcome
+    if transaction.parent is not None:
+        return
+
+    # Anything still pending here was not committed
+    db_session.info.pop(PENDING_DELETES, None)
+
+    for path in db_session.info.pop(PENDING_DISCARDS, ()):
+        deleter.put(path)
@@ -0,0 +1,120 @@
+"""
+This module contains the cached lookups of user records.
+
+Views get a read-only `UserSnapshot` instead of a `User` row. Each request
+memoizes its lookups on Flask's `g`, so resolving the same user several
+times costs one query, and snapshots are also kept in a small LRU cache
+shared by the requests of a process for USER_CACHE_TTL seconds. Handlers
+that change a user call `invalidate()`; other processes pick up the change
+when their cached copy expires.
+
+"""
+
+from collections import namedtuple
+from flask import g, has_app_context
+from catalog.cache import LRUCache, MISSING
+from catalog.connection_manager import session_factory
+from catalog.db_setup import User
+
+UserSnapshot = namedtuple("UserSnapshot", [
+    "id", "username", "email", "picture", "public", "catalog_updated"])
+
+# Setting USER_CACHE_TTL to 0 leaves only the per-request memo
+settings = {"ttl": 10}
+
+cache = LRUCache(maxsize=1024)
+
+
+def _memo():
+    if not has_app_context():
+        return {}
+    if "_user_memo" not in g:
+        g._user_memo = {}
+    return g._user_memo
+
+
+def _lookup(key, **criteria):
+    memo = _memo()
+    user = memo.get(key, MISSING)
+    if user is not MISSING:
+        return user
+
+    user = cache.get(key) if settings["ttl"] else MISSING
+    if user is MISSING:
+        # A short-lived session, so rows are never served from a stale
+        # identity map
+        db_session = session_factory()
+        try:
+            record = db_session.query(User).filter_by(**criteria).first()
+        finally:
+            db_session.close()
+
+        user = None
+        if record is not None:
+            user = UserSnapshot(record.id, record.username, record.email,
+                                record.picture, record.public,
+                                record.catalog_updated)
+
+            # Missing users are not cached, so signups show up at once
+            if settings["ttl"]:
+                cache.set(("id", user.id), user, settings["ttl"])
+                cache.set(("email", user.email), user, settings["ttl"])
+
+    memo[key] = user
+    return user
+
+
+def get_user(user_id):
+    """Returns a snapshot of a user, or None if there is no such user.
+
+    Args:
+        user_id (int): User's database `id` key value.
+    """
+
+    user_id = int(user_id)
+    return _lookup(("id", user_id), id=user_id)
+
+
+def get_user_by_email(email):
+    """Returns a snapshot of the user with an email, or None.
+
+    Args:
+        email (str): User's associated email address.
+    """
+
+    return _lookup(("email", email), email=email)
+
+
+def invalidate(user_id=None, email=None):
+    """Drops cached lookups of a user after its record changed.
+
+    Args:
+        user_id (int): User's database `id` key value.
+        email (str): Email address the user had or now has.
+    """
+
+    memo = _memo()
+    keys = []
+    if user_id is not None:
+        key = ("id", int(user_id))
+        user = memo.get(key) or cache.get(key, None)
+        keys.append(key)
+        if user is not None:
+            keys.append(("email", user.email))
+    if email is not None:
+        keys.append(("email", email))
+
+    for key in keys:
+        cache.delete(key)
+        memo.pop(key, None)
+
+
+def init_app(app):
+    """Applies the USER_CACHE_* settings of an app.
+
+    Args:
+        app (:obj:`Flask`): The application object.
+    """
+
+    settings["ttl"] = app.config["USER_CACHE_TTL"]
+    cache.maxsize = app.config["USER_CACHE_SIZE"]
@@ -0,0 +1,25 @@
+"""
+gunicorn settings for the catalog application:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+"""
+
+import multiprocessing
+
+bind = "0.0.0.0:8000"
+workers = multiprocessing.cpu_count() * 2 + 1
+
+# Threads share a worker's connection pools and caches
+threads = 4
+
+# Creates the app once in the master, so workers start without importing
+# or warming anything
+preload_app = True
+
+
+def post_fork(server, worker):
+    from catalog import reset_after_fork
+
+    # Workers open their own database and Redis connections
+    reset_after_fork()
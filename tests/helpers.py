@@ -0,0 +1,127 @@
+"""
+This module contains the shared setup of the test suite.
+
+Each test gets an app with its own database, session store and upload
+folder in a temporary directory. Redis is left out, so the caches run
+per process, and the in-process caches are emptied between tests because
+user IDs repeat across the test databases.
+
+"""
+
+import imp
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from catalog import (autocomplete, catalog_snapshot, create_app, page_cache,
+                     user_service)
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Category, User
+from catalog.login import http_client
+
+# The fake provider is a script, outside the catalog package
+fake_provider = imp.load_source("fake_provider", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "catalog", "scripts", "fake_provider.py"))
+
+
+class AppTestCase(unittest.TestCase):
+    """Test case with a fresh app and database.
+
+    Attributes:
+        config (dict): Settings a test case adds to the test defaults.
+    """
+
+    config = {}
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="catalog-test-")
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        os.mkdir(os.path.join(self.dir, "uploads"))
+
+        config = {
+            "TESTING": True,
+            "SECRET_KEY": "test",
+            "DATABASE_URL": "sqlite:///" + os.path.join(self.dir, "test.db"),
+            "SESSION_BACKEND": "sqlite",
+            "SESSION_SQLITE_PATH": os.path.join(self.dir, "sessions.db"),
+            "UPLOAD_FOLDER": os.path.join(self.dir, "uploads"),
+            "PAGE_CACHE_REDIS": False,
+            "SNAPSHOT_REDIS": False,
+            "TEMPLATE_BYTECODE_CACHE": None,
+            "TEMPLATE_WARMUP": False,
+            "PASSWORD_ROUNDS": 1000
+        }
+        config.update(self.config)
+
+        for cache in (catalog_snapshot.snapshots, page_cache.pages,
+                      user_service.cache, autocomplete.indexes,
+                      autocomplete.public):
+            cache.clear()
+        page_cache.local_versions.clear()
+
+        self.app = create_app(config)
+        self.client = self.app.test_client()
+
+    def make_user(self, email="tester@example.com", password=None,
+                  public=True):
+        """Adds a user with an "Unsorted" category and returns its ID."""
+
+        db_session = session_factory()
+        try:
+            user = User(username=email.split("@")[0], email=email,
+                        public=public)
+            if password is not None:
+                user.hash_password(password)
+            else:
+                user.password_hash = "-"
+            db_session.add(user)
+            db_session.flush()
+            db_session.add(Category(name="Unsorted", user_id=user.id))
+            db_session.commit()
+            return user.id
+        finally:
+            db_session.close()
+
+    def sign_in(self, user_id, email="tester@example.com"):
+        """Makes the test client's session signed in as a catalog user."""
+
+        with self.client.session_transaction() as sess:
+            sess["provider"] = "catalog"
+            sess["user_id"] = user_id
+            sess["username"] = email.split("@")[0]
+            sess["email"] = email
+            sess["picture"] = None
+            sess["access_token"] = None
+            sess["state"] = "STATE"
+
+    def start_provider(self, delay=0.0, client_id="", failures=0):
+        """Points the provider client at a fake provider server.
+
+        The server from `catalog/scripts/fake_provider.py` answers every
+        provider, after `delay` seconds and once `failures` requests were
+        answered with a 503, and is stopped after the test.
+
+        Returns:
+            The server, whose `base_url` is its origin.
+        """
+
+        server = fake_provider.make_server(0, delay, client_id,
+                                           failures=failures)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        server.base_url = "http://127.0.0.1:{}".format(
+            server.server_address[1])
+        self.app.config["PROVIDER_BASE_URLS"] = dict(
+            (provider, server.base_url)
+            for provider in http_client.PROVIDER_ORIGINS)
+        http_client.init_app(self.app)
+
+        # Closed kept-alive connections let the server threads finish
+        self.addCleanup(lambda: http_client.client.session.close())
+        return server
@@ -0,0 +1,89 @@
+"""Tests for the autocomplete indexes."""
+
+import unittest
+from catalog import autocomplete, catalog_snapshot, item_counts
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Category, Item
+from tests.helpers import AppTestCase
+
+
+class AutocompleteTest(AppTestCase):
+
+    def setUp(self):
+        super(AutocompleteTest, self).setUp()
+        self.user_id = self.make_user()
+        self.db_session = session_factory()
+        self.addCleanup(self.db_session.close)
+        self.unsorted = self.db_session.query(Category).one()
+
+    def names(self, index, prefix=u"a"):
+        return [(match["name"], match["kind"])
+                for match in index.search(prefix)]
+
+    def add_item(self, name):
+        item = Item(name=name, user_id=self.user_id,
+                    category=self.unsorted)
+        self.db_session.add(item)
+        item_counts.added(self.db_session, self.user_id, self.unsorted.id)
+        catalog_snapshot.item_saved(self.db_session, item)
+        self.db_session.commit()
+        return item
+
+    def test_indexes_follow_each_commit(self):
+        index = autocomplete.user_index(self.user_id)
+        shared = autocomplete.public_index()
+        self.assertEqual(self.names(index), [])
+
+        item = self.add_item(u"Apple")
+        self.assertIs(autocomplete.user_index(self.user_id), index)
+        self.assertEqual(self.names(index), [(u"Apple", "item")])
+        self.assertEqual(self.names(shared), [(u"Apple", "item")])
+
+        item.name = u"Apricot"
+        catalog_snapshot.item_saved(self.db_session, item)
+        self.db_session.commit()
+        self.assertEqual(self.names(index), [(u"Apricot", "item")])
+        self.assertEqual(self.names(shared), [(u"Apricot", "item")])
+
+        self.unsorted.name = u"Attic"
+        catalog_snapshot.category_saved(self.db_session, self.unsorted)
+        self.db_session.commit()
+        self.assertEqual(self.names(index), [(u"Apricot", "item"),
+                                             (u"Attic", "category")])
+        self.assertEqual(self.names(index, u"unsorted"), [])
+
+        self.db_session.delete(item)
+        item_counts.removed(self.db_session, self.user_id, self.unsorted.id)
+        catalog_snapshot.item_deleted(self.db_session, item)
+        self.db_session.commit()
+        self.assertIs(autocomplete.user_index(self.user_id), index)
+        self.assertEqual(self.names(index), [(u"Attic", "category")])
+        self.assertEqual(self.names(shared), [(u"Attic", "category")])
+
+    def test_rolled_back_changes_are_not_applied(self):
+        index = autocomplete.user_index(self.user_id)
+
+        item = Item(name=u"Apple", user_id=self.user_id,
+                    category=self.unsorted)
+        self.db_session.add(item)
+        catalog_snapshot.item_saved(self.db_session, item)
+        self.db_session.rollback()
+
+        self.assertEqual(self.names(autocomplete.user_index(self.user_id)),
+                         [])
+        self.assertEqual(self.names(index), [])
+
+    def test_api_answers_from_the_updated_index(self):
+        self.sign_in(self.user_id)
+        url = "/catalog/api/1.0/autocomplete?prefix=ap&user_id={}".format(
+            self.user_id)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.add_item(u"Apple")
+
+        response = self.client.get(url)
+        self.assertIn("Apple", response.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
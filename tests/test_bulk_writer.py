@@ -0,0 +1,179 @@
+"""Tests for the bulk item and category writers."""
+
+import unittest
+from catalog import bulk_writer
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Category, Item, User
+from tests.helpers import AppTestCase
+
+
+class BulkWriterTest(AppTestCase):
+
+    def setUp(self):
+        super(BulkWriterTest, self).setUp()
+        self.user_id = self.make_user()
+        self.db_session = session_factory()
+        self.addCleanup(self.db_session.close)
+
+    def write_items(self, creates=(), updates=(), deletes=(),
+                    atomic=False):
+        results, deleted = bulk_writer.write_items(
+            self.db_session, self.user_id, list(creates), list(updates),
+            list(deletes), atomic)
+        self.db_session.commit()
+        return results
+
+    def write_categories(self, creates=(), updates=(), deletes=(),
+                         atomic=False):
+        results, deleted = bulk_writer.write_categories(
+            self.db_session, self.user_id, list(creates), list(updates),
+            list(deletes), atomic)
+        self.db_session.commit()
+        return results
+
+    def names(self, model):
+        return sorted(row.name for row in self.db_session.query(model.name)
+                      .filter(model.user_id == self.user_id))
+
+    def category_of(self, item_name):
+        return (self.db_session.query(Category.name)
+                .join(Item, Item.category_id == Category.id)
+                .filter(Item.name == item_name).scalar())
+
+    def test_each_record_gets_a_result(self):
+        first = self.write_items(creates=[{"name": "Alpha"}])
+        alpha_id = first[0]["id"]
+
+        results = self.write_items(
+            creates=[{"name": "Beta"}, {"name": "Alpha"}, "nope"],
+            updates=[{"id": alpha_id, "description": "First"},
+                     {"id": 999, "name": "Ghost"}],
+            deletes=[{"id": alpha_id}])
+
+        # Deletes run first, so the new "Alpha" takes the freed name
+        self.assertEqual([(result["op"], result["status"])
+                          for result in results],
+                         [("create", "created"), ("create", "created"),
+                          ("create", "error"), ("update", "error"),
+                          ("update", "error"), ("delete", "deleted")])
+        self.assertEqual(results[2]["error"], "Not an object.")
+        self.assertEqual(results[3]["error"], "Record listed twice.")
+        self.assertEqual(results[4]["error"], "Record not found.")
+        self.assertNotEqual(results[1]["id"], alpha_id)
+        self.assertEqual(self.names(Item), ["Alpha", "Beta"])
+        self.assertEqual(self.category_of("Beta"), "Unsorted")
+
+    def test_atomic_batch_with_an_error_writes_nothing(self):
+        results = self.write_items(
+            creates=[{"name": "Alpha"}, {"name": ""}], atomic=True)
+
+        self.assertEqual([result["status"] for result in results],
+                         ["skipped", "error"])
+        self.assertNotIn("id", results[0])
+        self.assertEqual(self.names(Item), [])
+
+        results = self.write_items(creates=[{"name": "Alpha"}], atomic=True)
+        self.assertEqual(results[0]["status"], "created")
+        self.assertEqual(self.names(Item), ["Alpha"])
+
+    def test_counts_follow_the_writes(self):
+        self.write_categories(creates=[{"name": "Books"}])
+        self.write_items(creates=[{"name": "Alpha", "category": "Books"},
+                                  {"name": "Beta", "category": "Books"}])
+
+        self.assertEqual(self.db_session.query(User.item_count)
+                         .filter_by(id=self.user_id).scalar(), 2)
+        self.assertEqual(self.db_session.query(Category.item_count)
+                         .filter_by(name="Books").scalar(), 2)
+
+    def test_deleted_category_hands_items_to_unsorted(self):
+        created = self.write_categories(creates=[{"name": "Books"}])
+        self.write_items(creates=[{"name": "Alpha", "category": "Books"}])
+
+        results = self.write_categories(deletes=[{"id": created[0]["id"]}])
+
+        self.assertEqual(results[0]["status"], "deleted")
+        self.assertEqual(self.category_of("Alpha"), "Unsorted")
+        self.assertEqual(self.db_session.query(Category.item_count)
+                         .filter_by(name="Unsorted").scalar(), 1)
+
+    def test_missing_unsorted_category_is_created(self):
+        created = self.write_categories(creates=[{"name": "Books"}])
+        self.write_items(creates=[{"name": "Alpha", "category": "Books"}])
+        self.db_session.query(Category).filter_by(name="Unsorted").delete()
+        self.db_session.commit()
+
+        results = self.write_categories(
+            creates=[{"name": "Unsorted"}],
+            deletes=[{"id": created[0]["id"]}])
+
+        self.assertEqual(results[0]["status"], "error")
+        self.assertEqual(results[1]["status"], "deleted")
+        self.assertEqual(self.names(Category), ["Unsorted"])
+        self.assertEqual(self.category_of("Alpha"), "Unsorted")
+
+    def test_unsorted_cannot_be_renamed_or_deleted(self):
+        unsorted_id = (self.db_session.query(Category.id)
+                       .filter_by(name="Unsorted").scalar())
+
+        results = self.write_categories(
+            updates=[{"id": unsorted_id, "name": "Misc"}],
+            deletes=[{"id": unsorted_id}])
+
+        self.assertEqual([result["status"] for result in results],
+                         ["error", "error"])
+        self.assertEqual(self.names(Category), ["Unsorted"])
+
+
+class DeleteCategoryViewTest(AppTestCase):
+
+    def setUp(self):
+        super(DeleteCategoryViewTest, self).setUp()
+        self.user_id = self.make_user()
+        self.sign_in(self.user_id)
+
+    def delete(self, name):
+        return self.client.post(
+            "/catalog/category/{}/{}/delete".format(name, self.user_id),
+            data={"csrf-token": "STATE", "fm-yn": "Y"})
+
+    def category_names(self):
+        db_session = session_factory()
+        try:
+            return sorted(row.name for row in db_session.query(Category.name))
+        finally:
+            db_session.close()
+
+    def test_unsorted_is_not_deleted(self):
+        response = self.delete("Unsorted")
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.category_names(), ["Unsorted"])
+
+    def test_missing_unsorted_is_created(self):
+        db_session = session_factory()
+        try:
+            db_session.query(Category).delete()
+            books = Category(name="Books", user_id=self.user_id)
+            db_session.add(books)
+            db_session.flush()
+            db_session.add(Item(name="Alpha", user_id=self.user_id,
+                                category_id=books.id))
+            db_session.commit()
+        finally:
+            db_session.close()
+
+        response = self.delete("Books")
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.category_names(), ["Unsorted"])
+        db_session = session_factory()
+        try:
+            item = db_session.query(Item).filter_by(name="Alpha").one()
+            self.assertEqual(item.category.name, "Unsorted")
+        finally:
+            db_session.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
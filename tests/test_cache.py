@@ -0,0 +1,72 @@
+"""Tests for the in-process LRU cache."""
+
+import unittest
+from catalog import cache
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.addCleanup(setattr, cache, "time", cache.time)
+        cache.time = self.clock
+
+    def test_least_recently_used_entry_is_evicted(self):
+        lru = cache.LRUCache(maxsize=2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+
+        # Reading "a" makes "b" the oldest
+        self.assertEqual(lru.get("a"), 1)
+        lru.set("c", 3)
+
+        self.assertIs(lru.get("b"), cache.MISSING)
+        self.assertEqual((lru.get("a"), lru.get("c")), (1, 3))
+        self.assertEqual(len(lru), 2)
+        self.assertEqual((lru.hits, lru.misses), (3, 1))
+
+    def test_none_is_cached(self):
+        lru = cache.LRUCache()
+        lru.set("a", None)
+
+        self.assertIsNone(lru.get("a", "default"))
+        self.assertEqual(lru.get("b", "default"), "default")
+
+    def test_entries_expire(self):
+        lru = cache.LRUCache(ttl=10)
+        lru.set("a", 1)
+        lru.set("b", 2, ttl=60)
+        lru.set("c", 3, ttl=0)
+
+        self.assertIs(lru.get("c"), cache.MISSING)
+        self.clock.now += 10
+        self.assertIs(lru.get("a"), cache.MISSING)
+        self.assertEqual(lru.get("b"), 2)
+        self.clock.now += 50
+        self.assertIs(lru.get("b"), cache.MISSING)
+
+    def test_delete_and_clear(self):
+        lru = cache.LRUCache()
+        lru.set("a", 1)
+        lru.set("b", 2)
+
+        lru.delete("a")
+        lru.delete("missing")
+        self.assertIs(lru.get("a"), cache.MISSING)
+        self.assertEqual(lru.get("b"), 2)
+
+        lru.clear()
+        self.assertEqual(len(lru), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+"""Tests for the incremental updates of catalog snapshots."""
+
+import unittest
+from StringIO import StringIO
+from catalog import bulk_writer, catalog_snapshot, page_cache
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Item
+from tests.helpers import AppTestCase
+
+
+class SnapshotUpdateTest(AppTestCase):
+
+    def setUp(self):
+        super(SnapshotUpdateTest, self).setUp()
+        self.user_id = self.make_user()
+        self.sign_in(self.user_id)
+
+        self.post("/catalog/category/new", {"fm-name": "Books"})
+        self.new_item("Alpha", "Books")
+        self.new_item("Beta", "Unsorted")
+
+        # Later changes are applied to this snapshot
+        catalog_snapshot.get(self.user_id)
+
+    def post(self, url, data):
+        data = dict(data, **{"csrf-token": "STATE"})
+        response = self.client.post(url, data=data)
+        self.assertEqual(response.status_code, 302)
+
+    def new_item(self, name, category):
+        self.post("/catalog/item/new",
+                  {"fm-name": name, "fm-description": "",
+                   "category_name": category,
+                   "fm-image": (StringIO(""), "")})
+
+    def assertMatchesRebuild(self):
+        version = page_cache.version(self.user_id)
+        cached = catalog_snapshot.snapshots.get(self.user_id)
+
+        # Updated in place rather than dropped for a rebuild
+        self.assertEqual(cached["v"], version)
+        rebuilt = catalog_snapshot.build(self.user_id, version)
+        for key in ("c", "n", "i", "r"):
+            self.assertEqual(cached[key], rebuilt[key], key)
+        return cached
+
+    def test_item_create_edit_and_move(self):
+        self.new_item("Gamma", "Books")
+        self.assertMatchesRebuild()
+
+        self.post("/catalog/item/Alpha/{}/edit".format(self.user_id),
+                  {"fm-name": "Alpha Prime", "fm-description": "Edited",
+                   "fm-category": "Unsorted",
+                   "fm-image": (StringIO(""), "")})
+        snapshot = self.assertMatchesRebuild()
+        self.assertEqual([row[catalog_snapshot.ITEM_NAME]
+                          for row in snapshot["i"]["Unsorted"]],
+                         ["Alpha Prime", "Beta"])
+
+        self.post("/catalog/item/Beta/{}/delete".format(self.user_id),
+                  {"fm-yn": "Y"})
+        snapshot = self.assertMatchesRebuild()
+        self.assertEqual(catalog_snapshot.item_count(snapshot), 2)
+
+    def test_category_rename(self):
+        self.post("/catalog/category/Books/{}/edit".format(self.user_id),
+                  {"fm-name": "Novels"})
+
+        snapshot = self.assertMatchesRebuild()
+        self.assertNotIn("Books", snapshot["i"])
+        self.assertEqual([category["name"] for category
+                          in catalog_snapshot.categories(snapshot)],
+                         ["Novels", "Unsorted"])
+
+    def test_category_delete_moves_items_to_unsorted(self):
+        self.post("/catalog/category/Books/{}/delete".format(self.user_id),
+                  {"fm-yn": "Y"})
+
+        snapshot = self.assertMatchesRebuild()
+        self.assertEqual(sorted(snapshot["i"]), ["Unsorted"])
+        self.assertEqual([category["item_count"] for category
+                          in catalog_snapshot.categories(snapshot)], [2])
+
+    def test_bulk_writes(self):
+        db_session = session_factory()
+        try:
+            bulk_writer.write_items(
+                db_session, self.user_id,
+                [{"name": "Gamma", "category": "Books"}], [], [], False)
+            bulk_writer.write_categories(
+                db_session, self.user_id, [{"name": "Music"}], [], [], False)
+            db_session.commit()
+        finally:
+            db_session.close()
+
+        self.assertMatchesRebuild()
+
+    def test_version_gap_forces_a_rebuild(self):
+        stale = catalog_snapshot.snapshots.get(self.user_id)
+
+        # Another process adds an item and bumps the version
+        db_session = session_factory()
+        try:
+            unsorted_id = (db_session.query(Item.category_id)
+                           .filter_by(name="Beta").scalar())
+            db_session.add(Item(name="Delta", user_id=self.user_id,
+                                category_id=unsorted_id))
+            db_session.commit()
+        finally:
+            db_session.close()
+        page_cache.bump(self.user_id)
+
+        # This process's next change cannot be applied on top
+        self.new_item("Gamma", "Books")
+        self.assertIs(catalog_snapshot.snapshots.get(self.user_id), stale)
+
+        snapshot = catalog_snapshot.get(self.user_id)
+        self.assertEqual(snapshot["v"], page_cache.version(self.user_id))
+        self.assertEqual(
+            sorted(item["name"] for item in catalog_snapshot.items(snapshot)),
+            ["Alpha", "Beta", "Delta", "Gamma"])
+
+
+if __name__ == "__main__":
+    unittest.main()
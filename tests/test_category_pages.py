@@ -0,0 +1,97 @@
+"""Tests for the keyset cursors of category pages."""
+
+import re
+import unittest
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Category, Item
+from catalog.main.controller import decode_cursor, encode_cursor
+from tests.helpers import AppTestCase
+
+NAMES = ["Delta", "alpha", "Charlie", "Echo", "Bravo"]
+
+
+class CategoryPageTest(AppTestCase):
+
+    config = {"CATEGORY_PAGE_SIZE": 2}
+
+    def setUp(self):
+        super(CategoryPageTest, self).setUp()
+        self.user_id = self.make_user()
+        self.sign_in(self.user_id)
+
+        db_session = session_factory()
+        try:
+            category = Category(name="Books", user_id=self.user_id)
+            db_session.add(category)
+            db_session.flush()
+            for name in NAMES:
+                db_session.add(Item(name=name, user_id=self.user_id,
+                                    category_id=category.id))
+            db_session.commit()
+        finally:
+            db_session.close()
+
+        self.first = "/catalog/Books/{}/".format(self.user_id)
+
+    def get_page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        links = dict(
+            (kind, href.replace("&amp;", "&")) for href, kind in re.findall(
+                r'href="([^"]*\?(before|after)=[^"]*)"', response.data))
+        found = [(response.data.find(">{}<".format(name)), name)
+                 for name in NAMES]
+        items = [name for position, name in sorted(found) if position >= 0]
+        return items, links.get("before"), links.get("after")
+
+    def test_next_and_previous_links_walk_every_item(self):
+        pages = []
+        items, before, after = self.get_page(self.first)
+        self.assertIsNone(before)
+        while True:
+            pages.append(items)
+            if after is None:
+                break
+            items, before, after = self.get_page(after)
+            self.assertIsNotNone(before)
+
+        # Items are ordered by name, with uppercase before lowercase
+        self.assertEqual(pages, [["Bravo", "Charlie"], ["Delta", "Echo"],
+                                 ["alpha"]])
+
+        items, before, after = self.get_page(before)
+        self.assertEqual(items, ["Delta", "Echo"])
+        items, before, after = self.get_page(before)
+        self.assertEqual(items, ["Bravo", "Charlie"])
+        self.assertIsNone(before)
+
+    def test_cursor_survives_changes_before_it(self):
+        items, before, after = self.get_page(self.first)
+
+        db_session = session_factory()
+        try:
+            db_session.query(Item).filter_by(name="Bravo").delete()
+            db_session.query(Item).filter_by(name="Charlie").delete()
+            db_session.commit()
+        finally:
+            db_session.close()
+
+        # Still continues after "Charlie", not at an offset
+        items, before, after = self.get_page(after)
+        self.assertEqual(items, ["Delta", "Echo"])
+
+    def test_cursor_round_trip(self):
+        cursor = encode_cursor(u"Caf\xe9 / 1", 42)
+        self.assertNotIn("=", cursor)
+        self.assertEqual(decode_cursor(cursor), (u"Caf\xe9 / 1", 42))
+
+    def test_malformed_cursors_are_rejected(self):
+        for cursor in ("%%%", "bm90IGpzb24", encode_cursor("Delta", 1)[:-2],
+                       "WzEsMl0"):
+            response = self.client.get("{}?after={}".format(self.first,
+                                                             cursor))
+            self.assertEqual(response.status_code, 400, cursor)
+
+
+if __name__ == "__main__":
+    unittest.main()
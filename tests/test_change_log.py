@@ -0,0 +1,129 @@
+"""Tests for the change log and its sync tokens."""
+
+import unittest
+from catalog import change_log
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Category, ChangeLogLock, Item
+from tests.helpers import AppTestCase
+
+
+class ChangeLogTest(AppTestCase):
+
+    def setUp(self):
+        super(ChangeLogTest, self).setUp()
+        self.user_id = self.make_user()
+        self.start = change_log.latest()
+
+        db_session = session_factory()
+        try:
+            category = Category(name="Books", user_id=self.user_id)
+            db_session.add(category)
+            change_log.category_changed(db_session, category,
+                                        change_log.CREATE)
+            for name in ("Alpha", "Beta"):
+                item = Item(name=name, user_id=self.user_id,
+                            category_id=category.id)
+                db_session.add(item)
+                change_log.item_changed(db_session, item, change_log.CREATE)
+            db_session.commit()
+        finally:
+            db_session.close()
+
+    def test_pages_follow_tokens_in_order(self):
+        first, more = change_log.changes_since(self.start, 2)
+        self.assertTrue(more)
+        self.assertEqual([change["kind"] for change in first],
+                         ["category", "item"])
+
+        rest, more = change_log.changes_since(int(first[-1]["token"]), 2)
+        self.assertFalse(more)
+        self.assertEqual([change["data"]["name"] for change in rest],
+                         ["Beta"])
+        self.assertEqual(rest[0]["data"]["category"], "Books")
+
+        self.assertEqual(change_log.changes_since(int(rest[-1]["token"]),
+                                                  2), ([], False))
+
+    def test_rolled_back_changes_are_not_logged(self):
+        db_session = session_factory()
+        try:
+            item = Item(name="Gamma", user_id=self.user_id)
+            db_session.add(item)
+            change_log.item_changed(db_session, item, change_log.CREATE)
+            db_session.rollback()
+        finally:
+            db_session.close()
+
+        changes, more = change_log.changes_since(self.start, 10)
+        self.assertNotIn("Gamma", [change["data"]["name"]
+                                   for change in changes])
+
+    def test_private_catalogs_are_left_out(self):
+        other_id = self.make_user("other@example.com", public=False)
+        db_session = session_factory()
+        try:
+            category = Category(name="Hidden", user_id=other_id)
+            db_session.add(category)
+            change_log.category_changed(db_session, category,
+                                        change_log.CREATE)
+            db_session.commit()
+        finally:
+            db_session.close()
+
+        changes, more = change_log.changes_since(self.start, 10)
+        self.assertEqual(set(change["user_id"] for change in changes),
+                         set([self.user_id]))
+        self.assertEqual(change_log.changes_since(self.start, 10, other_id),
+                         ([], False))
+
+    def test_category_rename_logs_only_the_category(self):
+        self.sign_in(self.user_id)
+        token = change_log.latest()
+
+        self.client.post(
+            "/catalog/category/Books/{}/edit".format(self.user_id),
+            data={"csrf-token": "STATE", "fm-name": "Novels"})
+
+        changes, more = change_log.changes_since(token, 10)
+        self.assertEqual([(change["kind"], change["action"],
+                           change["data"]["name"]) for change in changes],
+                         [("category", "update", "Novels")])
+
+        # Item entries name their category by ID
+        items, more = change_log.changes_since(self.start, 10)
+        self.assertEqual(set(change["data"]["category_id"]
+                             for change in items
+                             if change["kind"] == "item"),
+                         set([changes[0]["id"]]))
+
+    def test_category_delete_logs_the_moved_items(self):
+        self.sign_in(self.user_id)
+        token = change_log.latest()
+
+        self.client.post(
+            "/catalog/category/Books/{}/delete".format(self.user_id),
+            data={"csrf-token": "STATE", "fm-yn": "Y"})
+
+        changes, more = change_log.changes_since(token, 10)
+        moved = [change for change in changes if change["kind"] == "item"]
+        self.assertEqual([change["data"]["name"] for change in moved],
+                         ["Alpha", "Beta"])
+        self.assertEqual(set(change["data"]["category"]
+                             for change in moved), set(["Unsorted"]))
+
+    def test_logging_takes_the_lock_row(self):
+        db_session = session_factory()
+        try:
+            writes = db_session.query(ChangeLogLock.writes).scalar()
+            item = Item(name="Gamma", user_id=self.user_id)
+            db_session.add(item)
+            change_log.item_changed(db_session, item, change_log.CREATE)
+            db_session.commit()
+            self.assertEqual(db_session.query(ChangeLogLock.writes).scalar(),
+                             writes + 1)
+        finally:
+            db_session.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+"""Tests for the response compression middleware."""
+
+import json
+import unittest
+import zlib
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+from catalog import compression
+
+TYPES = ["text/html", "application/json", "application/x-ndjson"]
+
+BODY = "<p>" + "catalog " * 200 + "</p>"
+
+
+def gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+def static_app(body=BODY, mimetype="text/html", headers=None):
+    def app(environ, start_response):
+        response = BaseResponse(body, mimetype=mimetype, headers=headers)
+        return response(environ, start_response)
+    return app
+
+
+class CompressionTest(unittest.TestCase):
+
+    def get(self, app, encoding="gzip", **kwargs):
+        middleware = compression.CompressionMiddleware(app, TYPES, **kwargs)
+        headers = {"Accept-Encoding": encoding} if encoding else {}
+        return Client(middleware, BaseResponse).get("/", headers=headers)
+
+    def test_encoding_follows_accept_encoding(self):
+        middleware = compression.CompressionMiddleware(None, TYPES)
+
+        def choose(value):
+            return middleware.choose_encoding({"HTTP_ACCEPT_ENCODING": value})
+
+        self.assertEqual(choose("gzip, deflate"), "gzip")
+        self.assertIsNone(choose("identity"))
+        self.assertIsNone(choose("gzip;q=0"))
+
+        self.addCleanup(setattr, compression, "brotli", compression.brotli)
+        compression.brotli = None
+        self.assertEqual(choose("br, gzip"), "gzip")
+        compression.brotli = object()
+        self.assertEqual(choose("br, gzip"), "br")
+
+    def test_accepted_gzip_compresses_html(self):
+        response = self.get(static_app())
+
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertNotIn("Content-Length", response.headers)
+        self.assertEqual(gunzip(response.data), BODY)
+
+        response = self.get(static_app(), encoding=None)
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.data, BODY)
+
+    def test_small_and_excluded_bodies_are_left_alone(self):
+        for body, app in (
+                ("<p>short</p>", static_app(body="<p>short</p>")),
+                (BODY, static_app(mimetype="image/png")),
+                (BODY, static_app(headers={"Cache-Control":
+                                           "no-transform"})),
+                (BODY, static_app(headers={"Content-Encoding": "gzip"}))):
+            response = self.get(app)
+            self.assertEqual(response.data, body, response.headers)
+            self.assertIn("Content-Length", response.headers)
+
+        response = self.get(static_app(body="<p>short</p>"), min_size=5)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+
+    def test_generator_rows_are_flushed_in_blocks(self):
+        rows = [json.dumps({"table": "items", "id": index,
+                            "name": "Item {}".format(index)}) + "\n"
+                for index in range(5000)]
+        raw = "".join(rows)
+        chunks = []
+
+        def app(environ, start_response):
+            start_response("200 OK",
+                           [("Content-Type", "application/x-ndjson")])
+            return iter(rows)
+
+        middleware = compression.CompressionMiddleware(app, TYPES)
+        environ = {"REQUEST_METHOD": "GET", "HTTP_ACCEPT_ENCODING": "gzip"}
+        for chunk in middleware(environ, lambda *args: None):
+            chunks.append(chunk)
+        body = "".join(chunks)
+
+        self.assertEqual(gunzip(body), raw)
+
+        # Close to compressing the body in one go, and far fewer chunks
+        # than rows
+        one_shot = zlib.compress(raw, 6)
+        self.assertLess(len(body), len(one_shot) * 1.2)
+        self.assertLess(len([chunk for chunk in chunks if chunk]),
+                        len(raw) // (16 * 1024) + 10)
+
+    def test_streamed_body_reaches_the_client_before_it_ends(self):
+        stream = compression.GzipStream(6, flush_size=1024)
+        data = "x" * 600
+
+        self.assertEqual(gunzip(stream.compress(data) + stream.finish()),
+                         data)
+
+        stream = compression.GzipStream(6, flush_size=1024)
+        first = stream.compress(data) + stream.compress(data)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual(decompressor.decompress(first), data * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
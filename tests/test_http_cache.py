@@ -0,0 +1,47 @@
+"""Tests for the HTTP caching policy of public responses."""
+
+import unittest
+from flask import make_response, session
+from catalog import http_cache
+from tests.helpers import AppTestCase
+
+
+class PublicPolicyTest(AppTestCase):
+
+    def test_plain_response_is_public(self):
+        with self.app.test_request_context("/"):
+            response = http_cache.public("page", None, 60)
+        self.assertTrue(response.cache_control.public)
+        self.assertEqual(response.cache_control.max_age, 60)
+
+    def test_response_changing_session_is_private(self):
+        with self.app.test_request_context("/"):
+            session["state"] = "STATE"
+            response = http_cache.public("page", None, 60)
+        self.assertTrue(response.cache_control.private)
+        self.assertFalse(response.cache_control.public)
+
+    def test_response_setting_cookie_is_private(self):
+        with self.app.test_request_context("/"):
+            response = make_response("page")
+            response.set_cookie("other", "value")
+            response = http_cache.public(response, None, 60)
+        self.assertTrue(response.cache_control.private)
+        self.assertIsNone(response.cache_control.max_age)
+
+    def test_public_page_changing_session_is_private(self):
+        user_id = self.make_user()
+        path = "/catalog/tester/{}".format(user_id)
+
+        # The first render flashes a message through the session
+        first = self.client.get(path)
+        self.assertTrue(first.cache_control.private)
+        self.assertFalse(first.cache_control.public)
+
+        second = self.client.get(path)
+        self.assertNotIn("Set-Cookie", second.headers)
+        self.assertTrue(second.cache_control.public)
+
+
+if __name__ == "__main__":
+    unittest.main()
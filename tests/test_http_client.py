@@ -0,0 +1,116 @@
+"""Tests for the pooled provider client against the fake provider."""
+
+import json
+import unittest
+import oauth2 as oauth
+from catalog.login import http_client
+from tests.helpers import AppTestCase
+
+TOKENINFO_URL = "https://www.googleapis.com/oauth2/v1/tokeninfo"
+
+
+class ProviderClientTest(AppTestCase):
+
+    def make_client(self, server, **kwargs):
+        kwargs.setdefault("backoff", 0)
+        client = http_client.ProviderClient(
+            base_urls=dict((provider, server.base_url)
+                           for provider in http_client.PROVIDER_ORIGINS),
+            **kwargs)
+        self.addCleanup(lambda: client.session.close())
+        return client
+
+    def test_urls_are_sent_to_the_configured_origin(self):
+        server = self.start_provider(client_id="app")
+        client = self.make_client(server)
+
+        response = client.get("google", TOKENINFO_URL)
+
+        self.assertEqual(json.loads(response.text)["issued_to"], "app")
+        self.assertEqual(server.requests[0][1], "/oauth2/v1/tokeninfo")
+        self.assertEqual(client.url("facebook", "https://example.com/x"),
+                         "https://example.com/x")
+
+    def test_server_errors_are_retried(self):
+        server = self.start_provider(failures=2)
+        client = self.make_client(server, retries=2)
+
+        response = client.get("google", TOKENINFO_URL)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(client.stats()["google"]["errors"], 0)
+
+    def test_last_server_error_is_returned_and_counted(self):
+        server = self.start_provider(failures=3)
+        client = self.make_client(server, retries=2)
+
+        response = client.get("google", TOKENINFO_URL)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(server.requests), 3)
+        stats = client.stats()["google"]
+        self.assertEqual((stats["calls"], stats["errors"]), (1, 1))
+
+    def test_posts_are_not_retried(self):
+        server = self.start_provider(failures=1)
+        client = self.make_client(server, retries=2)
+
+        response = client.request(
+            "facebook", "POST", "https://graph.facebook.com/v2.9/me")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_timeout_raises_provider_error(self):
+        server = self.start_provider(delay=0.3)
+        client = self.make_client(server, retries=0,
+                                  timeouts={"google": (1, 0.1)})
+
+        with self.assertRaises(http_client.ProviderError) as context:
+            client.get("google", TOKENINFO_URL)
+        self.assertIn("google GET failed", str(context.exception))
+        self.assertEqual(client.stats()["google"]["errors"], 1)
+
+    def test_latency_is_recorded_per_provider(self):
+        server = self.start_provider(delay=0.1)
+        client = self.make_client(server)
+
+        client.get("google", TOKENINFO_URL)
+        client.get("google", TOKENINFO_URL)
+
+        stats = client.stats()
+        self.assertEqual(list(stats), ["google"])
+        self.assertEqual(stats["google"]["calls"], 2)
+        self.assertGreaterEqual(stats["google"]["mean_ms"], 100)
+        self.assertGreaterEqual(stats["google"]["max_ms"],
+                                stats["google"]["mean_ms"])
+
+    def test_oauth_request_signs_through_the_pool(self):
+        server = self.start_provider()
+        self.addCleanup(setattr, http_client, "client", http_client.client)
+        http_client.client = self.make_client(server)
+        consumer = oauth.Consumer(key="key", secret="secret")
+        token = oauth.Token(key="token", secret="token-secret")
+
+        content = http_client.oauth_request(
+            "twitter", consumer, token,
+            "https://api.twitter.com/1.1/account/verify_credentials.json")
+
+        self.assertEqual(json.loads(content)["name"], "Fake Twitter User")
+        method, path, headers = server.requests[0]
+        self.assertEqual(method, "GET")
+        self.assertIn("oauth_signature=", path)
+        self.assertIn("oauth_consumer_key=key", path)
+
+        content = http_client.oauth_request(
+            "twitter", consumer, token,
+            "https://api.twitter.com/oauth/access_token", method="POST",
+            body="oauth_verifier=1234")
+        self.assertIn("oauth_token_secret=secret", content)
+        self.assertEqual(server.requests[1][2]["content-type"],
+                         "application/x-www-form-urlencoded")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""Tests for the item counters and the pages that show them."""
+
+import unittest
+from catalog import catalog_snapshot, item_counts
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Category, Item, User
+from tests.helpers import AppTestCase
+
+
+class ItemCountTest(AppTestCase):
+
+    def setUp(self):
+        super(ItemCountTest, self).setUp()
+        self.user_id = self.make_user()
+        self.sign_in(self.user_id)
+
+        db_session = session_factory()
+        try:
+            unsorted = db_session.query(Category).one()
+            db_session.add(Item(name="Alpha", user_id=self.user_id,
+                                category_id=unsorted.id))
+            item_counts.added(db_session, self.user_id, unsorted.id)
+            db_session.commit()
+        finally:
+            db_session.close()
+
+    def set_counts(self, count):
+        # Changes the columns by hand, as the repair script expects
+        db_session = session_factory()
+        try:
+            db_session.query(User).update({"item_count": count})
+            db_session.query(Category).update({"item_count": count})
+            db_session.commit()
+        finally:
+            db_session.close()
+
+    def counts(self):
+        db_session = session_factory()
+        try:
+            return (db_session.query(User.item_count).scalar(),
+                    db_session.query(Category.item_count).scalar())
+        finally:
+            db_session.close()
+
+    def test_pages_show_the_counter_columns(self):
+        self.set_counts(42)
+
+        snapshot = catalog_snapshot.get(self.user_id)
+        self.assertEqual(catalog_snapshot.item_count(snapshot), 42)
+        self.assertEqual([category["item_count"] for category
+                          in catalog_snapshot.categories(snapshot)], [42])
+
+        response = self.client.get("/catalog/")
+        self.assertIn("Unsorted<span class=\"tag\"> (42)", response.data)
+        self.assertIn("ITM<span class=\"tag\"> (42)", response.data)
+
+    def test_repair_fixes_the_counters_and_reports_owners(self):
+        self.set_counts(42)
+
+        db_session = session_factory()
+        try:
+            fixed = item_counts.recount(db_session)
+            db_session.commit()
+        finally:
+            db_session.close()
+
+        self.assertEqual(fixed, {"users": 1, "categories": 1,
+                                 "user_ids": set([self.user_id])})
+        self.assertEqual(self.counts(), (1, 1))
+
+    def test_delete_item_decrements_the_counters(self):
+        response = self.client.post(
+            "/catalog/item/Alpha/{}/delete".format(self.user_id),
+            data={"csrf-token": "STATE", "fm-yn": "Y"})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.counts(), (0, 0))
+        snapshot = catalog_snapshot.get(self.user_id)
+        self.assertEqual(catalog_snapshot.item_count(snapshot), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
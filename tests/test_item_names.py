@@ -0,0 +1,84 @@
+"""Tests for the uniqueness of item names in each catalog."""
+
+import os
+import unittest
+from StringIO import StringIO
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+from catalog import migrations
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Base, Category, Item
+from tests.helpers import AppTestCase
+
+
+class ItemNameTest(AppTestCase):
+
+    def setUp(self):
+        super(ItemNameTest, self).setUp()
+        self.user_id = self.make_user()
+        self.sign_in(self.user_id)
+
+        db_session = session_factory()
+        try:
+            unsorted = db_session.query(Category).one()
+            for name in ("Alpha", "Beta"):
+                db_session.add(Item(name=name, user_id=self.user_id,
+                                    category_id=unsorted.id))
+            db_session.commit()
+        finally:
+            db_session.close()
+
+    def names(self):
+        db_session = session_factory()
+        try:
+            return sorted(row.name for row in db_session.query(Item.name))
+        finally:
+            db_session.close()
+
+    def test_edit_refuses_a_name_in_use(self):
+        response = self.client.post(
+            "/catalog/item/Beta/{}/edit".format(self.user_id),
+            data={"csrf-token": "STATE", "fm-name": "Alpha",
+                  "fm-description": "", "fm-category": "Unsorted",
+                  "fm-image": (StringIO(""), "")})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.names(), ["Alpha", "Beta"])
+        with self.client.session_transaction() as sess:
+            self.assertIn("That item already exists!",
+                          [message for category, message
+                           in sess["_flashes"]])
+
+    def test_database_refuses_a_duplicate(self):
+        db_session = session_factory()
+        try:
+            db_session.add(Item(name="Alpha", user_id=self.user_id))
+            with self.assertRaises(IntegrityError):
+                db_session.commit()
+        finally:
+            db_session.close()
+
+
+class DuplicateMigrationTest(AppTestCase):
+
+    def test_duplicates_are_renamed_before_the_index(self):
+        engine = create_engine(
+            "sqlite:///" + os.path.join(self.dir, "old.db"))
+        Base.metadata.create_all(bind=engine)
+        engine.execute("DROP INDEX ix_items_user_id_name")
+        for name in ("Alpha", "Alpha", "Beta", "Alpha"):
+            engine.execute(text("INSERT INTO items (name, user_id) "
+                                "VALUES (:name, 1)"), name=name)
+
+        migrations.migrate(engine, Base.metadata)
+
+        names = [row[0] for row in engine.execute(
+            "SELECT name FROM items ORDER BY id")]
+        self.assertEqual(names, ["Alpha", "Alpha (2)", "Beta", "Alpha (4)"])
+        self.assertIn("ix_items_user_id_name",
+                      [index["name"]
+                       for index in inspect(engine).get_indexes("items")])
+
+
+if __name__ == "__main__":
+    unittest.main()
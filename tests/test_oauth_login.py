@@ -0,0 +1,191 @@
+"""Tests for the provider token checks of the OAuth logins."""
+
+import json
+import socket
+import time
+import oauth2client.client
+from catalog.login import http_client, provider_config
+from tests.helpers import AppTestCase, fake_provider
+
+
+class FakeResponse(object):
+
+    def __init__(self, data):
+        self.text = json.dumps(data)
+        self.content = self.text
+
+
+class FakeProvider(object):
+    """Answers provider calls from canned data and records the URLs."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.urls = []
+
+    def get(self, provider, url, **kwargs):
+        self.urls.append(url)
+        for start, data in self.answers.items():
+            if url.startswith(start):
+                return FakeResponse(data)
+        raise AssertionError("Unexpected call to {}".format(url))
+
+    def total_timeout(self, provider):
+        return 1
+
+
+class FakeCredentials(object):
+    access_token = "ACCESS"
+    id_token = {"sub": "G-1"}
+
+
+class FakeFlow(object):
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def step2_exchange(self, code, http=None):
+        return FakeCredentials()
+
+
+class GoogleLoginTest(AppTestCase):
+
+    tokeninfo_url = "https://www.googleapis.com/oauth2/v1/tokeninfo"
+    userinfo_url = "https://www.googleapis.com/oauth2/v1/userinfo"
+
+    def setUp(self):
+        super(GoogleLoginTest, self).setUp()
+
+        flow = oauth2client.client.OAuth2WebServerFlow
+        oauth2client.client.OAuth2WebServerFlow = FakeFlow
+        self.addCleanup(setattr, oauth2client.client,
+                        "OAuth2WebServerFlow", flow)
+
+        self.client_id = provider_config.secrets().google.client_id
+        with self.client.session_transaction() as sess:
+            sess["state"] = "STATE"
+
+    def use_provider(self, tokeninfo):
+        provider = FakeProvider({
+            self.tokeninfo_url: tokeninfo,
+            self.userinfo_url: {"name": "Tester", "picture": None,
+                                "email": "tester@example.com"}})
+        client = http_client.client
+        http_client.client = provider
+        self.addCleanup(setattr, http_client, "client", client)
+        return provider
+
+    def connect(self):
+        return self.client.post("/user/connect_gpl?state=STATE",
+                                data="code")
+
+    def test_token_of_other_client_is_refused_before_userinfo(self):
+        provider = self.use_provider({"user_id": "G-1",
+                                      "issued_to": "other-app"})
+
+        response = self.connect()
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(provider.urls, [
+            self.tokeninfo_url + "?access_token=ACCESS"])
+        with self.client.session_transaction() as sess:
+            self.assertNotIn("access_token", sess)
+            self.assertNotIn("email", sess)
+
+    def test_token_of_other_user_is_refused_before_userinfo(self):
+        provider = self.use_provider({"user_id": "G-2",
+                                      "issued_to": self.client_id})
+
+        response = self.connect()
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(len(provider.urls), 1)
+
+    def test_valid_token_fetches_userinfo(self):
+        provider = self.use_provider({"user_id": "G-1",
+                                      "issued_to": self.client_id})
+
+        response = self.connect()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(provider.urls[-1], self.userinfo_url)
+        with self.client.session_transaction() as sess:
+            self.assertEqual(sess["email"], "tester@example.com")
+
+
+class FacebookLoginTest(AppTestCase):
+
+    delay = 0.2
+
+    def setUp(self):
+        super(FacebookLoginTest, self).setUp()
+        with self.client.session_transaction() as sess:
+            sess["state"] = "STATE"
+
+    def connect(self):
+        return self.client.post("/user/connect_fb?state=STATE",
+                                data="exchange")
+
+    def test_profile_and_picture_are_fetched_together(self):
+        self.start_provider(self.delay)
+
+        start = time.time()
+        response = self.connect()
+        elapsed = time.time() - start
+
+        # The token exchange, then the profile and picture at once
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 3 * self.delay)
+        self.assertGreaterEqual(elapsed, 2 * self.delay)
+        with self.client.session_transaction() as sess:
+            self.assertEqual(sess["username"],
+                             fake_provider.FACEBOOK_USER["name"])
+            self.assertEqual(sess["picture"], "http://localhost/fb.png")
+            self.assertEqual(sess["access_token"], "fb-token")
+        self.assertEqual(http_client.client.stats()["facebook"]["calls"], 3)
+
+    def test_unreachable_provider_answers_504(self):
+        self.app.config["PROVIDER_BASE_URLS"] = {"facebook": closed_url()}
+        self.app.config["PROVIDER_RETRIES"] = 0
+        http_client.init_app(self.app)
+
+        response = self.connect()
+
+        self.assertEqual(response.status_code, 504)
+        with self.client.session_transaction() as sess:
+            self.assertNotIn("access_token", sess)
+
+
+def closed_url():
+    """Returns the URL of a local port nothing listens on."""
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return "http://127.0.0.1:{}".format(port)
+
+
+class GetManyTest(AppTestCase):
+
+    def test_calls_run_concurrently_in_order(self):
+        server = self.start_provider(0.2)
+        calls = [(server.base_url + "/v2.9/me", {}),
+                 (server.base_url + "/v2.9/me/picture", {}),
+                 (server.base_url + "/v2.9/me", {})]
+
+        start = time.time()
+        responses = http_client.client.get_many("facebook", calls)
+
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual([json.loads(response.text).get("id")
+                          for response in responses], ["fb-1", None, "fb-1"])
+
+    def test_a_failed_call_raises_provider_error(self):
+        server = self.start_provider()
+        client = http_client.ProviderClient(retries=0)
+        self.addCleanup(lambda: client.session.close())
+
+        with self.assertRaises(http_client.ProviderError):
+            client.get_many("facebook", [(server.base_url + "/v2.9/me", {}),
+                                         (closed_url() + "/v2.9/me", {})])
+        self.assertEqual(client.stats()["facebook"]["errors"], 1)
@@ -0,0 +1,80 @@
+"""Tests for the keys and lifetimes of cached public pages."""
+
+import time
+import unittest
+from catalog import page_cache
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Category, Item
+from catalog.main.controller import encode_cursor
+from tests.helpers import AppTestCase
+
+
+class PageCacheKeyTest(AppTestCase):
+
+    config = {"CATEGORY_PAGE_SIZE": 2}
+
+    def setUp(self):
+        super(PageCacheKeyTest, self).setUp()
+        self.user_id = self.make_user()
+
+        db_session = session_factory()
+        try:
+            category = Category(name="Books", user_id=self.user_id)
+            db_session.add(category)
+            db_session.flush()
+            for name in ("Alpha", "Beta", "Gamma"):
+                db_session.add(Item(name=name, user_id=self.user_id,
+                                    category_id=category.id))
+            db_session.commit()
+        finally:
+            db_session.close()
+
+    def test_username_in_url_does_not_add_pages(self):
+        for username in ("tester", "someone", "anything-else"):
+            response = self.client.get("/catalog/{}/{}".format(
+                username, self.user_id))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("Now visiting the page of tester", response.data)
+
+        self.assertEqual(len(page_cache.pages), 2)
+
+    def test_only_cursors_of_items_are_cached(self):
+        first = self.client.get("/catalog/Books/{}/".format(self.user_id))
+        self.assertIn("after=", first.data)
+        cached = len(page_cache.pages)
+
+        # A cursor the page linked to is cached once
+        link = first.data.split('href="')
+        link = [part.split('"')[0] for part in link if "after=" in part][0]
+        self.client.get(link.replace("&amp;", "&"))
+        self.assertEqual(len(page_cache.pages), cached + 2)
+
+        # Well-formed cursors of no item are answered, not cached
+        for name in ("Zulu", "Yankee", "Xray"):
+            response = self.client.get("/catalog/Books/{}/?after={}".format(
+                self.user_id, encode_cursor(name, 999)))
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(page_cache.pages), cached + 2)
+
+
+class PageCacheFallbackTest(AppTestCase):
+
+    # Nothing listens there, so every Redis call fails
+    config = {"PAGE_CACHE_REDIS": True, "REDIS_URL": "redis://127.0.0.1:1/0"}
+
+    def test_pages_cached_briefly_without_redis(self):
+        with self.app.app_context():
+            version, shared = page_cache.current_version(1)
+            self.assertFalse(shared)
+
+            page = page_cache.cached(1, "/page", lambda: u"page")
+            self.assertEqual(page, u"page")
+
+        expires = [entry[1] for entry in page_cache.pages._data.values()]
+        self.assertTrue(expires)
+        for value in expires:
+            self.assertLessEqual(value, time.time() + 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
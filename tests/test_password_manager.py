@@ -0,0 +1,86 @@
+"""Tests for the bounded password hashing pool and its busy responses."""
+
+import time
+import unittest
+from catalog.connection_manager import session_factory
+from catalog.db_setup import User
+from catalog.password_manager import PasswordBusy, PasswordHasher, hasher
+from tests.helpers import AppTestCase
+
+
+class PasswordHasherTest(unittest.TestCase):
+
+    def test_busy_pool_gives_up_without_queueing(self):
+        busy = PasswordHasher(rounds=1000, workers=1, timeout=0.05)
+        pool, slots = busy._get_pool()
+        slots.acquire(1)
+
+        started = time.time()
+        with self.assertRaises(PasswordBusy):
+            busy.hash("password12345")
+        self.assertLess(time.time() - started, 1)
+
+        # Nothing was left in the pool to run later
+        slots.release()
+        self.assertEqual(slots.free, 1)
+        self.assertTrue(busy.verify("password12345",
+                                    busy.hash("password12345")))
+        self.assertEqual(slots.free, 1)
+
+
+class PasswordBusyViewTest(AppTestCase):
+
+    config = {"PASSWORD_WORKERS": 1, "PASSWORD_TIMEOUT": 0.05}
+
+    def hold_worker(self):
+        pool, slots = hasher._get_pool()
+        slots.acquire(1)
+        self.addCleanup(slots.release)
+
+    def test_signup_answers_503(self):
+        with self.client.session_transaction() as sess:
+            sess["state"] = "STATE"
+        self.hold_worker()
+
+        response = self.client.post("/user/signup", data={
+            "csrf-token": "STATE", "fm_username": "tester_one",
+            "fm_email": "a@example.com", "fm_email_cnf": "a@example.com",
+            "fm_passd": "password12345", "fm_passd_cnf": "password12345"})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Signup is busy", response.data)
+        db_session = session_factory()
+        try:
+            self.assertEqual(db_session.query(User).count(), 0)
+        finally:
+            db_session.close()
+
+    def test_password_change_answers_503(self):
+        user_id = self.make_user(password="password12345")
+        db_session = session_factory()
+        try:
+            old_hash = db_session.query(User).get(user_id).password_hash
+        finally:
+            db_session.close()
+        self.sign_in(user_id)
+        self.hold_worker()
+
+        response = self.client.post("/user/settings", data={
+            "csrf-token": "STATE", "fm_username": "renamed_user",
+            "fm_email": "", "fm_email_cnf": "",
+            "fm_passd": "password67890", "fm_passd_cnf": "password67890",
+            "fm-yn": "Y"})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Settings are busy", response.data)
+        db_session = session_factory()
+        try:
+            user = db_session.query(User).get(user_id)
+            self.assertEqual(user.username, "tester")
+            self.assertEqual(user.password_hash, old_hash)
+        finally:
+            db_session.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+"""Tests for the background queue of OAuth token revocations."""
+
+import unittest
+from datetime import datetime, timedelta
+from catalog.connection_manager import DBSession, session_factory
+from catalog.db_setup import Category, Revocation
+from catalog.login import revocation
+from tests.helpers import AppTestCase
+
+
+class FakeWorker(object):
+
+    def __init__(self):
+        self.jobs = []
+
+    def put(self, job):
+        self.jobs.append(job)
+
+
+class RevocationTest(AppTestCase):
+
+    def setUp(self):
+        super(RevocationTest, self).setUp()
+        self.worker = FakeWorker()
+        self.addCleanup(setattr, revocation, "worker", revocation.worker)
+        revocation.worker = self.worker
+
+        self.sent = []
+        self.failures = 0
+        self.addCleanup(revocation.REVOKERS.update, dict(revocation.REVOKERS))
+        self.addCleanup(revocation.settings.update, dict(revocation.settings))
+        revocation.REVOKERS["google"] = self.revoke
+
+    def revoke(self, access_token, provider_user_id):
+        self.sent.append(access_token)
+        if self.failures:
+            self.failures -= 1
+            raise revocation.RevokeFailed("Google answered 500")
+
+    def rows(self):
+        db_session = session_factory()
+        try:
+            return db_session.query(Revocation).all()
+        finally:
+            db_session.close()
+
+    def make_due(self):
+        db_session = session_factory()
+        try:
+            db_session.query(Revocation).update(
+                {"next_attempt": datetime.utcnow()})
+            db_session.commit()
+        finally:
+            db_session.close()
+
+    def test_enqueue_leaves_the_request_session_alone(self):
+        with self.app.test_request_context():
+            DBSession.add(Category(name="Pending", user_id=1))
+            revocation.enqueue("google", "token-1")
+            DBSession.rollback()
+
+        self.assertEqual([row.access_token for row in self.rows()],
+                         ["token-1"])
+        self.assertEqual(self.worker.jobs, [None])
+        db_session = session_factory()
+        try:
+            self.assertEqual(db_session.query(Category).count(), 0)
+        finally:
+            db_session.close()
+
+    def test_sent_revocations_are_removed(self):
+        revocation.enqueue("google", "token-1")
+
+        self.assertEqual(revocation.process_due(), 1)
+        self.assertEqual(self.sent, ["token-1"])
+        self.assertEqual(self.rows(), [])
+
+    def test_failures_back_off_then_give_up(self):
+        revocation.settings["max_attempts"] = 3
+        revocation.enqueue("google", "token-1")
+        self.failures = 3
+
+        before = datetime.utcnow()
+        revocation.process_due()
+        row = self.rows()[0]
+        self.assertEqual(row.attempts, 1)
+        self.assertEqual(row.last_error, "Google answered 500")
+        self.assertGreaterEqual(row.next_attempt,
+                                before + timedelta(seconds=30))
+
+        # Not due yet
+        self.assertEqual(revocation.process_due(), 0)
+
+        self.make_due()
+        revocation.process_due()
+        row = self.rows()[0]
+        self.assertEqual(row.attempts, 2)
+        self.assertGreaterEqual(row.next_attempt,
+                                before + timedelta(seconds=60))
+
+        self.make_due()
+        revocation.process_due()
+        self.assertEqual(self.rows(), [])
+        self.assertEqual(len(self.sent), 3)
+
+    def test_a_row_is_claimed_by_one_worker(self):
+        revocation.enqueue("google", "token-1")
+        now = datetime.utcnow()
+
+        first = session_factory()
+        second = session_factory()
+        try:
+            # Both workers read the row while it is due
+            seen = second.query(Revocation.id, Revocation.next_attempt).all()
+            self.assertEqual(len(revocation.claim_due(first, now)), 1)
+
+            updated = (second.query(Revocation)
+                       .filter(Revocation.id == seen[0].id,
+                               Revocation.next_attempt ==
+                               seen[0].next_attempt)
+                       .update({"next_attempt": now},
+                               synchronize_session=False))
+            self.assertEqual(updated, 0)
+            self.assertEqual(revocation.claim_due(second, now), [])
+        finally:
+            first.close()
+            second.close()
+
+        # The claim holds the row until its lease runs out
+        self.assertEqual(revocation.process_due(), 0)
+        self.assertEqual(self.sent, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+"""Tests for session ID rotation, expiry and revocation."""
+
+import time
+import unittest
+from catalog.connection_manager import DBSession
+from tests.helpers import AppTestCase
+
+
+class SessionStoreTest(AppTestCase):
+
+    def setUp(self):
+        super(SessionStoreTest, self).setUp()
+        self.interface = self.app.session_interface
+        self.backend = self.interface.backend
+
+    def sid(self, client=None):
+        """Returns the session ID in a test client's cookie."""
+
+        client = client or self.client
+        signer = self.interface.get_signer(self.app)
+        for cookie in client.cookie_jar:
+            if cookie.name == self.app.session_cookie_name:
+                return signer.unsign(cookie.value).split("-", 1)[0]
+        return None
+
+    def expires(self, sid):
+        return self.backend._connect().execute(
+            "SELECT expires FROM sessions WHERE sid = ?", (sid,)).fetchone()
+
+    def log_in(self):
+        return self.client.post("/user/login", data={
+            "csrf-token": "STATE", "fm_email": "tester@example.com",
+            "fm_passd": "password12345"})
+
+    def test_login_moves_session_to_new_id(self):
+        user_id = self.make_user(password="password12345")
+        with self.client.session_transaction() as sess:
+            sess["state"] = "STATE"
+        planted = self.sid()
+
+        self.log_in()
+
+        self.assertNotEqual(self.sid(), planted)
+        self.assertIsNone(self.backend.load(planted))
+        self.assertEqual(list(self.backend.sids_for_user(user_id)),
+                         [self.sid()])
+
+    def test_logout_moves_session_to_new_id(self):
+        user_id = self.make_user()
+        self.sign_in(user_id)
+        signed_in = self.sid()
+
+        self.client.get("/user/disconnect")
+
+        self.assertIsNone(self.backend.load(signed_in))
+        self.assertNotEqual(self.sid(), signed_in)
+        with self.client.session_transaction() as sess:
+            self.assertNotIn("user_id", sess)
+
+    def test_anonymous_sessions_expire_early(self):
+        with self.client.session_transaction() as sess:
+            sess["state"] = "STATE"
+        anonymous = self.expires(self.sid())[0]
+
+        self.make_user(password="password12345")
+        self.log_in()
+        signed_in = self.expires(self.sid())[0]
+
+        self.assertLessEqual(anonymous, time.time() + 3600)
+        lifetime = self.app.permanent_session_lifetime.total_seconds()
+        self.assertGreater(signed_in, time.time() + lifetime - 60)
+
+    def change_password(self):
+        return self.client.post("/user/settings", data={
+            "csrf-token": "STATE", "fm_username": "",
+            "fm_email": "", "fm_email_cnf": "",
+            "fm_passd": "password67890", "fm_passd_cnf": "password67890",
+            "fm-yn": "Y"})
+
+    def test_password_change_signs_out_other_sessions(self):
+        user_id = self.make_user(password="password12345")
+        other = self.app.test_client()
+        with other.session_transaction() as sess:
+            sess["user_id"] = user_id
+        self.sign_in(user_id)
+
+        self.change_password()
+
+        self.assertIsNone(self.backend.load(self.sid(other)))
+        self.assertIsNotNone(self.backend.load(self.sid()))
+
+    def test_failed_password_change_keeps_other_sessions(self):
+        user_id = self.make_user(password="password12345")
+        other = self.app.test_client()
+        with other.session_transaction() as sess:
+            sess["user_id"] = user_id
+        self.sign_in(user_id)
+
+        def fail():
+            raise RuntimeError("commit failed")
+        DBSession.commit = fail
+        self.addCleanup(delattr, DBSession, "commit")
+
+        with self.assertRaises(RuntimeError):
+            self.change_password()
+        self.assertIsNotNone(self.backend.load(self.sid(other)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+"""Tests for the signed API tokens and their cache."""
+
+import base64
+import json
+import unittest
+from catalog import db_setup, token_manager
+from catalog.connection_manager import session_factory
+from catalog.db_setup import User
+from tests.helpers import AppTestCase
+
+
+class TokenTest(AppTestCase):
+
+    def setUp(self):
+        super(TokenTest, self).setUp()
+        self.user_id = self.make_user(password="secret")
+        self.addCleanup(token_manager.settings.update,
+                        dict(token_manager.settings))
+        token_manager.verified.clear()
+
+    def issue(self):
+        db_session = session_factory()
+        try:
+            return token_manager.issue(db_session.query(User).get(
+                self.user_id))
+        finally:
+            db_session.close()
+
+    def use_key(self, key):
+        for module in (db_setup, token_manager):
+            self.addCleanup(setattr, module, "secret_key", module.secret_key)
+            module.secret_key = key
+
+    def get_token(self, username, password=""):
+        credentials = base64.b64encode("{}:{}".format(username, password))
+        return self.client.get(
+            "/catalog/api/1.0/token",
+            headers={"Authorization": "Basic " + credentials})
+
+    def test_issued_token_verifies_to_its_user(self):
+        token = self.issue()
+
+        self.assertEqual(token_manager.verify(token), self.user_id)
+        self.assertIsNone(token_manager.verify(token[:-2] + "xx"))
+        self.assertIsNone(token_manager.verify("not a token"))
+
+    def test_password_is_traded_for_a_token(self):
+        response = self.get_token("tester@example.com", "secret")
+        self.assertEqual(response.status_code, 200)
+        token = json.loads(response.data)["token"]
+
+        # A token signs in, but is not traded for another one
+        self.assertEqual(self.get_token(token).status_code, 403)
+        self.assertEqual(self.get_token("bad-token").status_code, 401)
+
+    def test_expired_token_is_refused(self):
+        token_manager.settings["expiration"] = -1
+
+        self.assertIsNone(token_manager.verify(self.issue()))
+        self.assertEqual(len(token_manager.verified), 0)
+
+    def test_cached_token_skips_the_signature_check(self):
+        token = self.issue()
+        token_manager.verify(token)
+        hits = token_manager.verified.hits
+
+        def fail(*args, **kwargs):
+            raise AssertionError("Signature checked again")
+
+        self.addCleanup(setattr, token_manager, "Serializer",
+                        token_manager.Serializer)
+        token_manager.Serializer = fail
+
+        self.assertEqual(token_manager.verify(token), self.user_id)
+        self.assertEqual(token_manager.verified.hits, hits + 1)
+
+    def test_new_secret_key_refuses_old_tokens(self):
+        token = self.issue()
+        self.assertEqual(token_manager.verify(token), self.user_id)
+
+        self.use_key("another key")
+
+        self.assertIsNone(token_manager.verify(token))
+        self.assertEqual(token_manager.verify(self.issue()), self.user_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
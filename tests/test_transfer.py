@@ -0,0 +1,96 @@
+"""Tests for resuming interrupted catalog imports."""
+
+import json
+import unittest
+from catalog import transfer
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Category, Item, User
+from tests.helpers import AppTestCase
+
+
+def ndjson(rows):
+    return [json.dumps(row) + "\n" for row in rows]
+
+
+# An export of one user, their two categories and five items
+EXPORT = ndjson(
+    [{"table": "users", "id": 7, "username": "importer",
+      "email": "importer@example.com", "public": True},
+     {"table": "categories", "id": 1, "name": "Unsorted", "user_id": 7},
+     {"table": "categories", "id": 2, "name": "Books", "user_id": 7}] +
+    [{"table": "items", "id": index, "name": "Item {}".format(index),
+      "category_name": "Books", "user_id": 7}
+     for index in range(5)])
+
+
+class Interrupted(Exception):
+    pass
+
+
+class ImporterResumeTest(AppTestCase):
+
+    def counts(self):
+        db_session = session_factory()
+        try:
+            return (db_session.query(User).count(),
+                    db_session.query(Category).count(),
+                    db_session.query(Item).count())
+        finally:
+            db_session.close()
+
+    def test_resume_from_checkpoint(self):
+        checkpoints = []
+
+        def on_commit(importer):
+            checkpoints.append((importer.position, dict(importer.users)))
+            if len(checkpoints) == 2:
+                raise Interrupted()
+
+        first = transfer.Importer(batch_size=3, on_commit=on_commit)
+        with self.assertRaises(Interrupted):
+            first.run(transfer.read_ndjson(EXPORT))
+
+        position, users = checkpoints[-1]
+        self.assertEqual(position, 6)
+        self.assertEqual(self.counts(), (1, 2, 3))
+
+        # The checkpoint is saved as JSON, which turns the keys to text
+        users = json.loads(json.dumps(users))
+        second = transfer.Importer(batch_size=3, skip=position,
+                                   users=users).run(
+                                       transfer.read_ndjson(EXPORT))
+
+        self.assertEqual(second.report["position"], len(EXPORT))
+        self.assertEqual(second.applied, 2)
+        self.assertEqual(second.failed, 0)
+        self.assertEqual(self.counts(), (1, 2, 5))
+
+        db_session = session_factory()
+        try:
+            user = db_session.query(User).one()
+            self.assertEqual(user.item_count, 5)
+            books = db_session.query(Category).filter_by(name="Books").one()
+            self.assertEqual(books.item_count, 5)
+        finally:
+            db_session.close()
+
+    def test_importing_again_changes_nothing(self):
+        transfer.Importer().run(transfer.read_ndjson(EXPORT))
+        again = transfer.Importer().run(transfer.read_ndjson(EXPORT))
+
+        self.assertEqual(again.failed, 0)
+        self.assertEqual(self.counts(), (1, 2, 5))
+
+    def test_bad_line_keeps_the_records_before_it(self):
+        lines = EXPORT[:4] + ["not json\n"] + EXPORT[4:]
+        importer = transfer.Importer(batch_size=100)
+
+        with self.assertRaises(transfer.TransferError):
+            importer.run(transfer.read_ndjson(lines))
+
+        self.assertEqual(importer.position, 4)
+        self.assertEqual(self.counts(), (1, 2, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
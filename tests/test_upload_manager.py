@@ -0,0 +1,187 @@
+"""Tests for streamed image uploads."""
+
+import fcntl
+import hashlib
+import os
+import struct
+import unittest
+from StringIO import StringIO
+from werkzeug.datastructures import FileStorage
+from catalog import upload_manager
+from catalog.connection_manager import session_factory
+from catalog.db_setup import Category
+from tests.helpers import AppTestCase
+
+
+def png(width, height):
+    ihdr = struct.pack(">II", width, height) + b"\x08\x02\x00\x00\x00"
+    return (upload_manager.PNG_MAGIC + struct.pack(">I", len(ihdr)) +
+            b"IHDR" + ihdr + b"\x00" * 4 + b"IDAT data")
+
+
+def jpeg(width, height):
+    app0 = b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    sof0 = b"\x08" + struct.pack(">HH", height, width) + b"\x03" + b"\x00" * 9
+    return (b"\xff\xd8" +
+            b"\xff\xe0" + struct.pack(">H", len(app0) + 2) + app0 +
+            b"\xff\xff\xc0" + struct.pack(">H", len(sof0) + 2) + sof0 +
+            b"\xff\xda scan data")
+
+
+class UploadStreamTest(AppTestCase):
+
+    def stream(self, data, chunk_size=5):
+        stream = upload_manager.UploadStream(self.dir)
+        self.addCleanup(stream.close)
+        for start in range(0, len(data), chunk_size):
+            stream.write(data[start:start + chunk_size])
+        return stream
+
+    def test_png_header_is_read_from_chunks(self):
+        data = png(640, 480)
+        stream = self.stream(data)
+
+        self.assertEqual(stream.kind, "png")
+        self.assertEqual(stream.dimensions(), (640, 480))
+        self.assertEqual(stream.size, len(data))
+        self.assertEqual(stream.digest, hashlib.sha1(data).hexdigest())
+        stream.validate(4096)
+
+    def test_jpeg_frame_is_found_past_other_segments(self):
+        stream = self.stream(jpeg(800, 600))
+
+        self.assertEqual(stream.kind, "jpeg")
+        self.assertEqual(stream.dimensions(), (800, 600))
+        stream.validate(4096)
+
+    def test_oversized_image_is_refused(self):
+        for data in (png(5000, 10), jpeg(10, 5000)):
+            with self.assertRaises(upload_manager.UploadError) as context:
+                self.stream(data).validate(4096)
+            self.assertIn("4096x4096", str(context.exception))
+
+    def test_truncated_header_is_refused(self):
+        for data in (png(640, 480)[:20], jpeg(800, 600)[:27]):
+            with self.assertRaises(upload_manager.UploadError) as context:
+                self.stream(data).validate(4096)
+            self.assertIn("dimensions", str(context.exception))
+
+    def test_non_image_is_refused(self):
+        with self.assertRaises(upload_manager.UploadError) as context:
+            self.stream(b"GIF89a not accepted").validate(4096)
+        self.assertIn("PNG and JPEG", str(context.exception))
+
+    def test_commit_moves_the_file_and_close_discards_it(self):
+        kept = self.stream(png(1, 1))
+        target = os.path.join(self.dir, "kept.png")
+        kept.commit(target)
+        kept.close()
+        self.assertTrue(os.path.exists(target))
+        self.assertFalse(os.path.exists(kept.path))
+
+        dropped = self.stream(png(1, 1))
+        dropped.close()
+        self.assertFalse(os.path.exists(dropped.path))
+
+    def test_content_name_follows_the_content(self):
+        data = jpeg(800, 600)
+        name = hashlib.sha1(data).hexdigest()
+
+        streamed = FileStorage(self.stream(data), filename="photo.JPEG")
+        self.assertEqual(upload_manager.content_name(streamed),
+                         name + ".jpg")
+
+        # Uploads that were not streamed are hashed from their file
+        buffered = FileStorage(StringIO(data), filename="photo.JPEG")
+        self.assertEqual(upload_manager.content_name(buffered),
+                         name + ".jpeg")
+        self.assertEqual(buffered.stream.read(), data)
+
+
+
+class FakeWorker(object):
+
+    def __init__(self):
+        self.jobs = []
+
+    def put(self, job):
+        self.jobs.append(job)
+
+
+class DeferredRemovalTest(AppTestCase):
+
+    def setUp(self):
+        super(DeferredRemovalTest, self).setUp()
+        self.deleter = FakeWorker()
+        self.addCleanup(setattr, upload_manager, "deleter",
+                        upload_manager.deleter)
+        upload_manager.deleter = self.deleter
+
+        self.upload_dir = self.app.config["UPLOAD_FOLDER"]
+        os.makedirs(os.path.join(self.upload_dir, "1"))
+
+    def run_transaction(self, commit):
+        db_session = session_factory()
+        try:
+            db_session.add(Category(name="Books", user_id=1))
+            upload_manager.delete_after_commit(db_session, "old.png")
+            upload_manager.discard_on_rollback(db_session, "new.png")
+            if commit:
+                db_session.commit()
+            else:
+                db_session.rollback()
+        finally:
+            db_session.close()
+
+    def add_file(self, name, age):
+        path = os.path.join(self.upload_dir, "1", name)
+        with open(path, "wb") as image:
+            image.write(png(1, 1))
+        mtime = os.path.getmtime(path) - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_commit_deletes_the_replaced_file(self):
+        self.run_transaction(commit=True)
+
+        self.assertEqual(self.deleter.jobs, ["old.png"])
+
+    def test_rollback_discards_the_new_file(self):
+        self.run_transaction(commit=False)
+
+        self.assertEqual(self.deleter.jobs, ["new.png"])
+
+    def test_sweep_removes_old_orphans(self):
+        orphan = self.add_file("orphan.png", age=3600)
+        fresh = self.add_file("fresh.png", age=0)
+
+        removed, reclaimed = upload_manager.sweep_once(
+            self.upload_dir, 600, 3600)
+
+        self.assertEqual((removed, reclaimed), (1, len(png(1, 1))))
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(fresh))
+
+        # Swept too recently for another turn
+        self.add_file("orphan.png", age=3600)
+        self.assertIsNone(upload_manager.sweep_once(
+            self.upload_dir, 600, 3600))
+
+    def test_locked_sweep_is_skipped(self):
+        orphan = self.add_file("orphan.png", age=3600)
+
+        # Another process holds the lock while it sweeps
+        with open(os.path.join(self.upload_dir, ".sweep"), "a+") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.assertIsNone(upload_manager.sweep_once(
+                self.upload_dir, 600, 3600))
+            self.assertTrue(os.path.exists(orphan))
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+        self.assertIsNotNone(upload_manager.sweep_once(
+            self.upload_dir, 600, 3600))
+        self.assertFalse(os.path.exists(orphan))
+
+
+if __name__ == "__main__":
+    unittest.main()
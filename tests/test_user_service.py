@@ -0,0 +1,86 @@
+"""Tests for the cached lookups of user records."""
+
+import unittest
+from catalog import user_service
+from catalog.cache import MISSING
+from catalog.connection_manager import session_factory
+from catalog.db_setup import User
+from tests.helpers import AppTestCase
+
+
+class UserServiceTest(AppTestCase):
+
+    def setUp(self):
+        super(UserServiceTest, self).setUp()
+        self.user_id = self.make_user()
+        self.addCleanup(user_service.settings.update,
+                        dict(user_service.settings))
+
+    def update_user(self, **values):
+        # Written behind the service's back, as another process would
+        db_session = session_factory()
+        try:
+            db_session.query(User).filter_by(id=self.user_id).update(values)
+            db_session.commit()
+        finally:
+            db_session.close()
+
+    def test_lookups_are_memoized_then_cached(self):
+        with self.app.app_context():
+            user = user_service.get_user(self.user_id)
+            self.update_user(username="renamed")
+            self.assertIs(user_service.get_user(self.user_id), user)
+            self.assertIs(user_service.get_user_by_email(user.email), user)
+
+        # A later request is served from the LRU cache
+        with self.app.app_context():
+            self.assertEqual(user_service.get_user(self.user_id).username,
+                             "tester")
+
+    def test_invalidate_drops_the_memo_and_the_cache(self):
+        with self.app.app_context():
+            user_service.get_user(self.user_id)
+            self.update_user(username="renamed")
+
+            user_service.invalidate(self.user_id)
+
+            for key in (("id", self.user_id), ("email", "tester@example.com")):
+                self.assertIs(user_service.cache.get(key), MISSING)
+            self.assertEqual(user_service.get_user(self.user_id).username,
+                             "renamed")
+
+        with self.app.app_context():
+            self.assertEqual(user_service.get_user(self.user_id).username,
+                             "renamed")
+
+    def test_invalidate_drops_the_old_and_new_email(self):
+        with self.app.app_context():
+            user_service.get_user_by_email("tester@example.com")
+            self.assertIsNone(
+                user_service.get_user_by_email("new@example.com"))
+            self.update_user(email="new@example.com")
+
+            user_service.invalidate(self.user_id, "new@example.com")
+
+            self.assertIsNone(
+                user_service.get_user_by_email("tester@example.com"))
+            self.assertEqual(
+                user_service.get_user_by_email("new@example.com").id,
+                self.user_id)
+
+    def test_zero_ttl_keeps_only_the_memo(self):
+        user_service.settings["ttl"] = 0
+
+        with self.app.app_context():
+            user = user_service.get_user(self.user_id)
+            self.assertIs(user_service.get_user(self.user_id), user)
+        self.assertEqual(len(user_service.cache), 0)
+
+        self.update_user(username="renamed")
+        with self.app.app_context():
+            self.assertEqual(user_service.get_user(self.user_id).username,
+                             "renamed")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,15 @@
+"""
+WSGI entry point of the catalog application. From the application
+directory, serve it with a pre-fork server such as gunicorn:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app can be created once in the master process (gunicorn's `preload`)
+so workers fork with templates and settings already loaded. Database and
+Redis connections are opened by each worker on first use.
+
+"""
+
+from catalog import create_app
+
+app = application = create_app()